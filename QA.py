@@ -3,7 +3,14 @@ QA Benchmark - Бенчмарк по файлу gobench.md
 Запускает тестирование LLM на 17 вопросах о Транснефть
 """
 
+import os
 import re
+import argparse
+import json
+import queue
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 import sys
@@ -13,13 +20,64 @@ sys.path.insert(0, str(Path(__file__).parent))
 
 from main import ThinkingLLM, LLMConfig
 
+# Заголовок вопроса: строка вида **номер. текст** (компилируется один раз)
+_HEADER_RE = re.compile(r'^\*\*(\d+)\.\s+(.*?)(?:\*\*)?\s*$')
+
+# Размер буфера записи лог-файла (байт)
+LOG_BUFFER_SIZE = 1 << 16
+
+# Служебные сообщения потоку записи лога
+_LOG_FLUSH = object()
+_LOG_STOP = object()
+
+# Строки, начинающие другой блок разметки (требования, раздел, разделитель)
+_BLOCK_PREFIXES = ('**', '#', '---')
+
+# База знаний, входящая в системный промпт (учитывается в ключе кэша)
+KNOWLEDGE_BASE_FILE = Path(__file__).parent / "PROMT.md"
+
+# Модель рабочего процесса (по одной копии на процесс при workers > 1)
+_worker_llm = None
+
+
+def _init_worker(model_path: str):
+    """Инициализатор рабочего процесса: загрузка собственной копии модели"""
+    global _worker_llm
+    _worker_llm = ThinkingLLM(LLMConfig(model_path))
+
+
+def _generate_in_worker(prompt: str, include_thinking: bool) -> dict:
+    """Генерация ответа в рабочем процессе"""
+    return _worker_llm.generate_batch([prompt], include_thinking=include_thinking)[0]
+
 
 class QABenchmark:
     """Класс для запуска бенчмарка по gobench.md"""
     
-    def __init__(self, questions_file: str = "gobench.md", log_file: str = None):
+    # Разделители и шаблоны лога (собираются один раз)
+    EQ80 = "=" * 80
+    DASH80 = "─" * 80
+    DASH80_LINE = DASH80 + "\n"
+    HEADER_TMPL = f"\n{EQ80}\n📋 ВОПРОС {{num}}/{{total}}\n{EQ80}\n"
+    
+    def __init__(self, questions_file: str = "gobench.md", log_file: str = None,
+                 cache_file: str = "qa_benchmark_cache.json", workers: int = 1,
+                 max_batch: int = 8, log_thinking: bool = False):
         self.questions_file = questions_file
         
+        # Записывать ли размышления модели в лог (самая объёмная часть вывода)
+        self.log_thinking = log_thinking
+        
+        # Размер пачки промптов для generate_batch
+        self.max_batch = max(1, max_batch)
+        
+        # Количество процессов с отдельной копией модели (нужна память на K копий)
+        self.workers = max(1, workers)
+        
+        # Кэш ответов между запусками (используется только при temperature == 0)
+        self.cache_file = cache_file
+        self._cache = None
+        
         # Генерация имени лог-файла с датой и временем
         if log_file is None:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -27,14 +85,31 @@ class QABenchmark:
         else:
             self.log_file = log_file
         
-        # Инициализация LLM (используется PROMPT.md автоматически)
-        print("🤖 Инициализация LLM...")
-        config = LLMConfig()
-        self.llm = ThinkingLLM(config)
+        # Чекпоинт прогона: номер вопроса -> ответ (для продолжения после сбоя)
+        self.checkpoint_file = str(Path(self.log_file).with_suffix('.ckpt.json'))
+        
+        # Дескриптор лог-файла (открывается один раз при первой записи,
+        # блочная буферизация, сброс на диск на границе вопросов).
+        # Запись выполняет отдельный поток, чтобы не тормозить генерацию
+        self._log_fp = None
+        self._log_q = None
+        self._log_thread = None
         
-        # Требования к ответам (будут добавлены к каждому вопросу)
-        self.requirements = """
-**Требования к ответам:**
+        # Инициализация LLM (используется PROMPT.md автоматически).
+        # При workers > 1 модели загружаются в рабочих процессах
+        self.config = LLMConfig()
+        self.llm = None
+        if self.workers == 1:
+            print("🤖 Инициализация LLM...")
+            self.llm = ThinkingLLM(self.config)
+        else:
+            print(f"🤖 LLM будет загружена в {self.workers} рабочих процессах")
+        self._knowledge_base_digest = None
+        
+        # Требования к ответам - общий неизменный префикс каждого вопроса.
+        # Стоит в начале промпта, чтобы llama.cpp переиспользовал KV кэш
+        # (системный промпт + требования) между вопросами
+        self.requirements = """**Требования к ответам:**
 - Максимальная детализация, точные ссылки на год, нормативный документ, цифры (километры, мегатонны, количество, адреса и реквизиты)
 - Для вопросов расчётных — вывести формулы и рассуждения
 - Если ответ невозможен — чётко указать, что информации нет (где нет — ясно обозначить пропуск)
@@ -46,36 +121,42 @@ class QABenchmark:
     def parse_questions(self) -> list[dict]:
         """Парсинг вопросов из gobench.md"""
         try:
+            # Линейный проход по строкам файла (без чтения целиком в память):
+            # заголовок **номер.** открывает вопрос, последующие строки (подпункты)
+            # добавляются к нему, а любой другой блок разметки
+            # (## раздел, ---, **Требования**) его закрывает
+            questions = []
+            seen = set()
+            question_num = None
+            body_lines = []
+            
             with open(self.questions_file, 'r', encoding='utf-8') as f:
-                content = f.read()
+                for line in f:
+                    line = line.rstrip('\n')
+                    header = _HEADER_RE.match(line)
+                    if header:
+                        if question_num is not None:
+                            questions.append(self._make_question(question_num, body_lines))
+                        question_num = header.group(1)
+                        seen.add(int(question_num))
+                        body_lines = [header.group(2)]
+                    elif question_num is not None:
+                        if line.startswith(_BLOCK_PREFIXES):
+                            questions.append(self._make_question(question_num, body_lines))
+                            question_num = None
+                        else:
+                            body_lines.append(line)
             
-            # Улучшенный паттерн для парсинга вопросов
-            # Находим все вопросы (начинаются с **номер.**)
-            pattern = r'\*\*(\d+)\.\s+([^\*]+(?:\n(?!\*\*\d+\.)[^\*]*)*)'
-            matches = re.finditer(pattern, content, re.MULTILINE)
-            
-            questions = []
-            for match in matches:
-                question_num = match.group(1)
-                question_text = match.group(2).strip()
-                
-                # Формируем полный вопрос с номером
-                full_question = f"**Вопрос {question_num}:**\n{question_text}\n\n{self.requirements}"
-                questions.append({
-                    'number': question_num,
-                    'text': question_text,
-                    'full': full_question
-                })
+            if question_num is not None:
+                questions.append(self._make_question(question_num, body_lines))
             
             # Валидация: должно быть ровно 17 вопросов
             if len(questions) != 17:
                 print(f"⚠️ ВНИМАНИЕ: Найдено {len(questions)} вопросов вместо ожидаемых 17!")
-                print(f"Номера найденных вопросов: {[q['number'] for q in questions]}")
+                print(f"Номера найденных вопросов: {sorted(seen)}")
                 
                 # Проверяем какие вопросы отсутствуют
-                found_nums = set(int(q['number']) for q in questions)
-                expected_nums = set(range(1, 18))
-                missing = expected_nums - found_nums
+                missing = set(range(1, 18)) - seen
                 
                 if missing:
                     print(f"❌ Отсутствующие вопросы: {sorted(missing)}")
@@ -91,13 +172,222 @@ class QABenchmark:
             print(f"❌ Ошибка парсинга: {e}")
             return []
     
+    def _make_question(self, question_num: str, body_lines: list[str]) -> dict:
+        """Сборка словаря вопроса из номера и строк текста"""
+        return {
+            'number': question_num,
+            'text': "\n".join(body_lines).strip()
+        }
+    
+    def build_prompt(self, question: dict) -> str:
+        """Полный промпт вопроса: общий префикс требований, затем уникальный хвост"""
+        return f"{self.requirements}\n**Вопрос {question['number']}:**\n{question['text']}"
+    
     def log_message(self, message: str, console: bool = True):
         """Логирование сообщения в файл и консоль"""
         if console:
             print(message)
         
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(message + '\n')
+        if self._log_q is None:
+            self._start_log_writer()
+        
+        self._log_q.put(message + '\n')
+    
+    def _start_log_writer(self):
+        """Открытие лог-файла и запуск потока записи"""
+        self._log_fp = open(self.log_file, 'a', encoding='utf-8', buffering=LOG_BUFFER_SIZE)
+        self._log_q = queue.Queue()
+        self._log_thread = threading.Thread(target=self._log_worker, daemon=True)
+        self._log_thread.start()
+    
+    def _log_worker(self):
+        """Поток записи: забирает сообщения из очереди и пишет их в файл"""
+        while True:
+            item = self._log_q.get()
+            if item is _LOG_STOP:
+                break
+            try:
+                if item is _LOG_FLUSH:
+                    self._log_fp.flush()
+                else:
+                    self._log_fp.write(item)
+            except OSError as e:
+                print(f"⚠️ Ошибка записи в лог: {e}")
+    
+    def flush_log(self):
+        """Сброс накопленного буфера лога на диск"""
+        if self._log_q is not None:
+            self._log_q.put(_LOG_FLUSH)
+    
+    def close(self):
+        """Дозапись очереди и закрытие лог-файла"""
+        if self._log_q is None:
+            return
+        
+        self._log_q.put(_LOG_STOP)
+        self._log_thread.join()
+        self._log_fp.close()
+        self._log_fp = None
+        self._log_q = None
+        self._log_thread = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _cache_enabled(self) -> bool:
+        """Кэш имеет смысл только для детерминированной генерации"""
+        return self.config.temperature == 0
+    
+    def _cache_key(self, prompt: str) -> str:
+        """Ключ кэша: модель, база знаний, параметры сэмплирования и промпт"""
+        config = self.config
+        parts = [
+            config.model_path,
+            self._get_knowledge_base_digest(),
+            f"{config.temperature}|{config.top_p}|{config.top_k}|{config.min_p}|{config.max_tokens}|{self.log_thinking}",
+            prompt
+        ]
+        return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+    
+    def _get_knowledge_base_digest(self) -> str:
+        """Хэш содержимого базы знаний (пустая строка, если файла нет)"""
+        if self._knowledge_base_digest is None:
+            try:
+                self._knowledge_base_digest = hashlib.sha256(KNOWLEDGE_BASE_FILE.read_bytes()).hexdigest()
+            except OSError:
+                self._knowledge_base_digest = ""
+        return self._knowledge_base_digest
+    
+    def _load_cache(self) -> dict:
+        """Загрузка кэша ответов из файла"""
+        if self._cache is None:
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    self._cache = json.load(f)
+            except FileNotFoundError:
+                self._cache = {}
+            except (json.JSONDecodeError, OSError) as e:
+                print(f"⚠️ Кэш ответов повреждён, будет создан заново: {e}")
+                self._cache = {}
+        return self._cache
+    
+    def _cache_get(self, key: str):
+        """Получение ответа из кэша"""
+        return self._load_cache().get(key)
+    
+    def _cache_set(self, key: str, response: dict):
+        """Сохранение ответа в кэш (в памяти)"""
+        self._load_cache()[key] = response
+    
+    def _save_cache(self):
+        """Запись кэша ответов на диск"""
+        if self._cache is None:
+            return
+        try:
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f, ensure_ascii=False)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить кэш ответов: {e}")
+    
+    @staticmethod
+    def _is_successful(response) -> bool:
+        """Ответ получен без ошибки и не пустой"""
+        return isinstance(response, dict) and bool(response.get('token_stats', {}).get('output_tokens'))
+    
+    def _generate_with_cache(self, prompts: list[str], on_response=None) -> list:
+        """
+        Генерация ответов с пропуском промптов, уже найденных в кэше
+        
+        on_response(index, response) вызывается для каждого готового ответа.
+        """
+        use_cache = self._cache_enabled()
+        keys = [self._cache_key(p) for p in prompts] if use_cache else []
+        responses = [self._cache_get(k) for k in keys] if use_cache else [None] * len(prompts)
+        
+        pending = [i for i, r in enumerate(responses) if r is None]
+        if use_cache:
+            print(f"💾 Из кэша: {len(prompts) - len(pending)}, к генерации: {len(pending)}")
+        
+        if on_response:
+            for i, response in enumerate(responses):
+                if response is not None:
+                    on_response(i, response)
+        
+        def _on_generated(batch_index: int, response: dict):
+            i = pending[batch_index]
+            responses[i] = response
+            # Ошибки и пустые генерации не кэшируем
+            if use_cache and self._is_successful(response):
+                self._cache_set(keys[i], response)
+            if on_response:
+                on_response(i, response)
+        
+        if pending:
+            pending_prompts = [prompts[i] for i in pending]
+            try:
+                if self.workers > 1:
+                    self._generate_in_pool(pending_prompts, _on_generated)
+                else:
+                    self._generate_batched(pending_prompts, _on_generated)
+            except Exception as e:
+                for i in pending:
+                    if responses[i] is None:
+                        responses[i] = e
+            
+            if use_cache:
+                self._save_cache()
+        
+        return responses
+    
+    def _generate_batched(self, prompts: list[str], on_result):
+        """
+        Пакетная генерация
+        
+        Все промпты известны заранее, поэтому окно ожидания не нужно:
+        список режется на пачки по max_batch штук, каждая уходит в generate_batch.
+        """
+        for start in range(0, len(prompts), self.max_batch):
+            self.llm.generate_batch(
+                prompts[start:start + self.max_batch],
+                lambda j, response, offset=start: on_result(offset + j, response),
+                self.log_thinking
+            )
+    
+    def _generate_in_pool(self, prompts: list[str], on_result):
+        """Распределение промптов по рабочим процессам, каждый со своей моделью"""
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(self.config.model_path,)) as executor:
+            futures = {executor.submit(_generate_in_worker, p, self.log_thinking): i for i, p in enumerate(prompts)}
+            for future in as_completed(futures):
+                try:
+                    response = future.result()
+                except Exception as e:
+                    response = e
+                on_result(futures[future], response)
+    
+    def _load_checkpoint(self) -> dict:
+        """Загрузка чекпоинта прерванного прогона"""
+        try:
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, OSError) as e:
+            print(f"⚠️ Чекпоинт повреждён и будет проигнорирован: {e}")
+            return {}
+    
+    def _save_checkpoint(self, checkpoint: dict):
+        """Атомарная запись чекпоинта (через временный файл)"""
+        tmp_path = self.checkpoint_file + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f, ensure_ascii=False)
+            os.replace(tmp_path, self.checkpoint_file)
+        except OSError as e:
+            print(f"⚠️ Не удалось сохранить чекпоинт: {e}")
     
     def run_benchmark(self):
         """Запуск бенчмарка"""
@@ -111,50 +401,67 @@ class QABenchmark:
         print(f"\n✅ Найдено {len(questions)} вопросов\n")
         
         # Заголовок в лог-файле
-        separator = "=" * 80
+        separator = self.EQ80
         header = f"""
 {separator}
 QA BENCHMARK - Тестирование LLM по вопросам о ПАО «Транснефть»
 Дата запуска: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-Модель: {self.llm.config.model_path}
+Модель: {self.config.model_path}
 Количество вопросов: {len(questions)}
 {separator}
 
 """
         self.log_message(header, console=False)
         
-        # Обработка каждого вопроса
-        for i, q in enumerate(questions, 1):
-            question_header = f"\n{'=' * 80}\n📋 ВОПРОС {q['number']}/{len(questions)}\n{'=' * 80}\n"
-            self.log_message(question_header)
+        # Продолжение прерванного прогона: уже отвеченные вопросы пропускаются
+        checkpoint = self._load_checkpoint()
+        pending = [q for q in questions if q['number'] not in checkpoint]
+        if checkpoint:
+            print(f"♻️ Чекпоинт {self.checkpoint_file}: пропускаем {len(questions) - len(pending)} готовых вопросов")
+        
+        def _on_response(index: int, response):
+            if self._is_successful(response):
+                checkpoint[pending[index]['number']] = response
+                self._save_checkpoint(checkpoint)
+        
+        # Все вопросы независимы - отправляем их модели динамическими пачками
+        print(f"🤔 Генерация ответов на {len(pending)} вопросов (пачки до {self.max_batch})...")
+        generated = self._generate_with_cache([self.build_prompt(q) for q in pending], on_response=_on_response)
+        
+        responses = dict(checkpoint)
+        responses.update(zip((q['number'] for q in pending), generated))
+        
+        # Логирование строго в порядке номеров вопросов
+        total = len(questions)
+        for q in questions:
+            response = responses[q['number']]
+            self.log_message(self.HEADER_TMPL.format(num=q['number'], total=total))
             
             # Логируем текст вопроса
             self.log_message(f"\n{q['text']}\n")
-            self.log_message(f"{'─' * 80}\n")
+            self.log_message(self.DASH80_LINE)
             
-            # Генерация ответа
-            print(f"🤔 Генерация ответа на вопрос {q['number']}...")
-            try:
-                response = self.llm.generate_response(q['full'])
-                
-                # Логируем thinking (если есть)
-                thinking = response.get('thinking', '')
-                if thinking:
-                    self.log_message("💭 РАЗМЫШЛЕНИЯ (Thinking):\n", console=False)
-                    self.log_message(thinking + "\n", console=False)
-                    self.log_message(f"{'─' * 80}\n", console=False)
-                
-                # Логируем ответ
-                answer = response.get('answer', '')
-                self.log_message("✅ ОТВЕТ:\n")
-                self.log_message(answer + "\n")
-                
-                print(f"✅ Вопрос {q['number']} обработан\n")
-                
-            except Exception as e:
-                error_msg = f"❌ Ошибка при генерации ответа: {e}\n"
+            if isinstance(response, Exception):
+                error_msg = f"❌ Ошибка при генерации ответа: {response}\n"
                 self.log_message(error_msg)
                 print(error_msg)
+                self.flush_log()
+                continue
+            
+            # Логируем thinking (если включено и есть)
+            thinking = response.get('thinking', '') if self.log_thinking else ''
+            if thinking:
+                self.log_message("💭 РАЗМЫШЛЕНИЯ (Thinking):\n", console=False)
+                self.log_message(thinking + "\n", console=False)
+                self.log_message(self.DASH80_LINE, console=False)
+            
+            # Логируем ответ
+            answer = response.get('answer', '')
+            self.log_message("✅ ОТВЕТ:\n")
+            self.log_message(answer + "\n")
+            
+            self.flush_log()
+            print(f"✅ Вопрос {q['number']} обработан\n")
         
         # Финальное сообщение
         footer = f"""
@@ -165,12 +472,31 @@ QA BENCHMARK - Тестирование LLM по вопросам о ПАО «Т
 {separator}
 """
         self.log_message(footer)
+        self.close()
+        
+        # Все вопросы отвечены - чекпоинт больше не нужен
+        if all(self._is_successful(responses[q['number']]) for q in questions):
+            try:
+                os.remove(self.checkpoint_file)
+            except FileNotFoundError:
+                pass
         
         print(f"\n🎉 Бенчмарк завершён! Результаты в файле: {self.log_file}")
 
 
 def main():
     """Точка входа"""
+    parser = argparse.ArgumentParser(description='QA Benchmark по gobench.md')
+    parser.add_argument('--log-file', type=str, default=None,
+                        help='Лог-файл прогона (укажите лог прерванного прогона, чтобы продолжить по чекпоинту)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Число процессов с отдельной копией модели (требует памяти на все копии)')
+    parser.add_argument('--max-batch', type=int, default=8,
+                        help='Максимальный размер пачки промптов')
+    parser.add_argument('--log-thinking', action='store_true',
+                        help='Записывать размышления модели (thinking) в лог')
+    args = parser.parse_args()
+    
     print("""
 ╔══════════════════════════════════════════════════════════════╗
 ║          QA BENCHMARK - ПАО «Транснефть»                     ║
@@ -179,8 +505,10 @@ def main():
     """)
     
     # Создание и запуск бенчмарка
-    benchmark = QABenchmark()
-    benchmark.run_benchmark()
+    with QABenchmark(log_file=args.log_file, workers=args.workers,
+                     max_batch=args.max_batch,
+                     log_thinking=args.log_thinking) as benchmark:
+        benchmark.run_benchmark()
 
 
 if __name__ == "__main__":
@@ -8,10 +8,20 @@ Audio Handler Module
 
 import os
 import io
+import re
+import queue
 import wave
 import json
-import tempfile
+import atexit
+import math
+import time
+import struct
+import hashlib
+import sqlite3
+import functools
 import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Optional, Dict, Any, Callable, Union
 from pathlib import Path
 
@@ -29,6 +39,9 @@ requests = None
 AudioSegment = None
 play = None
 np = None
+audioop = None
+simpleaudio = None
+njit = None
 
 try:
     import pyaudio
@@ -62,6 +75,27 @@ try:
 except ImportError:
     np = None
 
+try:
+    import simpleaudio
+except ImportError:
+    simpleaudio = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    import audioop  # C-реализация RMS по сырым int16 байтам (удалён в Python 3.13)
+except ImportError:
+    audioop = None
+
+# Пересчёт порога из config.py (задан для среднего модуля амплитуды) в метрику громкости:
+# RMS речи ~1.25 среднего модуля (sqrt(pi/2) для нормального распределения),
+# пик на окне ~100 мс примерно в 4 раза больше среднего модуля
+RMS_PER_MEAN_ABS = 1.25
+PEAK_PER_MEAN_ABS = 4.0
+
 # Проверка критически важных зависимостей
 MISSING_DEPS = []
 if sr is None:
@@ -79,6 +113,299 @@ if MISSING_DEPS:
     print(f"⚠️  Отсутствуют аудио зависимости: {', '.join(MISSING_DEPS)}")
     print("Для полной функциональности установите: pip install " + ' '.join(MISSING_DEPS))
 
+# Кэш тяжёлых объектов между экземплярами AudioHandler:
+# калибровка микрофона (1 сек) и pyttsx3.init() выполняются один раз на процесс
+_RECOGNIZER_CACHE: Dict[tuple, tuple] = {}
+_TTS_ENGINE_CACHE: Dict[tuple, Any] = {}
+_CACHE_LOCK = threading.Lock()
+
+def _shutdown_audio_cache():
+    """Остановка закэшированных TTS движков при выходе"""
+    with _CACHE_LOCK:
+        for engine in _TTS_ENGINE_CACHE.values():
+            try:
+                engine.stop()
+            except Exception:
+                pass
+        _TTS_ENGINE_CACHE.clear()
+        _RECOGNIZER_CACHE.clear()
+
+atexit.register(_shutdown_audio_cache)
+
+# Один экземпляр PyAudio на процесс: инициализация опрашивает все устройства (50-200 мс)
+_PYAUDIO_INSTANCE = None
+
+def _get_pyaudio():
+    """Общий экземпляр PyAudio (создаётся при первом обращении)"""
+    global _PYAUDIO_INSTANCE
+    with _CACHE_LOCK:
+        if _PYAUDIO_INSTANCE is None:
+            _PYAUDIO_INSTANCE = pyaudio.PyAudio()
+            atexit.register(_PYAUDIO_INSTANCE.terminate)
+        return _PYAUDIO_INSTANCE
+
+# Кэш синтезированной речи: повторяющиеся фразы (приветствия, подтверждения)
+# воспроизводятся из готового WAV без повторного синтеза
+TTS_CACHE_DIR = Path.home() / ".cache" / "transneft_tts"
+TTS_MEMORY_CACHE_SIZE = 256
+# Предел кэша на диске: сверх него удаляются давно не использованные файлы
+TTS_DISK_CACHE_MAX_BYTES = 64 * 1024 * 1024
+TTS_QUEUE_SIZE = 8
+# Фразы, пришедшие в очередь почти одновременно, синтезируются одним вызовом
+TTS_BATCH_MAX = 8
+TTS_BATCH_WINDOW = 0.02  # сек
+
+# ElevenLabs: потоковый эндпоинт с выдачей сырого PCM (без декодирования MP3)
+ELEVENLABS_STREAM_URL = "https://api.elevenlabs.io/v1/text-to-speech/{voice_id}/stream"
+ELEVENLABS_MODEL_ID = "eleven_multilingual_v2"
+ELEVENLABS_SAMPLE_RATE = 16000
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Выбранный голос TTS: (id, имя, мужской ли) по имени движка - список голосов системы не меняется
+_VOICE_CACHE: Dict[str, Optional[tuple]] = {}
+
+def _find_russian_voice(engine_name: str, engine) -> Optional[tuple]:
+    """Поиск русского голоса (мужской в приоритете), результат кэшируется"""
+    with _CACHE_LOCK:
+        if engine_name in _VOICE_CACHE:
+            return _VOICE_CACHE[engine_name]
+    
+    chosen = None
+    fallback = None
+    for voice in engine.getProperty('voices') or []:
+        if not (hasattr(voice, 'name') and hasattr(voice, 'id')):
+            continue
+        name_lower = str(voice.name).lower()
+        id_lower = str(voice.id).lower()
+        if 'russian' not in name_lower and 'ru' not in id_lower:
+            continue
+        
+        # Ищем мужской русский голос (приоритет)
+        if 'male' in name_lower or 'ivan' in name_lower or 'dmitry' in name_lower:
+            chosen = (voice.id, voice.name, True)
+            break
+        # Если не нашли мужской, берём первый русский
+        if fallback is None:
+            fallback = (voice.id, voice.name, False)
+    
+    result = chosen or fallback
+    with _CACHE_LOCK:
+        _VOICE_CACHE[engine_name] = result
+    return result
+
+# Заголовок WAV для 16-бит моно PCM (44 байта): размеры подставляются при сборке
+_WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+
+def wav_header(data_len: int, sample_rate: int) -> bytes:
+    """Заголовок WAV для 16-бит моно PCM без прохода через модуль wave"""
+    return _WAV_HEADER.pack(b'RIFF', 36 + data_len, b'WAVE', b'fmt ', 16, 1, 1,
+                            sample_rate, sample_rate * 2, 2, 16, b'data', data_len)
+
+# Кэш распознавания речи по хэшу PCM и (опционально) аудио-отпечатку
+STT_CACHE_FILE = Path.home() / ".cache" / "transneft_stt.db"
+STT_CACHE_SCAN_ROWS = 1000
+FINGERPRINT_RATE = 16000
+FINGERPRINT_FRAME = 512
+FINGERPRINT_BANDS = 16
+FINGERPRINT_SEGMENTS = 8
+
+def _audio_fingerprint(pcm_bytes: bytes) -> Optional[bytes]:
+    """
+    Отпечаток фразы: логарифм энергии в 16 полосах спектра для 8 отрезков по времени,
+    квантованный в uint8 (128 байт). Временная структура нужна, чтобы разные фразы
+    одного голоса не сливались в один усреднённый спектр.
+    """
+    samples = np.frombuffer(pcm_bytes, dtype=np.int16)
+    n_frames = samples.size // FINGERPRINT_FRAME
+    if n_frames < FINGERPRINT_SEGMENTS:
+        return None
+    
+    frames = samples[:n_frames * FINGERPRINT_FRAME].reshape(n_frames, FINGERPRINT_FRAME).astype(np.float32)
+    spectrum = np.abs(np.fft.rfft(frames, axis=1))
+    
+    # Логарифмически расположенные полосы (грубое приближение mel-шкалы)
+    edges = np.unique(np.geomspace(1, spectrum.shape[1], FINGERPRINT_BANDS + 1).astype(int))
+    bands = np.add.reduceat(spectrum, edges[:-1], axis=1)
+    segments = np.array_split(np.log1p(bands), FINGERPRINT_SEGMENTS, axis=0)
+    features = np.stack([segment.mean(axis=0) for segment in segments]).ravel()
+    
+    features -= features.min()
+    peak = features.max()
+    if peak <= 0:
+        return None
+    return (features * (255.0 / peak)).astype(np.uint8).tobytes()
+
+class STTCache:
+    """
+    SQLite кэш распознанного текста
+    
+    По умолчанию текст возвращается только для побайтно той же записи (хэш PCM).
+    Поиск похожей записи по отпечатку включается явно: ложное совпадение
+    подменило бы вопрос пользователя чужой фразой. Хранится не больше
+    max_rows фраз: при каждой записи удаляются давно не использованные (LRU).
+    """
+    
+    def __init__(self, path: Path = STT_CACHE_FILE, similarity: float = 0.97,
+                 max_rows: int = 500):
+        self.similarity = similarity
+        self.max_rows = max(1, max_rows)
+        self._lock = threading.Lock()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS stt_phrases "
+            "(pcm_hash BLOB PRIMARY KEY, fingerprint BLOB, duration REAL, text TEXT, ts REAL)"
+        )
+        self._db.commit()
+    
+    def lookup(self, pcm_hash: bytes, fingerprint: Optional[bytes] = None,
+               duration: float = 0.0) -> Optional[str]:
+        """Точное совпадение PCM; при переданном отпечатке - ближайший сосед среди последних записей"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT text FROM stt_phrases WHERE pcm_hash = ?", (pcm_hash,)
+            ).fetchone()
+            if row:
+                self._touch(pcm_hash)
+                return row[0]
+            if fingerprint is None:
+                return None
+            
+            rows = self._db.execute(
+                "SELECT fingerprint, text, pcm_hash FROM stt_phrases "
+                "WHERE fingerprint IS NOT NULL AND duration BETWEEN ? AND ? "
+                "ORDER BY ts DESC LIMIT ?",
+                (duration * 0.9, duration * 1.1, STT_CACHE_SCAN_ROWS)
+            ).fetchall()
+        
+        if not rows:
+            return None
+        
+        query = np.frombuffer(fingerprint, dtype=np.uint8).astype(np.float32)
+        query -= query.mean()
+        stored = np.stack([np.frombuffer(row[0], dtype=np.uint8) for row in rows]).astype(np.float32)
+        stored -= stored.mean(axis=1, keepdims=True)
+        
+        norms = np.linalg.norm(stored, axis=1) * np.linalg.norm(query)
+        scores = np.einsum('ij,j->i', stored, query) / np.maximum(norms, 1e-6)
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity:
+            return None
+        with self._lock:
+            self._touch(rows[best][2])
+        return rows[best][1]
+    
+    def _touch(self, pcm_hash: bytes):
+        """Отметка использования записи (вызывается под self._lock)"""
+        self._db.execute("UPDATE stt_phrases SET ts = ? WHERE pcm_hash = ?", (time.time(), pcm_hash))
+        self._db.commit()
+    
+    def store(self, pcm_hash: bytes, fingerprint: Optional[bytes], duration: float, text: str):
+        """Сохранение распознанного текста с вытеснением давно не использованных фраз"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO stt_phrases VALUES (?, ?, ?, ?, ?)",
+                (pcm_hash, fingerprint, duration, text, time.time())
+            )
+            self._db.execute(
+                "DELETE FROM stt_phrases WHERE pcm_hash NOT IN "
+                "(SELECT pcm_hash FROM stt_phrases ORDER BY ts DESC LIMIT ?)",
+                (self.max_rows,)
+            )
+            self._db.commit()
+
+_STT_CACHE: Optional[STTCache] = None
+
+def _get_stt_cache(similarity: float, max_rows: int) -> Optional[STTCache]:
+    """Общий для процесса экземпляр кэша распознавания"""
+    global _STT_CACHE
+    with _CACHE_LOCK:
+        if _STT_CACHE is None:
+            try:
+                _STT_CACHE = STTCache(similarity=similarity, max_rows=max_rows)
+            except Exception as e:
+                print(f"⚠️  Кэш распознавания недоступен: {e}")
+                return None
+        return _STT_CACHE
+
+def cached_via_fingerprint(func: Callable) -> Callable:
+    """Декоратор метода распознавания: (self, audio: sr.AudioData) -> str"""
+    @functools.wraps(func)
+    def wrapper(self, audio):
+        if not self.config.stt_cache_enabled:
+            return func(self, audio)
+        
+        cache = _get_stt_cache(self.config.stt_cache_similarity, self.config.stt_cache_max_rows)
+        if cache is None:
+            return func(self, audio)
+        
+        raw = audio.get_raw_data()
+        pcm_hash = hashlib.sha1(raw).digest()
+        duration = len(raw) / (audio.sample_width * audio.sample_rate)
+        
+        def fingerprint():
+            if np is None:
+                return None
+            return _audio_fingerprint(
+                audio.get_raw_data(convert_rate=FINGERPRINT_RATE, convert_width=2)
+            )
+        
+        # Для поиска отпечаток нужен только при нечетком режиме (включается в config.py)
+        query = fingerprint() if self.config.stt_cache_fuzzy else None
+        text = cache.lookup(pcm_hash, query, duration)
+        if text:
+            print("⚡ Фраза распознана из кэша")
+            return text
+        
+        text = func(self, audio)
+        if text:
+            # Отпечаток сохраняется всегда, чтобы включённый позже нечеткий поиск видел историю
+            cache.store(pcm_hash, query if query is not None else fingerprint(), duration, text)
+        return text
+    
+    return wrapper
+
+# Коды действий автомата тишины
+FSM_CONTINUE = 0
+FSM_FLUSH = 1   # пауза после речи - распознать фразу
+FSM_STOP = 2    # таймаут бездействия - остановить запись
+
+def _update_silence_fsm(volume, has_speech, silence_start, last_speech, now,
+                        vol_thresh, silence_thresh, inact_timeout):
+    """
+    Шаг автомата определения пауз. silence_start < 0 означает "тишина не началась".
+    Возвращает (has_speech, silence_start, last_speech, action)
+    """
+    action = FSM_CONTINUE
+    if volume > vol_thresh:
+        # Громкость выше порога - есть речь
+        has_speech = True
+        silence_start = -1.0
+        last_speech = now
+    else:
+        if has_speech and silence_start < 0:
+            silence_start = now
+        # Пауза после речи = конец предложения
+        if has_speech and silence_start >= 0 and now - silence_start >= silence_thresh:
+            action = FSM_FLUSH
+            has_speech = False
+            silence_start = -1.0
+            # Даём пользователю ещё inact_timeout секунд
+            last_speech = now
+    
+    if action == FSM_CONTINUE and now - last_speech > inact_timeout:
+        action = FSM_STOP
+    return has_speech, silence_start, last_speech, action
+
+if njit is not None:
+    try:
+        _update_silence_fsm = njit(cache=True, fastmath=True)(_update_silence_fsm)
+        # Компиляция при импорте, а не на первой фразе пользователя
+        _update_silence_fsm(0.0, False, -1.0, 0.0, 0.0, 1.0, 1.0, 1.0)
+    except Exception as e:
+        print(f"⚠️  Numba JIT недоступен для автомата тишины: {e}")
+        _update_silence_fsm = _update_silence_fsm.py_func
+
 class AudioConfig:
     """Конфигурация для аудио модуля"""
     
@@ -113,6 +440,12 @@ class AudioConfig:
         self.channels = 1  # Всегда моно
         self.record_timeout = 10  # Таймаут записи
         
+        # Локальный кэш распознавания
+        self.stt_cache_enabled = app_config.STT_CACHE_ENABLED
+        self.stt_cache_fuzzy = app_config.STT_CACHE_FUZZY
+        self.stt_cache_similarity = app_config.STT_CACHE_SIMILARITY
+        self.stt_cache_max_rows = app_config.STT_CACHE_MAX_ROWS
+        
         print("✅ Настройки загружены из config.py")
 
 class SpeechRecognizer:
@@ -122,7 +455,10 @@ class SpeechRecognizer:
         self.config = config
         self.recognizer = None
         self.microphone = None
+        self._http_session = None
         self._initialize_recognizer()
+        if self.config.stt_engine == 'whisper_api' and self.config.whisper_api_key:
+            self._http_session = self._create_http_session()
     
     def _initialize_recognizer(self):
         """Инициализация распознавателя речи"""
@@ -132,18 +468,29 @@ class SpeechRecognizer:
             self.config.stt_enabled = False
             return
             
+        cache_key = (self.config.sample_rate, self.config.stt_engine, self.config.stt_language)
+        
         try:
-            self.recognizer = sr.Recognizer()
-            if pyaudio is not None:
-                self.microphone = sr.Microphone(sample_rate=self.config.sample_rate)
+            with _CACHE_LOCK:
+                cached = _RECOGNIZER_CACHE.get(cache_key)
+                if cached is not None:
+                    self.recognizer, self.microphone = cached
+                    print("🎤 Распознавание речи инициализировано (из кэша)")
+                    return
                 
-                # Калибровка шума
-                with self.microphone as source:
-                    self.recognizer.adjust_for_ambient_noise(source, duration=1)
-            else:
-                print("⚠️  pyaudio не установлен, микрофон недоступен")
-                self.config.stt_enabled = False
-                return
+                self.recognizer = sr.Recognizer()
+                if pyaudio is not None:
+                    self.microphone = sr.Microphone(sample_rate=self.config.sample_rate)
+                    
+                    # Без блокирующей калибровки на 1 сек: порог подстраивается по ходу записи
+                    # (dynamic_energy_threshold и оценка фонового шума в AudioHandler)
+                    self.recognizer.dynamic_energy_threshold = True
+                else:
+                    print("⚠️  pyaudio не установлен, микрофон недоступен")
+                    self.config.stt_enabled = False
+                    return
+                
+                _RECOGNIZER_CACHE[cache_key] = (self.recognizer, self.microphone)
                 
             print("🎤 Распознавание речи инициализировано")
         except Exception as e:
@@ -170,16 +517,14 @@ class SpeechRecognizer:
             
             # Выбор движка распознавания
             if self.config.stt_engine == 'google' and self.recognizer:
-                # type: ignore - Проверяем что recognizer не None
-                text = self.recognizer.recognize_google(audio, language=self.config.stt_language)  # type: ignore
+                text = self._recognize_with_google(audio)
             elif self.config.stt_engine == 'whisper_api':
                 text = self._recognize_with_whisper_api(audio)
             elif self.config.stt_engine == 'local_whisper':
                 text = self._recognize_with_local_whisper(audio)
             else:
                 if self.recognizer:
-                    # type: ignore - Проверяем что recognizer не None
-                    text = self.recognizer.recognize_google(audio, language=self.config.stt_language)  # type: ignore
+                    text = self._recognize_with_google(audio)
                 else:
                     raise RuntimeError("Google Speech Recognition недоступен")
             
@@ -201,6 +546,34 @@ class SpeechRecognizer:
             print(f"❌ Ошибка распознавания: {e}")
             return None
     
+    def _create_http_session(self, warmup: bool = True):
+        """HTTP сессия с пулом соединений для Whisper API"""
+        if requests is None:
+            return None
+        
+        session = requests.Session()
+        session.headers['Authorization'] = f'Bearer {self.config.whisper_api_key}'
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        session.mount('https://', adapter)
+        
+        if warmup:
+            # Прогрев: TCP+TLS рукопожатие выполняется до первой фразы пользователя
+            def warm():
+                try:
+                    session.head(self.config.whisper_api_url, timeout=5)
+                except Exception:
+                    pass
+            threading.Thread(target=warm, daemon=True).start()
+        
+        return session
+    
+    @cached_via_fingerprint
+    def _recognize_with_google(self, audio) -> str:
+        """Распознавание через Google Web Speech"""
+        # type: ignore - Проверяем что recognizer не None
+        return self.recognizer.recognize_google(audio, language=self.config.stt_language)  # type: ignore
+    
+    @cached_via_fingerprint
     def _recognize_with_whisper_api(self, audio) -> str:
         """Распознавание через Whisper API"""
         if not self.config.whisper_api_key:
@@ -209,33 +582,23 @@ class SpeechRecognizer:
         if requests is None:
             raise Exception("requests библиотека не установлена")
         
-        # Конвертация в WAV формат
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-            with wave.open(tmp_file.name, 'wb') as wav_file:
-                wav_file.setnchannels(1)
-                wav_file.setsampwidth(2)
-                wav_file.setframerate(self.config.sample_rate)
-                wav_file.writeframes(audio.get_wav_data())
-            
-            # Отправка на Whisper API
-            with open(tmp_file.name, 'rb') as audio_file:
-                headers = {'Authorization': f'Bearer {self.config.whisper_api_key}'}
-                files = {'file': audio_file}
-                data = {'model': 'whisper-1', 'language': 'ru'}
-                
-                response = requests.post(self.config.whisper_api_url, headers=headers, files=files, data=data)
-                response.raise_for_status()
-                
-                result = response.json()
-                text = result.get('text', '')
-            
-            # Удаление временного файла
-            try:
-                os.unlink(tmp_file.name)
-            except:
-                pass
-            
-            return text
+        # Конвертация в WAV прямо в памяти - без временного файла на диске
+        pcm_bytes = audio.get_raw_data(convert_rate=self.config.sample_rate, convert_width=2)
+        wav_buffer = io.BytesIO(wav_header(len(pcm_bytes), self.config.sample_rate) + pcm_bytes)
+        
+        # Отправка на Whisper API (сессия держит keep-alive соединение между фразами)
+        if self._http_session is None:
+            self._http_session = self._create_http_session(warmup=False)
+        
+        files = {'file': ('audio.wav', wav_buffer, 'audio/wav')}
+        data = {'model': 'whisper-1', 'language': 'ru'}
+        
+        response = self._http_session.post(self.config.whisper_api_url, files=files,
+                                           data=data, stream=False, timeout=10)
+        response.raise_for_status()
+        
+        result = response.json()
+        return result.get('text', '')
     
     def _recognize_with_local_whisper(self, audio) -> str:
         """Заглушка для локального Whisper"""
@@ -256,6 +619,14 @@ class TextToSpeech:
     def __init__(self, config: AudioConfig):
         self.config = config
         self.engine = None
+        self._wav_cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._wav_cache_lock = threading.Lock()
+        # Постоянный поток озвучивания с ограниченной очередью фраз
+        self._tts_q: "queue.Queue[tuple]" = queue.Queue(maxsize=TTS_QUEUE_SIZE)
+        self._tts_thread: Optional[threading.Thread] = None
+        self._tts_worker_lock = threading.Lock()
+        self._http_session = None
+        self._pyaudio = None
         self._initialize_tts()
     
     def _initialize_tts(self):
@@ -268,38 +639,26 @@ class TextToSpeech:
             
         try:
             if self.config.tts_engine == 'pyttsx3':
-                self.engine = pyttsx3.init()
+                cache_key = (self.config.tts_engine, self.config.tts_voice,
+                             self.config.tts_rate, self.config.tts_volume)
+                with _CACHE_LOCK:
+                    cached_engine = _TTS_ENGINE_CACHE.get(cache_key)
+                if cached_engine is not None:
+                    self.engine = cached_engine
+                    print("🔊 Синтез речи инициализирован (из кэша)")
+                    return
                 
-                # Настройка голоса (выбираем мужской русский)
-                voices = self.engine.getProperty('voices')
-                male_voice_found = False
+                self.engine = pyttsx3.init()
                 
-                if voices:  # Проверка что voices не None
-                    try:
-                        # Сначала ищем мужской русский голос
-                        for voice in voices:  # type: ignore
-                            if hasattr(voice, 'name') and hasattr(voice, 'id'):
-                                name_lower = voice.name.lower()
-                                id_lower = voice.id.lower()
-                                
-                                # Ищем мужской русский голос (приоритет)
-                                if ('russian' in name_lower or 'ru' in id_lower) and \
-                                   ('male' in name_lower or 'ivan' in name_lower or 'dmitry' in name_lower):
-                                    self.engine.setProperty('voice', voice.id)
-                                    male_voice_found = True
-                                    print(f"🎙️ Выбран мужской голос: {voice.name}")
-                                    break
-                        
-                        # Если не нашли мужской, берём любой русский
-                        if not male_voice_found:
-                            for voice in voices:  # type: ignore
-                                if hasattr(voice, 'name') and hasattr(voice, 'id'):
-                                    if 'russian' in voice.name.lower() or 'ru' in voice.id.lower():
-                                        self.engine.setProperty('voice', voice.id)
-                                        print(f"🎙️ Выбран голос: {voice.name}")
-                                        break
-                    except (TypeError, AttributeError):
-                        pass  # Игнорируем ошибки с типами
+                # Настройка голоса (выбираем мужской русский, поиск выполняется один раз)
+                chosen_voice = _find_russian_voice(self.config.tts_engine, self.engine)
+                if chosen_voice is not None:
+                    voice_id, voice_name, is_male = chosen_voice
+                    self.engine.setProperty('voice', voice_id)
+                    if is_male:
+                        print(f"🎙️ Выбран мужской голос: {voice_name}")
+                    else:
+                        print(f"🎙️ Выбран голос: {voice_name}")
                 
                 # Настройка скорости (увеличиваем на 20% для ускорения)
                 faster_rate = int(self.config.tts_rate * 1.2)
@@ -308,6 +667,9 @@ class TextToSpeech:
                 
                 print(f"⚡ Скорость речи: {faster_rate} слов/мин")
                 
+                with _CACHE_LOCK:
+                    _TTS_ENGINE_CACHE[cache_key] = self.engine
+                
             print("🔊 Синтез речи инициализирован")
         except Exception as e:
             print(f"⚠️  Ошибка инициализации TTS: {e}")
@@ -335,37 +697,270 @@ class TextToSpeech:
             return None
     
     def _speak_with_pyttsx3(self, text: str, play_async: bool) -> Optional[str]:
-        """Озвучивание через pyttsx3"""
+        """Озвучивание через pyttsx3 (все фразы идут через один поток озвучивания)"""
         if not self.engine or not hasattr(self.engine, 'say'):
             return None
+        return self._enqueue_speech(self._play_pyttsx3, text, play_async)
+    
+    def _enqueue_speech(self, play_fn: Callable[[str], None], text: str, play_async: bool) -> str:
+        """Постановка фразы в очередь потока озвучивания"""
+        self._ensure_tts_worker()
+        done = None if play_async else threading.Event()
         
-        def speak():
+        # Очередь ограничена: при переполнении выбрасываем самую старую фразу
+        while True:
             try:
-                if self.engine and hasattr(self.engine, 'say') and hasattr(self.engine, 'runAndWait'):
-                    self.engine.say(text)
-                    self.engine.runAndWait()
-                else:
-                    print("❌ TTS Engine недоступен")
+                self._tts_q.put_nowait((play_fn, text, done))
+                break
+            except queue.Full:
+                try:
+                    _, _, dropped_done = self._tts_q.get_nowait()
+                    if dropped_done is not None:
+                        dropped_done.set()
+                except queue.Empty:
+                    pass
+        
+        if play_async:
+            return "Воспроизведение поставлено в очередь"
+        done.wait()
+        return "Воспроизведение завершено"
+    
+    def prewarm(self):
+        """Запуск потока озвучивания и открытие аудиовыхода заранее, до первой фразы"""
+        if not self.config.tts_enabled:
+            return
+        self._ensure_tts_worker()
+        if pyaudio is not None and self._pyaudio is None:
+            self._pyaudio = _get_pyaudio()
+    
+    def _ensure_tts_worker(self):
+        """Запуск постоянного потока озвучивания при первой фразе"""
+        with self._tts_worker_lock:
+            if self._tts_thread is None or not self._tts_thread.is_alive():
+                self._tts_thread = threading.Thread(target=self._tts_loop, name='tts', daemon=True)
+                self._tts_thread.start()
+    
+    def _tts_loop(self):
+        """
+        Поток озвучивания: pyttsx3 runAndWait не допускает параллельных вызовов
+        
+        Фразы одного движка, пришедшие в пределах TTS_BATCH_WINDOW, склеиваются
+        и синтезируются одним вызовом (один runAndWait / один HTTP запрос).
+        Фразы для pyttsx3 с кэшем WAV не склеиваются: ключ кэша склеенного
+        текста зависел бы от тайминга и почти никогда не повторялся бы.
+        """
+        pending = None
+        while True:
+            play_fn, text, done = pending or self._tts_q.get()
+            pending = None
+            texts = [text]
+            dones = [done]
+            batch_max = 1 if play_fn == self._play_pyttsx3 and self._can_play_wav() else TTS_BATCH_MAX
+            deadline = time.monotonic() + TTS_BATCH_WINDOW
+            while len(texts) < batch_max:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._tts_q.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item[0] != play_fn:
+                    pending = item  # другой движок - следующим вызовом
+                    break
+                texts.append(item[1])
+                dones.append(item[2])
+            
+            try:
+                play_fn(" ".join(texts))
             except Exception as e:
                 print(f"❌ Ошибка озвучивания: {e}")
+            finally:
+                for done in dones:
+                    if done is not None:
+                        done.set()
+    
+    def _play_pyttsx3(self, text: str):
+        """Синтез и воспроизведение фразы через pyttsx3 (в потоке озвучивания)"""
+        if not (self.engine and hasattr(self.engine, 'say') and hasattr(self.engine, 'runAndWait')):
+            print("❌ TTS Engine недоступен")
+            return
         
-        if play_async:
-            thread = threading.Thread(target=speak, daemon=True)
-            thread.start()
-            return "Воспроизведение начато асинхронно"
-        else:
-            speak()
-            return "Воспроизведение завершено"
+        # Если есть чем проиграть WAV - синтезируем через кэш, иначе напрямую
+        wav_bytes = self._render_pyttsx3_cached(text) if self._can_play_wav() else None
+        if wav_bytes is None or not self._play_wav_bytes(wav_bytes):
+            self.engine.say(text)
+            self.engine.runAndWait()
+    
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        """Нормализация текста для ключа кэша"""
+        return _WHITESPACE_RE.sub(' ', text.strip().lower())
+    
+    def _tts_cache_key(self, text: str, voice: Optional[str] = None, rate: Optional[Any] = None) -> str:
+        """Ключ кэша: нормализованный текст + голос + скорость"""
+        if voice is None:
+            voice = self.engine.getProperty('voice') if self.engine else self.config.tts_voice
+        if rate is None:
+            rate = self.engine.getProperty('rate') if self.engine else self.config.tts_rate
+        raw = f"{self._normalize_text(text)}|{voice}|{rate}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def _can_play_wav() -> bool:
+        """Доступна ли библиотека для воспроизведения WAV"""
+        return simpleaudio is not None or (AudioSegment is not None and play is not None)
+    
+    def _render_pyttsx3_cached(self, text: str) -> Optional[bytes]:
+        """WAV для текста: из памяти, с диска или синтез с сохранением в кэш"""
+        key = self._tts_cache_key(text)
+        
+        with self._wav_cache_lock:
+            wav_bytes = self._wav_cache.get(key)
+            if wav_bytes is not None:
+                self._wav_cache.move_to_end(key)
+                return wav_bytes
+        
+        wav_path = TTS_CACHE_DIR / f"{key}.wav"
+        created = not wav_path.exists()
+        if created:
+            tmp_path = wav_path.with_suffix('.tmp.wav')
+            try:
+                TTS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                self.engine.save_to_file(text, str(tmp_path))
+                self.engine.runAndWait()
+                os.replace(tmp_path, wav_path)
+            except Exception as e:
+                print(f"⚠️  Не удалось сохранить речь в кэш: {e}")
+                tmp_path.unlink(missing_ok=True)
+                return None
+        
+        try:
+            wav_bytes = wav_path.read_bytes()
+            if created:
+                self._prune_disk_cache()
+            else:
+                # mtime = время последнего использования (для вытеснения)
+                os.utime(wav_path)
+        except OSError:
+            return None
+        
+        with self._wav_cache_lock:
+            self._wav_cache[key] = wav_bytes
+            if len(self._wav_cache) > TTS_MEMORY_CACHE_SIZE:
+                self._wav_cache.popitem(last=False)
+        return wav_bytes
+    
+    @staticmethod
+    def _prune_disk_cache():
+        """Удаление давно не использованных WAV сверх TTS_DISK_CACHE_MAX_BYTES"""
+        try:
+            files = []
+            for path in TTS_CACHE_DIR.glob('*.wav'):
+                stat = path.stat()
+                files.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            return
+        
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files, key=lambda item: item[0]):
+            if total <= TTS_DISK_CACHE_MAX_BYTES:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                pass
+    
+    @staticmethod
+    def _play_wav_bytes(wav_bytes: bytes) -> bool:
+        """Воспроизведение готового WAV, True при успехе"""
+        try:
+            if simpleaudio is not None:
+                with wave.open(io.BytesIO(wav_bytes), 'rb') as wav_read:
+                    wave_obj = simpleaudio.WaveObject.from_wave_read(wav_read)
+                wave_obj.play().wait_done()
+                return True
+            if AudioSegment is not None and play is not None:
+                play(AudioSegment.from_wav(io.BytesIO(wav_bytes)))
+                return True
+        except Exception as e:
+            print(f"⚠️  Ошибка воспроизведения из кэша: {e}")
+        return False
     
     def _speak_with_elevenlabs(self, text: str, play_async: bool) -> Optional[str]:
-        """Заглушка для ElevenLabs API"""
+        """Озвучивание через ElevenLabs API с воспроизведением по мере загрузки"""
         if not self.config.elevenlabs_api_key:
             print("🔧 ElevenLabs API ключ не настроен, используется pyttsx3")
             return self._speak_with_pyttsx3(text, play_async)
         
-        # TODO: Реализация ElevenLabs API
-        print("🔧 ElevenLabs API пока не реализован, используется pyttsx3")
-        return self._speak_with_pyttsx3(text, play_async)
+        if requests is None or pyaudio is None:
+            print("🔧 Для ElevenLabs нужны requests и pyaudio, используется pyttsx3")
+            return self._speak_with_pyttsx3(text, play_async)
+        
+        return self._enqueue_speech(self._play_elevenlabs, text, play_async)
+    
+    def _play_elevenlabs(self, text: str):
+        """
+        Потоковое воспроизведение ElevenLabs: запрашиваем сырой PCM 16 кГц и пишем
+        чанки в аудиовыход по мере получения - звук начинается с первым чанком,
+        а не после загрузки всего ответа. Готовая фраза сохраняется в кэш.
+        """
+        key = self._tts_cache_key(text, voice=f"elevenlabs:{self.config.elevenlabs_voice_id}", rate='')
+        with self._wav_cache_lock:
+            cached_wav = self._wav_cache.get(key)
+            if cached_wav is not None:
+                self._wav_cache.move_to_end(key)
+        
+        output = self._open_pcm_output(ELEVENLABS_SAMPLE_RATE)
+        try:
+            if cached_wav is not None:
+                output.write(cached_wav[_WAV_HEADER.size:])
+                return
+            
+            if self._http_session is None:
+                self._http_session = requests.Session()
+            
+            response = self._http_session.post(
+                ELEVENLABS_STREAM_URL.format(voice_id=self.config.elevenlabs_voice_id),
+                params={'optimize_streaming_latency': 3,
+                        'output_format': f'pcm_{ELEVENLABS_SAMPLE_RATE}'},
+                headers={'xi-api-key': self.config.elevenlabs_api_key},
+                json={'text': text, 'model_id': ELEVENLABS_MODEL_ID},
+                stream=True,
+                timeout=10
+            )
+            response.raise_for_status()
+            
+            pcm = bytearray()
+            pending = b''
+            for chunk in response.iter_content(chunk_size=4096):
+                if not chunk:
+                    continue
+                # Границы HTTP чанков не совпадают с границами 16-бит сэмплов
+                chunk = pending + chunk
+                usable = len(chunk) & ~1
+                pending = chunk[usable:]
+                output.write(chunk[:usable])
+                pcm += chunk[:usable]
+            
+            with self._wav_cache_lock:
+                self._wav_cache[key] = wav_header(len(pcm), ELEVENLABS_SAMPLE_RATE) + bytes(pcm)
+                if len(self._wav_cache) > TTS_MEMORY_CACHE_SIZE:
+                    self._wav_cache.popitem(last=False)
+        except Exception as e:
+            print(f"❌ Ошибка ElevenLabs API: {e}, используется pyttsx3")
+            if self.engine:
+                self._play_pyttsx3(text)
+        finally:
+            output.stop_stream()
+            output.close()
+    
+    def _open_pcm_output(self, sample_rate: int):
+        """Аудиовыход для 16-бит моно PCM"""
+        if self._pyaudio is None:
+            self._pyaudio = _get_pyaudio()
+        return self._pyaudio.open(format=pyaudio.paInt16, channels=1, rate=sample_rate, output=True)
     
     def _speak_with_local_tts(self, text: str, play_async: bool) -> Optional[str]:
         """Заглушка для локального TTS"""
@@ -384,20 +979,66 @@ class AudioHandler:
         # Для потоковой записи голоса
         self.is_listening = False
         self.audio_stream = None
-        self.audio_frames = []
+        # Буфер фразы: заранее выделенный bytearray (~30 сек) и позиция записи
+        self._ring = bytearray(self.config.sample_rate * 2 * 30)
+        self._ring_pos = 0
+        # Громкость считается раз в окно ~100 мс (несколько чанков), а не на каждый чанк
+        self._window_bytes = max(1, round(0.1 * self.config.sample_rate / self.config.chunk_size)) \
+            * self.config.chunk_size * 2
         self.last_speech_time = None
         
         # Пороги времени и громкости (загружаются из config.py)
         self.silence_threshold = app_config.SILENCE_THRESHOLD
         self.inactivity_timeout = app_config.INACTIVITY_TIMEOUT
-        self.volume_threshold = app_config.VOICE_VOLUME_THRESHOLD
+        # VOICE_VOLUME_THRESHOLD задан для среднего модуля, громкость считается как RMS или пик
+        # Целый порог: громкость тоже целая (отсчёты int16), сравнение без float
+        self.volume_metric = app_config.VOICE_VOLUME_METRIC
+        if self.volume_metric == 'peak':
+            self._window_volume = self._chunk_peak
+            threshold_scale = PEAK_PER_MEAN_ABS
+        else:
+            self._window_volume = self._chunk_rms
+            threshold_scale = RMS_PER_MEAN_ABS
+        self.volume_threshold = int(round(app_config.VOICE_VOLUME_THRESHOLD * threshold_scale))
+        
+        # Скользящая оценка фонового шума (EWMA громкости в тишине), сохраняется между сессиями
+        self._noise_ewma = 0.0
+        self._base_energy_threshold = (
+            self.speech_recognizer.recognizer.energy_threshold
+            if self.speech_recognizer.recognizer else 300
+        )
         
         self.recording_thread = None
         self.pyaudio_instance = None
+        # Распознавание идёт в отдельном потоке, пока запись продолжается.
+        # Один исполнитель сохраняет порядок фраз, семафор ограничивает очередь
+        self._stt_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stt')
+        self._stt_slots = threading.BoundedSemaphore(2)
+        
+        # Чанки от драйвера (callback-режим PyAudio) для потока записи
+        self._frame_queue: "queue.SimpleQueue[bytes]" = queue.SimpleQueue()
+        
+        # Режим одного вопроса (listen_for_question_streaming): распознанные фразы и результат
+        self._question_phrases: Optional[list] = None
+        self._question_future: Optional[Future] = None
         
         print("🎵 Аудио модуль инициализирован")
         self.print_status()
     
+    def prewarm(self):
+        """
+        Прогрев аудио перед первым обращением пользователя
+        
+        Инициализация PortAudio (опрос всех устройств) и запуск потоков
+        выполняются здесь, а не на первом 'listen' или первой озвучке.
+        """
+        try:
+            if pyaudio is not None and self.config.stt_enabled:
+                self.pyaudio_instance = _get_pyaudio()
+            self.tts.prewarm()
+        except Exception as e:
+            print(f"⚠️  Прогрев аудио не удался: {e}")
+    
     def print_status(self):
         """Вывод статуса аудио модуля"""
         print(f"🎤 Распознавание речи: {'✅' if self.config.stt_enabled else '❌'} ({self.config.stt_engine})")
@@ -409,6 +1050,50 @@ class AudioHandler:
         """
         return self.speech_recognizer.listen_for_speech(timeout)
     
+    def listen_for_question_streaming(self) -> "Future[Optional[str]]":
+        """
+        Слушает один вопрос в фоне и возвращает Future с распознанным текстом
+        
+        Запись идет в callback-режиме постоянно открытого потока, конец фразы
+        определяется автоматом тишины, и распознавание стартует сразу по паузе
+        в потоке STT. Если непрерывная запись недоступна - listen_for_question
+        выполняется в отдельном потоке.
+        """
+        if self._question_future is not None and not self._question_future.done():
+            return self._question_future
+        
+        self._question_phrases = []
+        self._question_future = Future()
+        result = self.start_listening()
+        if result.get('status') != 'started':
+            self._question_phrases = None
+            future = self._question_future
+            self._question_future = None
+            threading.Thread(
+                target=lambda: future.set_result(self.listen_for_question()),
+                name='listen-question', daemon=True
+            ).start()
+            return future
+        return self._question_future
+    
+    def _finish_question(self):
+        """Завершение вопроса: результат отдается после всех фраз в очереди STT"""
+        future = self._question_future
+        if future is None:
+            return
+        
+        def resolve():
+            phrases = self._question_phrases or []
+            self._question_phrases = None
+            self._question_future = None
+            future.set_result(" ".join(phrases) or None)
+        
+        # Один исполнитель STT: resolve выполнится после распознавания последней фразы
+        try:
+            self._stt_executor.submit(resolve)
+        except RuntimeError:
+            resolve()
+    
     def speak_answer(self, answer: str, play_async: Optional[bool] = None) -> Optional[str]:
         """
         Озвучивает ответ
@@ -449,92 +1134,106 @@ class AudioHandler:
         if self.is_listening:
             return {'status': 'already_listening'}
         
-        if np is None:
+        if np is None and audioop is None:
             return {'status': 'error', 'message': 'numpy не установлен'}
         
         if pyaudio is None:
             return {'status': 'error', 'message': 'pyaudio не установлен'}
         
         try:
-            import time
-            
             self.is_listening = True
-            self.audio_frames = []
+            self._ring_pos = 0
+            self._frame_queue = queue.SimpleQueue()
             self.last_speech_time = time.time()
             
             if pyaudio is None:
                 raise Exception("PyAudio не установлен")
             
-            self.pyaudio_instance = pyaudio.PyAudio()
+            # PyAudio и поток открываются один раз, дальше поток только запускается/останавливается
+            if self.pyaudio_instance is None:
+                self.pyaudio_instance = _get_pyaudio()
             
-            # Открываем аудиопоток
-            self.audio_stream = self.pyaudio_instance.open(
-                format=pyaudio.paInt16,
-                channels=1,
-                rate=self.config.sample_rate,
-                input=True,
-                frames_per_buffer=self.config.chunk_size
-            )
+            if self.audio_stream is None:
+                # Открываем аудиопоток в callback-режиме: драйвер сам кладёт чанки в очередь
+                self.audio_stream = self.pyaudio_instance.open(
+                    format=pyaudio.paInt16,
+                    channels=1,
+                    rate=self.config.sample_rate,
+                    input=True,
+                    frames_per_buffer=self.config.chunk_size,
+                    stream_callback=self._on_audio,
+                    start=False
+                )
+                atexit.register(self._close_audio_stream)
+            
+            self.audio_stream.start_stream()
             
             print("🎤 Начата запись голоса (2 сек молчания = отправка, 5 сек = отключение)")
             
             def recording_worker():
                 """Фоновый поток для непрерывной записи"""
-                import time
-                
-                silence_start = None
+                silence_start = -1.0
                 has_speech = False
+                last_speech = self.last_speech_time
+                window_start = 0  # начало текущего окна громкости в буфере фразы
                 
                 while self.is_listening:
                     try:
-                        # Чтение аудио данных
-                        audio_data = self.audio_stream.read(self.config.chunk_size, exception_on_overflow=False)
-                        self.audio_frames.append(audio_data)
+                        # Ожидание чанка от драйвера (без активного опроса)
+                        try:
+                            audio_data = self._frame_queue.get(timeout=0.1)
+                        except queue.Empty:
+                            audio_data = None
                         
-                        # Определение уровня громкости (простая эвристика)
-                        audio_array = np.frombuffer(audio_data, dtype=np.int16)
-                        volume = np.abs(audio_array).mean()
+                        if audio_data is not None:
+                            self._append_frame(audio_data)
+                            if self._ring_pos - window_start < self._window_bytes:
+                                continue  # окно ещё не заполнено
+                            
+                            # Определение уровня громкости по всему окну (RMS за один проход)
+                            with memoryview(self._ring) as ring_view:
+                                volume = self._window_volume(ring_view[window_start:self._ring_pos])
+                            window_start = self._ring_pos
+                        else:
+                            volume = 0
                         
                         current_time = time.time()
+                        # Порог речи не ниже настроенного и не ниже удвоенного фонового шума
+                        speech_threshold = max(self.volume_threshold, 2.0 * self._noise_ewma)
+                        has_speech, silence_start, last_speech, action = _update_silence_fsm(
+                            float(volume), has_speech, silence_start, last_speech, current_time,
+                            float(speech_threshold), float(self.silence_threshold),
+                            float(self.inactivity_timeout)
+                        )
+                        self.last_speech_time = last_speech
                         
-                        # Если громкость выше порога - есть речь
-                        if volume > self.volume_threshold:
-                            has_speech = True
-                            silence_start = None
-                            self.last_speech_time = current_time
-                        else:
-                            # Тишина
-                            if has_speech and silence_start is None:
-                                silence_start = current_time
-                            
-                            if silence_start:
-                                silence_duration = current_time - silence_start
-                                
-                                # 2 секунды тишины после речи = конец предложения
-                                if silence_duration >= self.silence_threshold and has_speech:
-                                    print("✅ Обнаружена пауза 2 сек - распознавание...")
-                                    self._process_recorded_audio()
-                                    
-                                    # Сброс для следующей фразы
-                                    self.audio_frames = []
-                                    has_speech = False
-                                    silence_start = None
-                                    # Обновляем last_speech_time чтобы дать пользователю ещё 5 секунд
-                                    self.last_speech_time = current_time
+                        if audio_data is not None and not has_speech:
+                            self._update_noise_floor(volume)
                         
-                        # Проверка таймаута бездействия (5 секунд)
-                        if current_time - self.last_speech_time > self.inactivity_timeout:
+                        if action == FSM_FLUSH:
+                            print("✅ Обнаружена пауза 2 сек - распознавание...")
+                            self._process_recorded_audio()
+                            
+                            # Сброс для следующей фразы (буфер переиспользуется)
+                            self._ring_pos = 0
+                            window_start = 0
+                            
+                            if self._question_future is not None:
+                                # Вопрос закончен - запись больше не нужна
+                                self.stop_listening()
+                                break
+                        elif action == FSM_STOP:
+                            # Проверка таймаута бездействия (5 секунд)
                             print("⏰ Таймаут 5 секунд - отключение записи")
                             self.stop_listening()
                             break
                         
-                        time.sleep(0.01)  # Небольшая задержка
-                        
                     except Exception as e:
                         print(f"❌ Ошибка записи: {e}")
                         break
                 
                 print("🛑 Запись завершена")
+                self._finish_question()
             
             # Запуск потока записи
             self.recording_thread = threading.Thread(target=recording_worker, daemon=True)
@@ -547,48 +1246,118 @@ class AudioHandler:
             self.is_listening = False
             return {'status': 'error', 'message': str(e)}
     
+    @staticmethod
+    def _chunk_rms(audio_data) -> int:
+        """RMS громкость 16-битного фрагмента (bytes или memoryview) в целых числах"""
+        if audioop is not None:
+            return audioop.rms(audio_data, 2)
+        
+        if np is not None:
+            # frombuffer - представление без копирования, сумма квадратов в int64 без переполнения
+            audio_array = np.frombuffer(audio_data, dtype=np.int16)
+            if not audio_array.size:
+                return 0
+            energy = int(np.einsum('i,i->', audio_array, audio_array, dtype=np.int64))
+            return math.isqrt(energy // audio_array.size)
+        
+        # Без numpy: целочисленное представление memoryview без копирования
+        samples = memoryview(audio_data).cast('B').cast('h')
+        if not len(samples):
+            return 0
+        return math.isqrt(sum(x * x for x in samples) // len(samples))
+    
+    @staticmethod
+    def _chunk_peak(audio_data) -> int:
+        """Пиковая амплитуда 16-битного фрагмента (bytes или memoryview)"""
+        if audioop is not None:
+            return audioop.max(audio_data, 2)
+        
+        if np is not None:
+            audio_array = np.frombuffer(audio_data, dtype=np.int16)
+            if not audio_array.size:
+                return 0
+            # max/min вместо np.abs - без временного массива
+            return max(int(audio_array.max()), -int(audio_array.min()))
+        
+        samples = memoryview(audio_data).cast('B').cast('h')
+        if not len(samples):
+            return 0
+        return max(max(samples), -min(samples))
+    
+    def _update_noise_floor(self, volume: float):
+        """Обновление оценки фонового шума и порога recognizer по окну тишины"""
+        self._noise_ewma = 0.9 * self._noise_ewma + 0.1 * volume
+        if self.speech_recognizer.recognizer:
+            self.speech_recognizer.recognizer.energy_threshold = max(
+                self._base_energy_threshold, 1.5 * self._noise_ewma
+            )
+    
+    def _on_audio(self, in_data, frame_count, time_info, status):
+        """Callback PyAudio: передаёт чанк в поток записи"""
+        self._frame_queue.put_nowait(in_data)
+        return (None, pyaudio.paContinue)
+    
+    def _append_frame(self, audio_data: bytes):
+        """Дописывает чанк в буфер фразы, расширяя его при необходимости"""
+        end = self._ring_pos + len(audio_data)
+        if end > len(self._ring):
+            self._ring.extend(bytes(max(end - len(self._ring), len(self._ring))))
+        self._ring[self._ring_pos:end] = audio_data
+        self._ring_pos = end
+    
     def _process_recorded_audio(self):
         """Обработка записанного аудио (распознавание)"""
-        if not self.audio_frames or len(self.audio_frames) < 10:
+        if self._ring_pos < 10 * self.config.chunk_size * 2:
             # Пропускаем если фреймов мало (< 0.25 сек) - это артефакты
             return
         
-        try:
-            # Собираем все фреймы в один WAV
-            import wave
-            import io
-            
-            wav_buffer = io.BytesIO()
-            with wave.open(wav_buffer, 'wb') as wf:
-                wf.setnchannels(1)
-                wf.setsampwidth(2)  # 16-bit audio = 2 bytes
-                wf.setframerate(self.config.sample_rate)
-                wf.writeframes(b''.join(self.audio_frames))
-            
-            wav_buffer.seek(0)
-            
-            # Распознавание через speech_recognition
-            if sr and self.speech_recognizer.recognizer:
-                audio_data = sr.AudioData(wav_buffer.read(), self.config.sample_rate, 2)
-                
-                try:
-                    text = self.speech_recognizer.recognizer.recognize_google(
-                        audio_data, 
-                        language=self.config.stt_language
-                    )
-                    
-                    if text:
-                        print(f"🗣️  Распознано: {text}")
-                        # TODO: Отправить текст в веб-интерфейс через callback
-                        self._on_text_recognized(text)
-                    
-                except sr.UnknownValueError:
-                    print("❓ Речь не распознана")
-                except sr.RequestError as e:
-                    print(f"❌ Ошибка API: {e}")
+        # Снимок фразы: буфер сразу переиспользуется для следующей
+        pcm_bytes = bytes(memoryview(self._ring)[:self._ring_pos])
         
+        # Не больше двух фраз в работе - иначе поток записи ждёт свободный слот
+        self._stt_slots.acquire()
+        try:
+            future = self._stt_executor.submit(self._recognize_blocking, pcm_bytes)
+        except RuntimeError:
+            self._stt_slots.release()
+            return
+        future.add_done_callback(self._on_recognition_done)
+    
+    def _on_recognition_done(self, future):
+        """Завершение фонового распознавания"""
+        self._stt_slots.release()
+        try:
+            text = future.result()
         except Exception as e:
             print(f"❌ Ошибка обработки аудио: {e}")
+            return
+        
+        if text:
+            if self._question_phrases is not None:
+                self._question_phrases.append(text)
+            self._on_text_recognized(text)
+    
+    def _recognize_blocking(self, pcm_bytes: bytes) -> Optional[str]:
+        """Распознавание фразы (выполняется в пуле потоков)"""
+        # Распознавание через speech_recognition
+        if not (sr and self.speech_recognizer.recognizer):
+            return None
+        
+        # AudioData принимает сырые PCM фреймы - WAV контейнер здесь не нужен
+        audio_data = sr.AudioData(pcm_bytes, self.config.sample_rate, 2)
+        
+        try:
+            text = self.speech_recognizer._recognize_with_google(audio_data)
+        except sr.UnknownValueError:
+            print("❓ Речь не распознана")
+            return None
+        except sr.RequestError as e:
+            print(f"❌ Ошибка API: {e}")
+            return None
+        
+        if text:
+            print(f"🗣️  Распознано: {text}")
+        return text
     
     def _on_text_recognized(self, text: str):
         """Callback для обработки распознанного текста"""
@@ -604,14 +1373,9 @@ class AudioHandler:
         self.is_listening = False
         
         try:
-            if self.audio_stream:
+            # Поток не закрывается - следующая запись просто запустит его снова
+            if self.audio_stream and self.audio_stream.is_active():
                 self.audio_stream.stop_stream()
-                self.audio_stream.close()
-                self.audio_stream = None
-            
-            if self.pyaudio_instance:
-                self.pyaudio_instance.terminate()
-                self.pyaudio_instance = None
             
             print("🛑 Запись остановлена")
             
@@ -624,6 +1388,16 @@ class AudioHandler:
             print(f"❌ Ошибка остановки: {e}")
             return None
     
+    def _close_audio_stream(self):
+        """Закрытие аудиопотока при выходе из процесса"""
+        if self.audio_stream is not None:
+            try:
+                self.audio_stream.stop_stream()
+                self.audio_stream.close()
+            except Exception:
+                pass
+            self.audio_stream = None
+    
     def resume_listening(self):
         """Возобновление записи после ответа нейросети"""
         if not self.is_listening:
@@ -4,56 +4,201 @@ Chat Logger - Логирование диалогов в файл
 """
 
 import os
-from datetime import datetime
+import time
+import atexit
+import threading
+from collections import deque
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
+
+# Неизменяемые части записей лога собираются один раз при импорте
+_EQ80 = '=' * 80
+_DASH80 = '─' * 80
+_SRC_EMOJI = {
+    "text": "💬",
+    "voice": "🎤",
+    "gesture": "👋"
+}
+# Готовые префиксы записи пользователя для каждого источника
+_USER_PREFIX = {source: f"{emoji} ПОЛЬЗОВАТЕЛЬ ({source})" for source, emoji in _SRC_EMOJI.items()}
+_DEF_EMOJI = "📝"
+_HEADER_TMPL = (
+    f"{_EQ80}\n"
+    "CHAT LOG - AI-Консультант ПАО «Транснефть»\n"
+    "Дата начала сессии: {started}\n"
+    f"{_EQ80}\n\n"
+)
+_FOOTER_TMPL = (
+    f"\n{_EQ80}\n"
+    "Сессия завершена: {finished}\n"
+    "Лог сохранён: {log_file}\n"
+    f"{_EQ80}\n"
+)
+
+def _noop(*args, **kwargs):
+    """Заглушка для методов отключённого логгера"""
+    return None
+
+
+def _verbose() -> bool:
+    """VERBOSE_LOGGING из config.py (импорт при первом обращении - без циклических импортов)"""
+    global _VERBOSE
+    if _VERBOSE is None:
+        try:
+            from config import VERBOSE_LOGGING
+            _VERBOSE = bool(VERBOSE_LOGGING)
+        except ImportError:
+            _VERBOSE = True
+    return _VERBOSE
+
+
+_VERBOSE = None
+
+
+# Кэш метки времени: strftime пересчитывается только при смене секунды
+_last_ts_int = 0
+_last_ts_str = ""
+
+
+def _ts() -> str:
+    """Текущее время в формате ЧЧ:ММ:СС"""
+    global _last_ts_int, _last_ts_str
+    t = int(time.time())
+    if t != _last_ts_int:
+        _last_ts_str = time.strftime("%H:%M:%S", time.localtime(t))
+        _last_ts_int = t
+    return _last_ts_str
 
 
 class ChatLogger:
     """Класс для логирования чат-диалогов"""
     
-    def __init__(self, log_dir: str = "chat_logs", session_name: Optional[str] = None):
+    LOG_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_APPEND | getattr(os, 'O_BINARY', 0)
+    FLUSH_INTERVAL = 0.05   # сек между фоновыми сбросами очереди
+    FLUSH_THRESHOLD = 64    # записей в очереди, при которых поток будится досрочно
+    MAX_BATCH_BUFFER = 1 << 17  # буфер пачки крупнее 128 КБ не удерживается между сбросами
+    _LOG_METHODS = ('log_user_message', 'log_assistant_thinking', 'log_assistant_answer',
+                    'log_error', 'log_system_event', 'flush', 'close')
+    
+    def __init__(self, log_dir: str = "chat_logs", session_name: Optional[str] = None,
+                 fsync_on_error: bool = True, enabled: bool = True):
         """
         Инициализация логгера
         
         Args:
             log_dir: Директория для логов
             session_name: Имя сессии (если None - генерируется автоматически)
+            fsync_on_error: Сбрасывать лог на диск (fsync) при записи ошибки
+            enabled: False - логгер ничего не делает (файл не создаётся)
         """
+        self.enabled = enabled
+        self.log_file = None
+        self._fd = None
+        
+        if not enabled:
+            # Методы логирования подменяются заглушками: без форматирования и меток времени
+            for name in self._LOG_METHODS:
+                setattr(self, name, _noop)
+            return
+        
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(exist_ok=True)
         
         # Генерация имени файла
         if session_name is None:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
             session_name = f"chat_{timestamp}"
         
         self.log_file = self.log_dir / f"{session_name}.log"
-        self.enabled = True
+        self.fsync_on_error = fsync_on_error
+        
+        # Файл открывается один раз как сырой дескриптор: пачки уже собираются в памяти,
+        # поэтому буферизация Python (BufferedWriter/TextIOWrapper) не нужна.
+        # Записи кодируются в UTF-8 один раз и уходят в файл через os.write
+        self._fd = os.open(self.log_file, self.LOG_OPEN_FLAGS, 0o644)
+        
+        # Записи копятся в очереди и пишутся в файл фоновым потоком пачками -
+        # вызывающий (чат) не ждёт диска
+        self._queue = deque()
+        self._lock = threading.Lock()      # очередь записей
+        self._io_lock = threading.Lock()   # файл
+        self._wakeup = threading.Event()
+        self._closing = False
+        self._batch_buf = bytearray()  # переиспользуемый буфер пачки (только под _io_lock)
+        self._flush_thread = threading.Thread(target=self._flush_worker, name='chat-log', daemon=True)
+        self._flush_thread.start()
+        atexit.register(self.close)
         
         # Создание заголовка лога
         self._write_header()
     
     def _write_header(self):
         """Запись заголовка лога"""
-        header = f"""{'=' * 80}
-CHAT LOG - AI-Консультант ПАО «Транснефть»
-Дата начала сессии: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-{'=' * 80}
-
-"""
+        header = _HEADER_TMPL.format(started=time.strftime("%Y-%m-%d %H:%M:%S"))
         self._write_to_file(header)
     
-    def _write_to_file(self, text: str):
-        """Запись текста в файл"""
-        if not self.enabled:
+    def _write_to_file(self, text: Union[str, bytes]):
+        """Постановка текста в очередь записи"""
+        if not self.enabled or self._fd is None:
             return
         
-        try:
-            with open(self.log_file, 'a', encoding='utf-8') as f:
-                f.write(text)
-        except Exception as e:
-            print(f"⚠️ Ошибка записи в лог: {e}")
+        if isinstance(text, str):
+            text = text.encode('utf-8')
+        
+        with self._lock:
+            self._queue.append(text)
+            queued = len(self._queue)
+        if queued >= self.FLUSH_THRESHOLD:
+            self._wakeup.set()
+    
+    def _flush_worker(self):
+        """Фоновый поток: сбрасывает очередь раз в FLUSH_INTERVAL или по заполнению"""
+        while True:
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self._drain()
+            if self._closing:
+                break
+    
+    def _drain(self):
+        """Запись накопленной очереди одним вызовом write"""
+        with self._io_lock:
+            with self._lock:
+                if not self._queue:
+                    return
+                batch, self._queue = self._queue, deque()
+            
+            if self._fd is None:
+                return
+            
+            buf = self._batch_buf
+            for item in batch:
+                buf += item
+            try:
+                # os.write может записать не всё - дописываем остаток
+                with memoryview(buf) as view:
+                    written = 0
+                    while written < len(view):
+                        written += os.write(self._fd, view[written:])
+            except Exception as e:
+                self._report_write_error(e)
+            finally:
+                # Буфер очищается и переиспользуется; после крупной пачки память отдаётся
+                if len(buf) > self.MAX_BATCH_BUFFER:
+                    self._batch_buf = bytearray()
+                else:
+                    buf.clear()
+    
+    def _report_write_error(self, error: Exception):
+        """Ошибка записи сообщается один раз, дальше логирование отключается"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        print(f"⚠️ Ошибка записи в лог: {error} - логирование отключено")
+    
+    def flush(self):
+        """Синхронный сброс очереди лога в файл"""
+        self._drain()
     
     def log_user_message(self, message: str, source: str = "text"):
         """
@@ -63,19 +208,11 @@ CHAT LOG - AI-Консультант ПАО «Транснефть»
             message: Текст сообщения
             source: Источник (text/voice/gesture)
         """
-        timestamp = datetime.now().strftime("%H:%M:%S")
+        timestamp = _ts()
         
-        source_emoji = {
-            "text": "💬",
-            "voice": "🎤",
-            "gesture": "👋"
-        }.get(source, "📝")
+        prefix = _USER_PREFIX.get(source) or f"{_DEF_EMOJI} ПОЛЬЗОВАТЕЛЬ ({source})"
         
-        log_entry = f"""
-{'─' * 80}
-[{timestamp}] {source_emoji} ПОЛЬЗОВАТЕЛЬ ({source}):
-{message}
-"""
+        log_entry = f"\n{_DASH80}\n[{timestamp}] {prefix}:\n{message}\n"
         self._write_to_file(log_entry)
     
     def log_assistant_thinking(self, thinking: str):
@@ -88,7 +225,7 @@ CHAT LOG - AI-Консультант ПАО «Транснефть»
         if not thinking:
             return
         
-        timestamp = datetime.now().strftime("%H:%M:%S")
+        timestamp = _ts()
         
         log_entry = f"""
 [{timestamp}] 💭 AI РАЗМЫШЛЕНИЯ (Thinking):
@@ -103,7 +240,7 @@ CHAT LOG - AI-Консультант ПАО «Транснефть»
         Args:
             answer: Текст ответа
         """
-        timestamp = datetime.now().strftime("%H:%M:%S")
+        timestamp = _ts()
         
         log_entry = f"""
 [{timestamp}] 🤖 AI ОТВЕТ:
@@ -118,13 +255,23 @@ CHAT LOG - AI-Консультант ПАО «Транснефть»
         Args:
             error: Описание ошибки
         """
-        timestamp = datetime.now().strftime("%H:%M:%S")
+        timestamp = _ts()
         
         log_entry = f"""
 [{timestamp}] ❌ ОШИБКА:
 {error}
 """
         self._write_to_file(log_entry)
+        
+        # Ошибка может предшествовать падению - фиксируем лог на диске
+        if self.fsync_on_error and self._fd is not None:
+            self._drain()
+            with self._io_lock:
+                try:
+                    if self._fd is not None:
+                        os.fsync(self._fd)
+                except Exception as e:
+                    self._report_write_error(e)
     
     def log_system_event(self, event: str):
         """
@@ -133,7 +280,7 @@ CHAT LOG - AI-Консультант ПАО «Транснефть»
         Args:
             event: Описание события
         """
-        timestamp = datetime.now().strftime("%H:%M:%S")
+        timestamp = _ts()
         
         log_entry = f"""
 [{timestamp}] ⚙️ СИСТЕМА:
@@ -143,11 +290,29 @@ CHAT LOG - AI-Консультант ПАО «Транснефть»
     
     def close(self):
         """Закрытие лога"""
-        footer = f"""
-{'=' * 80}
-Сессия завершена: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-Лог сохранён: {self.log_file}
-{'=' * 80}
-"""
+        if self._fd is None:
+            return
+        
+        footer = _FOOTER_TMPL.format(
+            finished=time.strftime("%Y-%m-%d %H:%M:%S"),
+            log_file=self.log_file
+        )
         self._write_to_file(footer)
-        print(f"📄 Лог диалога сохранён: {self.log_file}")
+        
+        # Остановка фонового потока с финальным сбросом очереди
+        self._closing = True
+        self._wakeup.set()
+        self._flush_thread.join()
+        self._drain()
+        
+        with self._io_lock:
+            fd, self._fd = self._fd, None
+            try:
+                os.fsync(fd)
+            except Exception as e:
+                self._report_write_error(e)
+            finally:
+                os.close(fd)
+        atexit.unregister(self.close)
+        if _verbose():
+            print(f"📄 Лог диалога сохранён: {self.log_file}")
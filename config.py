@@ -5,11 +5,18 @@
 Теперь config.json больше не нужен - всё здесь!
 """
 
+import sys
+from dataclasses import dataclass, asdict
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, Tuple
+
 # ════════════════════════════════════════════════════════════════════════════════
 # 🗂️ МОДЕЛЬ LLM (Пути и технические параметры)
 # ════════════════════════════════════════════════════════════════════════════════
 
 # Путь к файлу модели (GGUF)
+# Используйте 4-битную квантизацию (Q4_K_M / Q4_K_S): генерация ограничена чтением
+# весов из памяти, и f16 модель того же размера отвечает в ~3-4 раза медленнее
 MODEL_PATH = "J:/models-LM Studio/mradermacher/Huihui-Qwen3-4B-Thinking-2507-abliterated-GGUF/Huihui-Qwen3-4B-Thinking-2507-abliterated.Q4_K_S.gguf"
 
 # Размер контекста (в токенах)
@@ -30,6 +37,12 @@ MAIN_GPU = 0
 # Больше = быстрее, но больше VRAM
 BATCH_SIZE = 512
 
+# Адрес общего llama.cpp сервера (None = модель загружается в этот процесс)
+# Сервер с непрерывным батчингом обслуживает консоль, веб-интерфейс и QA одной моделью:
+#   llama-server -m model.gguf -c 32768 -ngl -1 -fa -np 4 --cont-batching
+# Пример: "http://127.0.0.1:8080"
+LLM_SERVER_URL = None
+
 # ════════════════════════════════════════════════════════════════════════════════
 # 💾 ПАМЯТЬ И ОПТИМИЗАЦИЯ
 # ════════════════════════════════════════════════════════════════════════════════
@@ -42,13 +55,16 @@ USE_MLOCK = False
 
 # Тип квантизации KV кэша для ключей (keys)
 # Опции: 'f32', 'f16', 'q8_0', 'q8_1', 'q5_0', 'q5_1', 'q4_0', 'q4_1'
-# q8_0 = оптимальный баланс (качество/скорость/память)
+# q8_0 = оптимальный баланс (качество/скорость/память), ключи чувствительнее к квантизации
 KV_CACHE_TYPE_K = "q8_0"
 
 # Тип квантизации KV кэша для значений (values)
-KV_CACHE_TYPE_V = "q8_0"
+# q4_0 = ~1/4 памяти f16 при небольшой потере качества
+# Квантизованный KV кэш на CUDA требует Flash Attention, а разные типы K и V -
+# сборки llama-cpp-python с GGML_CUDA_FA_ALL_QUANTS=ON
+KV_CACHE_TYPE_V = "q4_0"
 
-# Flash Attention (ускоряет генерацию)
+# Flash Attention (ускоряет генерацию, обязателен для квантизованного KV кэша на GPU)
 FLASH_ATTENTION = True
 
 # RoPE scaling type (для больших контекстов)
@@ -62,6 +78,12 @@ SPLIT_MODE = 1
 # NUMA оптимизация (для серверов с несколькими CPU)
 NUMA = False
 
+# Потоки CPU для генерации (None = число физических ядер, SMT не помогает)
+CPU_THREADS = None
+
+# Потоки CPU для обработки промпта (None = число логических ядер)
+CPU_THREADS_BATCH = None
+
 
 # ════════════════════════════════════════════════════════════════════════════════
 # 🤖 ГЕНЕРАЦИЯ ТЕКСТА (LLM)
@@ -90,6 +112,18 @@ MAX_TOKENS = -1
 # 1024 = ~750 слов
 MAX_THINKING_TOKENS = 1024
 
+# Ограничивать вывод грамматикой "<think>...</think> ответ"
+# Модель не сможет пропустить теги размышлений, ответ всегда разбирается однозначно
+ENFORCE_THINK_TAGS = True
+
+# Кэш ответов: тот же вопрос в том же состоянии диалога отвечается без генерации
+# При TEMPERATURE = 0.0 включается автоматически (ответ детерминирован),
+# иначе - флагом --cache или здесь
+RESPONSE_CACHE = False
+
+# Сколько последних ответов хранить в кэше
+RESPONSE_CACHE_SIZE = 256
+
 
 # ════════════════════════════════════════════════════════════════════════════════
 # 🎤 ГОЛОСОВОЙ ВВОД (Speech-to-Text)
@@ -114,6 +148,11 @@ WHISPER_API_URL = "https://api.openai.com/v1/audio/transcriptions"
 # Чем выше, тем меньше чувствительность к тихим звукам
 VOICE_VOLUME_THRESHOLD = 500
 
+# Метрика громкости для детектора речи: 'rms' (устойчивее к щелчкам) или 'peak'
+# (пиковая амплитуда, чётче отделяет речь от тишины на коротких окнах).
+# Порог выше задаётся в единицах среднего модуля и пересчитывается автоматически
+VOICE_VOLUME_METRIC = "rms"
+
 # Порог тишины для окончания предложения (секунды)
 # Пользователь замолчал → текст распознаётся и отправляется
 SILENCE_THRESHOLD = 2.0
@@ -130,6 +169,24 @@ AUDIO_SAMPLE_RATE = 16000
 # Меньше = быстрее отклик, больше = стабильнее
 AUDIO_CHUNK_SIZE = 1024
 
+# Локальный кэш распознавания (SQLite, ~/.cache/transneft_stt.db)
+# Текст берётся из кэша только для побайтно совпадающей записи (хэш PCM);
+# живой звук с микрофона побайтно не повторяется, поэтому без STT_CACHE_FUZZY
+# кэш срабатывает лишь на повторно воспроизведённых записях
+# ВНИМАНИЕ: в файле хранится текст распознанных фраз пользователей
+STT_CACHE_ENABLED = False
+
+# Поиск похожей записи по аудио-отпечатку (опционально)
+# ВНИМАНИЕ: при ложном совпадении ассистент получит текст другой фразы
+STT_CACHE_FUZZY = False
+
+# Порог похожести аудио-отпечатков для попадания в кэш (0-1, при STT_CACHE_FUZZY)
+# Чем выше, тем меньше риск вернуть текст другой фразы
+STT_CACHE_SIMILARITY = 0.97
+
+# Сколько последних фраз хранить в кэше (давно не использованные удаляются)
+STT_CACHE_MAX_ROWS = 500
+
 
 # ════════════════════════════════════════════════════════════════════════════════
 # 🔊 ОЗВУЧИВАНИЕ ОТВЕТОВ (Text-to-Speech)
@@ -183,6 +240,10 @@ CAMERA_FPS = 16
 # Разрешение камеры [ширина, высота]
 CAMERA_RESOLUTION = [640, 480]
 
+# Качество JPEG для трансляции камеры в веб-интерфейс (0-100)
+# Кадр кодируется один раз и отдается всем подключенным клиентам
+CAMERA_JPEG_QUALITY = 80
+
 # Уверенность детекции жестов (0.0-1.0)
 # Чем выше, тем меньше ложных срабатываний
 GESTURE_CONFIDENCE = 0.6
@@ -204,6 +265,14 @@ MEDIAPIPE_MODEL_COMPLEXITY = 1  # 0 = lite, 1 = full, 2 = heavy
 MEDIAPIPE_MIN_DETECTION_CONFIDENCE = 0.7
 MEDIAPIPE_MIN_TRACKING_CONFIDENCE = 0.5
 MEDIAPIPE_MAX_NUM_HANDS = 2
+# GPU делегат MediaPipe (OpenGL ES; в Python работает на Linux/macOS, на Windows - откат на CPU)
+MEDIAPIPE_USE_GPU = True
+# Максимальная ширина кадра для распознавания жестов (пропорции сохраняются)
+# Детектор ладони работает на 192x192, а крупные кадры MediaPipe уменьшает сам на каждом вызове
+MEDIAPIPE_INPUT_WIDTH = 320
+# Порог движения: средняя разница яркости (0-255) кадра 96x96 с последним распознанным.
+# Ниже порога сцена считается неподвижной и используется прошлый результат (0 = всегда распознавать)
+GESTURE_MOTION_THRESHOLD = 1.0
 
 # Обработка кадров
 FRAME_SKIP = 2  # Пропускать каждый N-й кадр для экономии CPU
@@ -245,138 +314,207 @@ SHOW_THINKING_TO_USER = True
 # ⚙️ СЛУЖЕБНЫЕ ФУНКЦИИ
 # ════════════════════════════════════════════════════════════════════════════════
 
-def get_model_config() -> dict:
-    """Получить настройки модели и памяти"""
-    return {
-        'path': MODEL_PATH,
-        'context_size': CONTEXT_SIZE,
-        'gpu_layers': GPU_LAYERS,
-        'main_gpu': MAIN_GPU,
-        'batch_size': BATCH_SIZE,
-        'use_mmap': USE_MMAP,
-        'use_mlock': USE_MLOCK,
-        'kv_cache_type_k': KV_CACHE_TYPE_K,
-        'kv_cache_type_v': KV_CACHE_TYPE_V,
-        'flash_attention': FLASH_ATTENTION,
-        'rope_scaling_type': ROPE_SCALING_TYPE,
-        'split_mode': SPLIT_MODE,
-        'numa': NUMA
-    }
-
-
-def get_generation_config() -> dict:
-    """Получить настройки генерации текста для LLM"""
-    return {
-        'temperature': TEMPERATURE,
-        'top_p': TOP_P,
-        'top_k': TOP_K,
-        'min_p': MIN_P,
-        'max_tokens': MAX_TOKENS,
-        'max_thinking_tokens': MAX_THINKING_TOKENS
-    }
-
-
-def get_audio_config() -> dict:
-    """Получить настройки аудио (STT/TTS)"""
-    return {
-        'stt_enabled': STT_ENABLED,
-        'stt_engine': STT_ENGINE,
-        'stt_language': STT_LANGUAGE,
-        'whisper_api_key': WHISPER_API_KEY,
-        'whisper_api_url': WHISPER_API_URL,
-        'volume_threshold': VOICE_VOLUME_THRESHOLD,
-        'silence_threshold': SILENCE_THRESHOLD,
-        'inactivity_timeout': INACTIVITY_TIMEOUT,
-        'sample_rate': AUDIO_SAMPLE_RATE,
-        'chunk_size': AUDIO_CHUNK_SIZE,
-        'tts_enabled': TTS_ENABLED,
-        'tts_engine': TTS_ENGINE,
-        'tts_voice': TTS_VOICE,
-        'tts_rate': TTS_RATE,
-        'tts_volume': TTS_VOLUME,
-        'tts_auto_play': TTS_AUTO_PLAY,
-        'elevenlabs_api_key': ELEVENLABS_API_KEY,
-        'elevenlabs_voice_id': ELEVENLABS_VOICE_ID
-    }
-
-
-def get_vision_config() -> dict:
-    """Получить настройки камеры и жестов"""
-    return {
-        'enabled': VISION_ENABLED,
-        'camera_device_id': CAMERA_DEVICE_ID,
-        'camera_fps': CAMERA_FPS,
-        'camera_resolution': CAMERA_RESOLUTION,
-        'gesture_confidence': GESTURE_CONFIDENCE,
-        'gesture_analysis_interval': GESTURE_ANALYSIS_INTERVAL,
-        'gesture_confirmation_time': GESTURE_CONFIRMATION_TIME,
-        'gesture_inactivity_timeout': GESTURE_INACTIVITY_TIMEOUT,
-        'mediapipe_model_complexity': MEDIAPIPE_MODEL_COMPLEXITY,
-        'mediapipe_min_detection_confidence': MEDIAPIPE_MIN_DETECTION_CONFIDENCE,
-        'mediapipe_min_tracking_confidence': MEDIAPIPE_MIN_TRACKING_CONFIDENCE,
-        'mediapipe_max_num_hands': MEDIAPIPE_MAX_NUM_HANDS,
-        'frame_skip': FRAME_SKIP,
-        'gesture_detection_enabled': GESTURE_DETECTION_ENABLED,
-        'real_time_analysis': REAL_TIME_ANALYSIS,
-        'gesture_recognition': GESTURE_RECOGNITION,
-        'hand_tracking': HAND_TRACKING,
-        'pose_detection': POSE_DETECTION
-    }
-
-
-def get_history_config() -> dict:
-    """Получить настройки истории диалога"""
-    return {
-        'max_messages': MAX_HISTORY_MESSAGES,
-        'keep_full_history': KEEP_FULL_HISTORY
-    }
+# Настройки групп собираются один раз при импорте в неизменяемые dataclass со __slots__
+# (config.MODEL.path, config.AUDIO.sample_rate ...). get_*_config() отдают их же в виде
+# словаря только для чтения (MappingProxyType). Нужна изменяемая копия - dict(get_model_config())
+
+@dataclass(frozen=True, slots=True)
+class ModelConfig:
+    """Модель и память"""
+    path: str = MODEL_PATH
+    context_size: int = CONTEXT_SIZE
+    gpu_layers: int = GPU_LAYERS
+    main_gpu: int = MAIN_GPU
+    batch_size: int = BATCH_SIZE
+    server_url: Optional[str] = LLM_SERVER_URL
+    use_mmap: bool = USE_MMAP
+    use_mlock: bool = USE_MLOCK
+    kv_cache_type_k: str = KV_CACHE_TYPE_K
+    kv_cache_type_v: str = KV_CACHE_TYPE_V
+    flash_attention: bool = FLASH_ATTENTION
+    rope_scaling_type: int = ROPE_SCALING_TYPE
+    split_mode: int = SPLIT_MODE
+    numa: bool = NUMA
+    cpu_threads: Optional[int] = CPU_THREADS
+    cpu_threads_batch: Optional[int] = CPU_THREADS_BATCH
+
+
+MODEL = ModelConfig()
+_MODEL_CONFIG = MappingProxyType(asdict(MODEL))
+
+
+def get_model_config() -> Mapping[str, Any]:
+    """Получить настройки модели и памяти (общий неизменяемый словарь)"""
+    return _MODEL_CONFIG
+
+
+@dataclass(frozen=True, slots=True)
+class GenerationConfig:
+    """Генерация текста"""
+    temperature: float = TEMPERATURE
+    top_p: float = TOP_P
+    top_k: int = TOP_K
+    min_p: float = MIN_P
+    max_tokens: int = MAX_TOKENS
+    max_thinking_tokens: int = MAX_THINKING_TOKENS
+    enforce_think_tags: bool = ENFORCE_THINK_TAGS
+    response_cache: bool = RESPONSE_CACHE
+    response_cache_size: int = RESPONSE_CACHE_SIZE
+
+
+GENERATION = GenerationConfig()
+_GENERATION_CONFIG = MappingProxyType(asdict(GENERATION))
+
+
+def get_generation_config() -> Mapping[str, Any]:
+    """Получить настройки генерации текста для LLM (общий неизменяемый словарь)"""
+    return _GENERATION_CONFIG
+
+
+@dataclass(frozen=True, slots=True)
+class AudioSettings:
+    """Аудио (STT/TTS)"""
+    stt_enabled: bool = STT_ENABLED
+    stt_engine: str = STT_ENGINE
+    stt_language: str = STT_LANGUAGE
+    whisper_api_key: str = WHISPER_API_KEY
+    whisper_api_url: str = WHISPER_API_URL
+    volume_threshold: int = VOICE_VOLUME_THRESHOLD
+    volume_metric: str = VOICE_VOLUME_METRIC
+    silence_threshold: float = SILENCE_THRESHOLD
+    inactivity_timeout: float = INACTIVITY_TIMEOUT
+    sample_rate: int = AUDIO_SAMPLE_RATE
+    chunk_size: int = AUDIO_CHUNK_SIZE
+    stt_cache_enabled: bool = STT_CACHE_ENABLED
+    stt_cache_fuzzy: bool = STT_CACHE_FUZZY
+    stt_cache_similarity: float = STT_CACHE_SIMILARITY
+    stt_cache_max_rows: int = STT_CACHE_MAX_ROWS
+    tts_enabled: bool = TTS_ENABLED
+    tts_engine: str = TTS_ENGINE
+    tts_voice: str = TTS_VOICE
+    tts_rate: int = TTS_RATE
+    tts_volume: float = TTS_VOLUME
+    tts_auto_play: bool = TTS_AUTO_PLAY
+    elevenlabs_api_key: str = ELEVENLABS_API_KEY
+    elevenlabs_voice_id: str = ELEVENLABS_VOICE_ID
+
+
+AUDIO = AudioSettings()
+_AUDIO_CONFIG = MappingProxyType(asdict(AUDIO))
+
+
+def get_audio_config() -> Mapping[str, Any]:
+    """Получить настройки аудио (STT/TTS) (общий неизменяемый словарь)"""
+    return _AUDIO_CONFIG
+
+
+@dataclass(frozen=True, slots=True)
+class VisionConfig:
+    """Камера и жесты"""
+    enabled: bool = VISION_ENABLED
+    camera_device_id: int = CAMERA_DEVICE_ID
+    camera_fps: int = CAMERA_FPS
+    camera_resolution: Tuple[int, ...] = tuple(CAMERA_RESOLUTION)
+    camera_jpeg_quality: int = CAMERA_JPEG_QUALITY
+    gesture_confidence: float = GESTURE_CONFIDENCE
+    gesture_analysis_interval: float = GESTURE_ANALYSIS_INTERVAL
+    gesture_confirmation_time: float = GESTURE_CONFIRMATION_TIME
+    gesture_inactivity_timeout: float = GESTURE_INACTIVITY_TIMEOUT
+    mediapipe_model_complexity: int = MEDIAPIPE_MODEL_COMPLEXITY
+    mediapipe_min_detection_confidence: float = MEDIAPIPE_MIN_DETECTION_CONFIDENCE
+    mediapipe_min_tracking_confidence: float = MEDIAPIPE_MIN_TRACKING_CONFIDENCE
+    mediapipe_max_num_hands: int = MEDIAPIPE_MAX_NUM_HANDS
+    mediapipe_use_gpu: bool = MEDIAPIPE_USE_GPU
+    mediapipe_input_width: int = MEDIAPIPE_INPUT_WIDTH
+    gesture_motion_threshold: float = GESTURE_MOTION_THRESHOLD
+    frame_skip: int = FRAME_SKIP
+    gesture_detection_enabled: bool = GESTURE_DETECTION_ENABLED
+    real_time_analysis: bool = REAL_TIME_ANALYSIS
+    gesture_recognition: bool = GESTURE_RECOGNITION
+    hand_tracking: bool = HAND_TRACKING
+    pose_detection: bool = POSE_DETECTION
+
+
+VISION = VisionConfig()
+_VISION_CONFIG = MappingProxyType(asdict(VISION))
+
+
+def get_vision_config() -> Mapping[str, Any]:
+    """Получить настройки камеры и жестов (общий неизменяемый словарь)"""
+    return _VISION_CONFIG
+
+
+@dataclass(frozen=True, slots=True)
+class HistoryConfig:
+    """История диалога"""
+    max_messages: int = MAX_HISTORY_MESSAGES
+    keep_full_history: bool = KEEP_FULL_HISTORY
+
+
+HISTORY = HistoryConfig()
+_HISTORY_CONFIG = MappingProxyType(asdict(HISTORY))
+
+
+def get_history_config() -> Mapping[str, Any]:
+    """Получить настройки истории диалога (общий неизменяемый словарь)"""
+    return _HISTORY_CONFIG
+
+
+def format_current_config() -> str:
+    """Текущие настройки в виде одного текста для вывода"""
+    lines = [
+        "\n" + "="*80,
+        "⚙️  ТЕКУЩАЯ КОНФИГУРАЦИЯ",
+        "="*80,
+        
+        "\n🗂️  МОДЕЛЬ:",
+        f"  Путь: {MODEL_PATH}",
+        f"  Контекст: {CONTEXT_SIZE} токенов",
+        f"  GPU слои: {GPU_LAYERS}",
+        f"  Batch size: {BATCH_SIZE}",
+        
+        "\n💾 ПАМЯТЬ:",
+        f"  MMAP: {USE_MMAP}",
+        f"  MLOCK: {USE_MLOCK}",
+        f"  KV cache: {KV_CACHE_TYPE_K}/{KV_CACHE_TYPE_V}",
+        f"  Flash Attention: {FLASH_ATTENTION}",
+        
+        "\n🤖 ГЕНЕРАЦИЯ ТЕКСТА:",
+        f"  Temperature: {TEMPERATURE}",
+        f"  Top-p: {TOP_P}",
+        f"  Top-k: {TOP_K}",
+        f"  Max tokens: {MAX_TOKENS}",
+        
+        "\n🎤 ГОЛОСОВОЙ ВВОД:",
+        f"  Включён: {STT_ENABLED}",
+        f"  Движок: {STT_ENGINE}",
+        f"  Язык: {STT_LANGUAGE}",
+        f"  Порог молчания: {SILENCE_THRESHOLD} сек",
+        f"  Таймаут: {INACTIVITY_TIMEOUT} сек",
+        f"  Громкость: {VOICE_VOLUME_THRESHOLD}",
+        
+        "\n🔊 ОЗВУЧИВАНИЕ:",
+        f"  Включено: {TTS_ENABLED}",
+        f"  Движок: {TTS_ENGINE}",
+        f"  Скорость: {TTS_RATE} слов/мин",
+        f"  Громкость: {TTS_VOLUME}",
+        
+        "\n📹 КАМЕРА:",
+        f"  Включена: {VISION_ENABLED}",
+        f"  Device ID: {CAMERA_DEVICE_ID}",
+        f"  FPS: {CAMERA_FPS}",
+        f"  Разрешение: {CAMERA_RESOLUTION}",
+        f"  Качество JPEG: {CAMERA_JPEG_QUALITY}",
+        
+        "="*80 + "\n",
+    ]
+    return "\n".join(lines) + "\n"
 
 
 def print_current_config():
-    """Вывести текущие настройки в консоль"""
-    print("\n" + "="*80)
-    print("⚙️  ТЕКУЩАЯ КОНФИГУРАЦИЯ")
-    print("="*80)
-    
-    print("\n🗂️  МОДЕЛЬ:")
-    print(f"  Путь: {MODEL_PATH}")
-    print(f"  Контекст: {CONTEXT_SIZE} токенов")
-    print(f"  GPU слои: {GPU_LAYERS}")
-    print(f"  Batch size: {BATCH_SIZE}")
-    
-    print("\n💾 ПАМЯТЬ:")
-    print(f"  MMAP: {USE_MMAP}")
-    print(f"  MLOCK: {USE_MLOCK}")
-    print(f"  KV cache: {KV_CACHE_TYPE_K}/{KV_CACHE_TYPE_V}")
-    print(f"  Flash Attention: {FLASH_ATTENTION}")
-    
-    print("\n🤖 ГЕНЕРАЦИЯ ТЕКСТА:")
-    print(f"  Temperature: {TEMPERATURE}")
-    print(f"  Top-p: {TOP_P}")
-    print(f"  Top-k: {TOP_K}")
-    print(f"  Max tokens: {MAX_TOKENS}")
-    
-    print("\n🎤 ГОЛОСОВОЙ ВВОД:")
-    print(f"  Включён: {STT_ENABLED}")
-    print(f"  Движок: {STT_ENGINE}")
-    print(f"  Язык: {STT_LANGUAGE}")
-    print(f"  Порог молчания: {SILENCE_THRESHOLD} сек")
-    print(f"  Таймаут: {INACTIVITY_TIMEOUT} сек")
-    print(f"  Громкость: {VOICE_VOLUME_THRESHOLD}")
-    
-    print("\n🔊 ОЗВУЧИВАНИЕ:")
-    print(f"  Включено: {TTS_ENABLED}")
-    print(f"  Движок: {TTS_ENGINE}")
-    print(f"  Скорость: {TTS_RATE} слов/мин")
-    print(f"  Громкость: {TTS_VOLUME}")
-    
-    print("\n📹 КАМЕРА:")
-    print(f"  Включена: {VISION_ENABLED}")
-    print(f"  Device ID: {CAMERA_DEVICE_ID}")
-    print(f"  FPS: {CAMERA_FPS}")
-    print(f"  Разрешение: {CAMERA_RESOLUTION}")
-    
-    print("="*80 + "\n")
+    """Вывести текущие настройки в консоль (одной записью в stdout)"""
+    sys.stdout.write(format_current_config())
+    sys.stdout.flush()
 
 
 # ════════════════════════════════════════════════════════════════════════════════
@@ -389,7 +527,7 @@ if __name__ == "__main__":
     
     # Примеры получения конфигов
     gen_config = get_generation_config()
-    print(f"Конфиг генерации: {gen_config}")
+    print(f"Конфиг генерации: {dict(gen_config)}")
     
     audio_config = get_audio_config()
-    print(f"Конфиг аудио: {audio_config}")
+    print(f"Конфиг аудио: {dict(audio_config)}")
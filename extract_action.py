@@ -0,0 +1,41 @@
+"""
+Извлечение одной анимации из FBX в отдельный .blend (рабочий процесс для import_model.py)
+
+Запуск:
+    blender --background --factory-startup --python extract_action.py -- <fbx_path> <action_name> <out_blend>
+"""
+
+import sys
+
+import bpy
+
+
+def main() -> int:
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    if len(argv) != 3:
+        print("❌ Использование: extract_action.py -- <fbx_path> <action_name> <out_blend>")
+        return 2
+    fbx_path, action_name, out_blend = argv
+    
+    # Тот же выбор оператора импорта, что и в import_model.py
+    try:
+        bpy.ops.wm.fbx_import.get_rna_type()
+        bpy.ops.wm.fbx_import(filepath=fbx_path, use_anim=True)
+    except (AttributeError, KeyError):
+        bpy.ops.import_scene.fbx(filepath=fbx_path, use_anim=True, use_image_search=False,
+                                 use_subsurf=False, use_custom_props=False)
+    
+    for obj in bpy.data.objects:
+        if obj.type == 'ARMATURE' and obj.animation_data and obj.animation_data.action:
+            action = obj.animation_data.action
+            action.name = action_name
+            bpy.data.libraries.write(out_blend, {action}, fake_user=True)
+            print(f"✅ {action_name}: {len(action.fcurves)} fcurves → {out_blend}")
+            return 0
+    
+    print(f"❌ Анимация не найдена в {fbx_path}")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,9 @@
 
 import bpy
 import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 print("🚀 Импорт модели и анимаций...")
 
@@ -11,6 +14,24 @@ PROJECT_PATH = r"C:\Users\vital\Desktop\Hackathon"
 MODEL_DIR = os.path.join(PROJECT_PATH, "3D")
 OUTPUT_PATH = os.path.join(PROJECT_PATH, "static", "models", "transneft_character.glb")
 
+# Оператор импорта FBX выбирается один раз: wm.fbx_import (Blender 4.x) или import_scene.fbx (3.x)
+try:
+    bpy.ops.wm.fbx_import.get_rna_type()
+    _fbx_import = bpy.ops.wm.fbx_import
+    # У нового импортёра другой набор параметров - передаём только общий
+    _FBX_ANIM_KWARGS = {'use_anim': True}
+    print("   ✅ Используется новый API импорта (Blender 4.x)")
+except (AttributeError, KeyError):
+    _fbx_import = bpy.ops.import_scene.fbx
+    # Только анимация: без поиска текстур, subsurf и custom props
+    _FBX_ANIM_KWARGS = {'use_anim': True, 'use_image_search': False,
+                        'use_subsurf': False, 'use_custom_props': False}
+    print("   ✅ Используется старый API импорта (Blender 3.x)")
+
+# Список файлов модели одним системным вызовом вместо os.path.exists на каждый файл
+with os.scandir(MODEL_DIR) as entries:
+    available_files = {entry.name for entry in entries if entry.is_file()}
+
 # Очистка сцены
 if bpy.context.mode != 'OBJECT':
     bpy.ops.object.mode_set(mode='OBJECT')
@@ -22,19 +43,15 @@ bpy.ops.object.delete()
 print("📦 Импорт базовой FBX модели со скелетом...")
 base_fbx = os.path.join(MODEL_DIR, "Idle.fbx")  # Используем Idle как базу (со скелетом)
 
-# Импорт первого FBX как основы
-try:
-    bpy.ops.wm.fbx_import(filepath=base_fbx)
-    print("   ✅ Использован новый API импорта (Blender 4.x)")
-except AttributeError:
-    bpy.ops.import_scene.fbx(filepath=base_fbx)
-    print("   ✅ Использован старый API импорта (Blender 3.x)")
+# Импорт первого FBX как основы (новые объекты определяем по разнице с bpy.data.objects)
+pre_import = set(bpy.data.objects)
+_fbx_import(filepath=base_fbx)
 
 # Получить армature и модель
 armature = None
 model = None
 
-for obj in bpy.context.selected_objects:
+for obj in [o for o in bpy.data.objects if o not in pre_import]:
     if obj.type == 'ARMATURE':
         armature = obj
         armature.name = "CharacterArmature"
@@ -64,7 +81,7 @@ if armature.animation_data and armature.animation_data.action:
 print("🎨 Применение текстуры из OBJ...")
 texture_png = os.path.join(MODEL_DIR, "Bot.png")
 
-if os.path.exists(texture_png):
+if "Bot.png" in available_files:
     # Загрузить текстуру
     texture_image = bpy.data.images.load(texture_png)
     print(f"   ✅ Загружена текстура: {os.path.basename(texture_png)}")
@@ -115,21 +132,56 @@ animations = {
 
 print("\n🎬 Импорт остальных анимаций...")
 
-for anim_name, fbx_file in animations.items():
-    fbx_path = os.path.join(MODEL_DIR, fbx_file)
+# Каждый FBX разбирается в отдельном фоновом процессе Blender параллельно,
+# результат подгружается из временного .blend. При ошибке - обычный импорт в этой сцене
+PARALLEL_ANIMATION_IMPORT = True
+EXTRACT_ACTION_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extract_action.py")
+
+
+def _extract_actions_parallel(items, out_dir):
+    """Запуск рабочих процессов Blender, возвращает {имя анимации: путь к .blend}"""
+    def run(anim_name, fbx_file):
+        out_blend = os.path.join(out_dir, f"{anim_name}.blend")
+        cmd = [bpy.app.binary_path, "--background", "--factory-startup",
+               "--python", EXTRACT_ACTION_SCRIPT, "--",
+               os.path.join(MODEL_DIR, fbx_file), anim_name, out_blend]
+        result = subprocess.run(cmd, capture_output=True, text=True)
+        if result.returncode != 0 or not os.path.exists(out_blend):
+            print(f"   ⚠️  Рабочий процесс для {anim_name} завершился с ошибкой, импорт в сцене")
+            return anim_name, None
+        return anim_name, out_blend
     
-    if not os.path.exists(fbx_path):
-        print(f"   ⚠️  Файл не найден: {fbx_file}")
-        continue
+    # Потоков достаточно: они только ждут дочерние процессы Blender
+    with ThreadPoolExecutor(max_workers=min(len(items), os.cpu_count() or 1)) as pool:
+        futures = [pool.submit(run, anim_name, fbx_file) for anim_name, fbx_file in items]
+        return {name: path for name, path in (f.result() for f in futures) if path}
+
+
+def _load_extracted_action(blend_path, anim_name):
+    """Подгрузка анимации из временного .blend, True при успехе"""
+    with bpy.data.libraries.load(blend_path, link=False) as (data_from, data_to):
+        data_to.actions = [name for name in data_from.actions if name == anim_name]
+    if not data_to.actions:
+        return False
+    
+    action = data_to.actions[0]
+    action.name = anim_name
+    print(f"   ✅ {anim_name}: {len(action.fcurves)} fcurves")
+    return True
+
+
+def _import_animation_inline(anim_name, fbx_file):
+    """Импорт FBX в текущую сцену только ради его анимации"""
+    fbx_path = os.path.join(MODEL_DIR, fbx_file)
     
     # Импорт FBX только для анимации
-    try:
-        bpy.ops.wm.fbx_import(filepath=fbx_path, use_anim=True)
-    except AttributeError:
-        bpy.ops.import_scene.fbx(filepath=fbx_path, use_anim=True)
+    pre_import = set(bpy.data.objects)
+    pre_meshes = set(bpy.data.meshes)
+    pre_materials = set(bpy.data.materials)
+    _fbx_import(filepath=fbx_path, **_FBX_ANIM_KWARGS)
     
     # Найти импортированный армature и его action
-    imported_objects = list(bpy.context.selected_objects)
+    imported_objects = [obj for obj in bpy.data.objects if obj not in pre_import]
     imported_arm = None
     
     for obj in imported_objects:
@@ -143,13 +195,35 @@ for anim_name, fbx_file in animations.items():
         action.name = anim_name
         print(f"   ✅ {anim_name}: {len(action.fcurves)} fcurves")
     
-    # Удалить все импортированные объекты (анимация уже сохранена в bpy.data.actions)
-    for obj in list(imported_objects):
-        try:
-            if obj.name in bpy.data.objects:
-                bpy.data.objects.remove(obj)
-        except ReferenceError:
-            pass  # Объект уже удалён
+    # Удалить все импортированные объекты одним вызовом (анимация уже сохранена в bpy.data.actions)
+    # вместе с их мешами и материалами - иначе они остаются в файле сиротами
+    to_remove = [obj for obj in imported_objects if obj.name in bpy.data.objects]
+    to_remove += [mesh for mesh in bpy.data.meshes if mesh not in pre_meshes]
+    to_remove += [mat for mat in bpy.data.materials if mat not in pre_materials]
+    if to_remove:
+        bpy.data.batch_remove(ids=to_remove)
+
+
+pending_animations = []
+for anim_name, fbx_file in tuple(animations.items()):
+    if fbx_file not in available_files:
+        print(f"   ⚠️  Файл не найден: {fbx_file}")
+        continue
+    pending_animations.append((anim_name, fbx_file))
+
+with tempfile.TemporaryDirectory() as extract_dir:
+    extracted = {}
+    if PARALLEL_ANIMATION_IMPORT and len(pending_animations) > 1 and os.path.exists(EXTRACT_ACTION_SCRIPT):
+        extracted = _extract_actions_parallel(pending_animations, extract_dir)
+    
+    for anim_name, fbx_file in pending_animations:
+        blend_path = extracted.get(anim_name)
+        if blend_path and _load_extracted_action(blend_path, anim_name):
+            continue
+        _import_animation_inline(anim_name, fbx_file)
+
+# Один пересчёт depsgraph после всего блока импорта анимаций
+bpy.context.view_layer.update()
 
 # ========== ПРОВЕРКА ПРИВЯЗКИ ==========
 
@@ -159,11 +233,21 @@ if model.parent == armature:
     print("   ✅ Модель уже привязана к скелету")
 else:
     print("   ⚠️ Модель не привязана, привязываем...")
-    bpy.ops.object.select_all(action='DESELECT')
-    model.select_set(True)
-    armature.select_set(True)
-    bpy.context.view_layer.objects.active = armature
-    bpy.ops.object.parent_set(type='ARMATURE_AUTO')
+    if model.vertex_groups:
+        # Веса из FBX уже есть - достаточно родителя и модификатора, без операторов
+        model.parent = armature
+        model.matrix_parent_inverse = armature.matrix_world.inverted()
+        modifier = next((m for m in model.modifiers if m.type == 'ARMATURE'), None)
+        if modifier is None:
+            modifier = model.modifiers.new(name="Armature", type='ARMATURE')
+        modifier.object = armature
+    else:
+        # Весов нет - нужен автоматический расчёт, который есть только у оператора
+        bpy.ops.object.select_all(action='DESELECT')
+        model.select_set(True)
+        armature.select_set(True)
+        bpy.context.view_layer.objects.active = armature
+        bpy.ops.object.parent_set(type='ARMATURE_AUTO')
     print("   ✅ Привязка выполнена")
 
 # ========== ЭКСПОРТ ==========
@@ -172,8 +256,9 @@ print("\n📤 Экспорт в glTF...")
 
 # Проверка финальных анимаций
 print("Проверка анимаций:")
-for name in ["Hello", "Idle", "Talking", "Thinking"]:
-    action = bpy.data.actions.get(name)
+actions_by_name = {a.name: a for a in bpy.data.actions}
+for name in ("Hello", "Idle", "Talking", "Thinking"):
+    action = actions_by_name.get(name)
     if action:
         print(f"   ✅ {name} ({len(action.fcurves)} fcurves)")
     else:
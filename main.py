@@ -6,23 +6,39 @@ LLM Chat Interface with GGUF Model Support
 Поддерживает thinking mode и полную выгрузку на GPU.
 """
 
+import io
 import os
+import re
 import sys
 import json
 import argparse
+import functools
+import hashlib
+import mmap
+import queue
+import selectors
+import subprocess
+import textwrap
 import time
-from typing import Optional, Dict, Any, List
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple, Callable, TextIO
 from pathlib import Path
 
+if TYPE_CHECKING:
+    # Только для аннотаций: сами модули импортируются лениво в main()
+    from audio_handler import AudioHandler
+    from vision_handler import VisionHandler
+
 # Установка CUDA переменной окружения для стабильности
 os.environ['CUDA_VISIBLE_DEVICES'] = '0'
 
 try:
-    from llama_cpp import Llama
+    from llama_cpp import Llama, LlamaGrammar
     from colorama import init, Fore, Style, Back
     import psutil
-    from audio_handler import AudioHandler
-    from vision_handler import VisionHandler
 except ImportError as e:
     print(f"Ошибка импорта зависимостей: {e}")
     print("Убедитесь, что все зависимости установлены: pip install -r requirements.txt")
@@ -31,6 +47,206 @@ except ImportError as e:
 # Инициализация colorama для Windows
 init(autoreset=True)
 
+# Типы KV кэша llama.cpp (ggml_type) и размер одного элемента в байтах
+_KV_TYPES = {
+    'f32': 0,
+    'f16': 1,
+    'q4_0': 2,
+    'q4_1': 3,
+    'q5_0': 6,
+    'q5_1': 7,
+    'q8_0': 8,
+    'q8_1': 9,
+}
+_KV_TYPE_NAMES = {value: name for name, value in _KV_TYPES.items()}
+
+# Тип весов GGUF (general.file_type = llama_ftype)
+_WEIGHT_FILE_TYPES = {
+    0: 'F32', 1: 'F16', 2: 'Q4_0', 3: 'Q4_1', 7: 'Q8_0', 8: 'Q5_0', 9: 'Q5_1',
+    10: 'Q2_K', 11: 'Q3_K_S', 12: 'Q3_K_M', 13: 'Q3_K_L', 14: 'Q4_K_S', 15: 'Q4_K_M',
+    16: 'Q5_K_S', 17: 'Q5_K_M', 18: 'Q6_K', 32: 'BF16',
+}
+_UNQUANTIZED_FILE_TYPES = frozenset({0, 1, 32})
+
+# Режимы разбиения модели между GPU (llama_split_mode)
+_SPLIT_MODE_NAMES = {0: 'none', 1: 'layer', 2: 'row'}
+_KV_BYTES_PER_ELEMENT = {
+    0: 4.0,
+    1: 2.0,
+    2: 18 / 32,
+    3: 20 / 32,
+    6: 22 / 32,
+    7: 24 / 32,
+    8: 34 / 32,
+    9: 36 / 32,
+}
+
+@functools.lru_cache(maxsize=4)
+def _load_promt(path_str: str, mtime_ns: int, size: int) -> str:
+    """
+    Чтение PROMT.md через mmap только для чтения
+    
+    mtime_ns и size входят в ключ кэша: повторные экземпляры ThinkingLLM
+    не читают файл заново, пока он не изменился.
+    """
+    if size == 0:
+        return ""
+    with open(path_str, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Как при чтении в текстовом режиме: переводы строк Windows -> \n
+            return mm[:].decode('utf-8').replace('\r\n', '\n')
+
+
+_ASSISTANT_HEADER = "<|im_start|>assistant\n"
+
+_THINK_OPEN = "<think>"
+_THINK_CLOSE = "</think>"
+
+# GBNF: сначала размышления в тегах, затем произвольный ответ.
+# Внутри размышлений запрещена только последовательность "</", начинающая закрывающий тег
+_THINK_GRAMMAR = r'''
+root ::= "<think>" think "</think>" answer
+think ::= ([^<] | "<" [^/])*
+answer ::= [^\x00]*
+'''
+
+
+def _partial_tag_len(text: str, tag: str) -> int:
+    """Длина хвоста text, который может оказаться началом тега tag"""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if tag.startswith(text[-size:]):
+            return size
+    return 0
+
+
+class ThinkStreamParser:
+    """
+    Потоковый разбор генерации на размышления и ответ по тегам <think>...</think>
+    
+    Состояния: pre (до <think>) -> think -> post (после </think>).
+    Теги могут прийти разрезанными между чанками, поэтому возможное начало
+    тега придерживается до следующего чанка. Каждый фрагмент просматривается
+    один раз, постобработка всего ответа после генерации не нужна.
+    При keep_thinking=False текст размышлений не накапливается.
+    """
+    
+    def __init__(self, keep_thinking: bool = True):
+        self.state = "pre"
+        self._tail = ""
+        self._keep_thinking = keep_thinking
+        self.parts: Dict[str, List[str]] = {"pre": [], "think": [], "post": []}
+    
+    def feed(self, text: str) -> List[Tuple[str, str]]:
+        """Принять очередной фрагмент, вернуть список (состояние, текст) для вывода"""
+        text = self._tail + text
+        self._tail = ""
+        out = []
+        while text:
+            if self.state == "post":
+                out.append(("post", text))
+                break
+            tag = _THINK_OPEN if self.state == "pre" else _THINK_CLOSE
+            idx = text.find(tag)
+            if idx >= 0:
+                if idx:
+                    out.append((self.state, text[:idx]))
+                self.state = "think" if self.state == "pre" else "post"
+                text = text[idx + len(tag):]
+                continue
+            keep = _partial_tag_len(text, tag)
+            if keep:
+                self._tail = text[-keep:]
+                text = text[:-keep]
+            if text:
+                out.append((self.state, text))
+            break
+        self._store(out)
+        return out
+    
+    def _store(self, segments: List[Tuple[str, str]]):
+        for state, piece in segments:
+            if state != "think" or self._keep_thinking:
+                self.parts[state].append(piece)
+    
+    def finish(self) -> List[Tuple[str, str]]:
+        """Сбросить придержанный хвост в конце генерации"""
+        if not self._tail:
+            return []
+        out = [(self.state, self._tail)]
+        self._store(out)
+        self._tail = ""
+        return out
+    
+    @property
+    def complete(self) -> bool:
+        """Встретились оба тега"""
+        return self.state == "post"
+
+@dataclass(slots=True)
+class Message:
+    """Сообщение истории диалога"""
+    role: str
+    content: str
+    n_tokens: int = 0  # Токены сообщения вместе с обрамлением chat template
+
+
+class LlamaServerClient:
+    """
+    Клиент llama.cpp сервера с интерфейсом, совместимым с Llama
+    
+    Сервер ведет непрерывный батчинг: запросы консоли, веб-интерфейса и QA
+    обрабатываются одной моделью в общих проходах, а не отдельными загрузками.
+    Поддерживается подмножество Llama, которое использует ThinkingLLM:
+    вызов (в т.ч. stream=True), tokenize() и reset().
+    """
+    
+    def __init__(self, base_url: str, timeout: float = 600.0):
+        import requests  # Нужен только в серверном режиме
+        
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._session = requests.Session()  # Keep-alive между запросами
+        self.metadata: Dict[str, str] = {}
+        
+        response = self._session.get(f"{self.base_url}/health", timeout=10)
+        response.raise_for_status()
+    
+    def __call__(self, prompt: str, stream: bool = False, grammar=None, echo: bool = False, **params):
+        """Запрос /v1/completions; ответ в том же формате, что у Llama"""
+        # cache_prompt: слот сервера переиспользует KV кэш общего префикса между запросами
+        payload = dict(params, prompt=prompt, stream=stream, cache_prompt=True)
+        if grammar is not None:
+            payload['grammar'] = grammar
+        response = self._session.post(f"{self.base_url}/v1/completions", json=payload,
+                                      stream=stream, timeout=self.timeout)
+        response.raise_for_status()
+        if not stream:
+            return response.json()
+        return self._iter_events(response)
+    
+    @staticmethod
+    def _iter_events(response):
+        """Разбор потока server-sent events в чанки completion"""
+        with response:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                yield json.loads(data)
+    
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        """Токенизация на сервере (тот же словарь, что у обслуживаемой модели)"""
+        response = self._session.post(f"{self.base_url}/tokenize", timeout=self.timeout,
+                                      json={'content': text.decode('utf-8'), 'add_special': add_bos})
+        response.raise_for_status()
+        return response.json()['tokens']
+    
+    def reset(self):
+        """Сервер сам управляет слотами и кэшем префиксов"""
+
+
 class LLMConfig:
     """Конфигурация для LLM модели с оптимизациями"""
     
@@ -49,6 +265,7 @@ class LLMConfig:
         self.n_gpu_layers = app_config.GPU_LAYERS
         self.main_gpu = app_config.MAIN_GPU
         self.n_batch = app_config.BATCH_SIZE
+        self.server_url = app_config.LLM_SERVER_URL
         
         # Параметры памяти
         self.use_mmap = app_config.USE_MMAP
@@ -58,9 +275,11 @@ class LLMConfig:
         self.type_k = self._parse_kv_type(app_config.KV_CACHE_TYPE_K)
         self.type_v = self._parse_kv_type(app_config.KV_CACHE_TYPE_V)
         
-        # CPU настройки
-        self.n_threads = psutil.cpu_count()
-        self.n_threads_batch = psutil.cpu_count()
+        # CPU настройки: генерация упирается в память, SMT-соседи ей только мешают,
+        # а обработка промпта выигрывает от всех логических ядер
+        physical_cores = psutil.cpu_count(logical=False) or psutil.cpu_count()
+        self.n_threads = app_config.CPU_THREADS or physical_cores
+        self.n_threads_batch = app_config.CPU_THREADS_BATCH or psutil.cpu_count(logical=True)
         
         # Параметры генерации
         self.temperature = app_config.TEMPERATURE
@@ -69,44 +288,76 @@ class LLMConfig:
         self.min_p = app_config.MIN_P
         self.max_tokens = app_config.MAX_TOKENS
         self.max_thinking_tokens = app_config.MAX_THINKING_TOKENS
+        self.enforce_think_tags = app_config.ENFORCE_THINK_TAGS
+        # При нулевой температуре ответ определяется промптом - кэш безопасен
+        self.response_cache = app_config.RESPONSE_CACHE or self.temperature == 0
+        self.response_cache_size = app_config.RESPONSE_CACHE_SIZE
         
         # Оптимизации
         self.flash_attn = app_config.FLASH_ATTENTION
         self.rope_scaling_type = app_config.ROPE_SCALING_TYPE
         self.split_mode = app_config.SPLIT_MODE
+        
+        # При одной видимой видеокарте разбиение между GPU только добавляет синхронизацию
+        visible_devices = [d for d in os.environ.get('CUDA_VISIBLE_DEVICES', '').split(',') if d.strip()]
+        if len(visible_devices) == 1 and self.split_mode != 0:
+            print(f"{Fore.CYAN}ℹ️  Видна одна GPU ({visible_devices[0]}): split mode "
+                  f"{_SPLIT_MODE_NAMES.get(self.split_mode, self.split_mode)} -> none")
+            self.split_mode = 0  # LLAMA_SPLIT_MODE_NONE
         self.numa = app_config.NUMA
+        if self.numa:
+            self._check_numa_threads(physical_cores)
         
         # Отладка
         self.verbose = app_config.VERBOSE_LOGGING
         
+        # Квантизованный KV кэш на CUDA работает только через ядра Flash Attention
+        if not self.flash_attn and (self.type_k != 1 or self.type_v != 1):
+            print(f"{Fore.YELLOW}⚠️  KV кэш {self.kv_type_name(self.type_k)}/{self.kv_type_name(self.type_v)} "
+                  f"без Flash Attention: на GPU квантизованный кэш требует FLASH_ATTENTION = True")
+        
         print(f"{Fore.GREEN}✓ Конфигурация загружена из config.py")
     
+    def _check_numa_threads(self, physical_cores: int):
+        """Предупреждение, если потоков генерации больше, чем ядер на одном NUMA узле"""
+        try:
+            nodes = [name for name in os.listdir('/sys/devices/system/node')
+                     if name.startswith('node') and name[4:].isdigit()]
+        except OSError:
+            return  # Топология недоступна (не Linux)
+        if len(nodes) > 1 and self.n_threads > physical_cores // len(nodes):
+            print(f"{Fore.YELLOW}⚠️  NUMA: {self.n_threads} потоков при ~{physical_cores // len(nodes)} "
+                  f"ядрах на узел - потоки будут обращаться к памяти соседнего узла")
+    
     def _parse_kv_type(self, type_str: str) -> int:
         """Преобразование строкового типа KV кэша в цифру"""
-        type_mapping = {
-            'q4_0': 2,
-            'q4_1': 3,
-            'q5_0': 6,
-            'q5_1': 7,
-            'q8_0': 8,
-            'q8_1': 9,
-            'f16': 1,
-            'f32': 0
-        }
-        return type_mapping.get(type_str.lower(), 8)  # По умолчанию Q8_0
+        return _KV_TYPES.get(type_str.lower(), 8)  # По умолчанию Q8_0
+    
+    @staticmethod
+    def kv_type_name(kv_type: int) -> str:
+        """Название типа KV кэша по его номеру"""
+        return _KV_TYPE_NAMES.get(kv_type, str(kv_type))
+    
+    def estimate_kv_cache_bytes(self, n_layer: int, n_kv_heads: int, head_dim: int) -> int:
+        """
+        Оценка объема KV кэша: n_layer * n_kv_heads * head_dim * n_ctx * (байт K + байт V)
+        """
+        per_element = _KV_BYTES_PER_ELEMENT.get(self.type_k, 2.0) + _KV_BYTES_PER_ELEMENT.get(self.type_v, 2.0)
+        return int(n_layer * n_kv_heads * head_dim * self.n_ctx * per_element)
     
     def print_config(self):
         """Вывод текущей конфигурации"""
         print(f"{Fore.MAGENTA}=== Конфигурация модели ===")
-        print(f"{Fore.BLUE}Модель: {self.model_path}")
+        print(f"{Fore.BLUE}Модель: {self.server_url or self.model_path}")
         print(f"{Fore.BLUE}Контекст: {self.n_ctx}")
         print(f"{Fore.BLUE}GPU слои: {self.n_gpu_layers}")
         print(f"{Fore.BLUE}Основной GPU: {self.main_gpu}")
         print(f"{Fore.BLUE}Temperature: {self.temperature}")
         print(f"{Fore.BLUE}Top P: {self.top_p}")
         print(f"{Fore.BLUE}Top K: {self.top_k}")
-        print(f"{Fore.BLUE}KV cache: type_k={self.type_k}, type_v={self.type_v}")
+        print(f"{Fore.BLUE}KV cache: K={self.kv_type_name(self.type_k)}, V={self.kv_type_name(self.type_v)}")
         print(f"{Fore.BLUE}Flash attention: {self.flash_attn}")
+        print(f"{Fore.BLUE}Split mode: {_SPLIT_MODE_NAMES.get(self.split_mode, self.split_mode)}")
         print(f"{Fore.BLUE}MMAP: {self.use_mmap}, MLOCK: {self.use_mlock}")
         print(f"{Fore.MAGENTA}=========================")
 
@@ -116,21 +367,44 @@ class ThinkingLLM:
     def __init__(self, config: LLMConfig):
         self.config = config
         self.llama = None
-        self.conversation_history = []  # История диалога
+        self.conversation_history: List[Message] = []  # История диалога
+        self._lock = threading.Lock()  # llama.cpp контекст не потокобезопасен
+        self._prompt_prefix = ""  # История в формате chat template, дополняется по сообщению
+        self._prefix_tokens = 0  # Токены префикса: сумма n_tokens сообщений истории
+        # Счетчики истории, обновляются при добавлении сообщений (без проходов по списку)
+        self._n_user = 0
+        self._n_assistant = 0
+        self._system_messages: List[Message] = []
+        self._think_grammar = None  # Грамматика <think>...</think>, создается после загрузки модели
+        # Кэш ответов: хэш полного промпта (системный промпт + история + вопрос) -> результат
+        self._response_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
         self.max_history_tokens = config.n_ctx // 2  # Максимум токенов для истории (половина контекста)
         
         # Загружаем базу знаний из PROMT.md
         self.knowledge_base = self._load_knowledge_base()
         
+        # Системный промпт не меняется за время жизни объекта - собираем один раз
+        self._system_prompt = self._build_system_prompt()
+        
         self._initialize_model()
+        self._system_prompt_tokens = self._count_message_tokens("system", self._system_prompt)
+        self._assistant_header_tokens = self._count_tokens(_ASSISTANT_HEADER)
+        
+        if config.enforce_think_tags:
+            try:
+                # Сервер принимает грамматику текстом и компилирует ее сам
+                self._think_grammar = (_THINK_GRAMMAR if config.server_url else
+                                       LlamaGrammar.from_string(_THINK_GRAMMAR, verbose=config.verbose))
+            except Exception as e:
+                print(f"{Fore.YELLOW}⚠️  Грамматика <think> недоступна, теги не гарантируются: {e}")
     
     def _load_knowledge_base(self) -> str:
         """Загрузка базы знаний из PROMT.md"""
         try:
             promt_path = Path(__file__).parent / "PROMT.md"
             if promt_path.exists():
-                with open(promt_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                stat = promt_path.stat()
+                content = _load_promt(str(promt_path), stat.st_mtime_ns, stat.st_size)
                 print(f"{Fore.GREEN}✓ База знаний загружена из PROMT.md ({len(content)} символов)")
                 return content
             else:
@@ -142,18 +416,27 @@ class ThinkingLLM:
     
     def _initialize_model(self):
         """Инициализация модели с настройками"""
+        if self.config.server_url:
+            print(f"{Fore.YELLOW}Подключение к llama.cpp серверу {self.config.server_url}...")
+            self.llama = LlamaServerClient(self.config.server_url)
+            print(f"{Fore.GREEN}✓ Сервер доступен, модель загружается сервером")
+            return
+        
         print(f"{Fore.YELLOW}Инициализация модели...")
         print(f"{Fore.CYAN}Модель: {self.config.model_path}")
         print(f"{Fore.CYAN}Контекст: {self.config.n_ctx} токенов")
         print(f"{Fore.CYAN}GPU слои: {self.config.n_gpu_layers} (полная выгрузка)")
         print(f"{Fore.CYAN}Основной GPU: {self.config.main_gpu}")
         print(f"{Fore.CYAN}CPU потоки: {self.config.n_threads}")
-        print(f"{Fore.CYAN}KV кэш: type_k={self.config.type_k}, type_v={self.config.type_v}")
+        print(f"{Fore.CYAN}KV кэш: K={self.config.kv_type_name(self.config.type_k)}, "
+              f"V={self.config.kv_type_name(self.config.type_v)}")
         print(f"{Fore.CYAN}KV кэш: Автоматические оптимизации")
         
         if not Path(self.config.model_path).exists():
             raise FileNotFoundError(f"Модель не найдена: {self.config.model_path}")
         
+        self._check_flash_attention()
+        
         try:
             self.llama = Llama(
                 model_path=self.config.model_path,
@@ -179,6 +462,9 @@ class ThinkingLLM:
                 flash_attn=self.config.flash_attn
             )
             print(f"{Fore.GREEN}✓ Модель успешно загружена!")
+            self._warmup()
+            self._check_weight_quantization()
+            self._print_kv_cache_estimate()
             self._print_model_info()
         except Exception as e:
             error_msg = str(e)
@@ -201,8 +487,13 @@ class ThinkingLLM:
                         # KV cache квантизация даже на CPU
                         type_k=self.config.type_k,
                         type_v=self.config.type_v,
+                        offload_kqv=self.config.n_gpu_layers > 0,
+                        # Flash Attention на CPU почти ничего не дает - не включаем
                     )
                     print(f"{Fore.GREEN}✓ Модель загружена на CPU!")
+                    self._warmup()
+                    self._check_weight_quantization()
+                    self._print_kv_cache_estimate()
                     self._print_model_info()
                     return
                 except Exception as cpu_error:
@@ -210,8 +501,94 @@ class ThinkingLLM:
             
             raise
     
+    def _warmup(self):
+        """
+        Прогревочная генерация одного токена сразу после загрузки
+        
+        Рабочие буферы и CUDA графы выделяются здесь, а не на первом вопросе
+        пользователя (аналог --warmup в llama.cpp CLI).
+        """
+        try:
+            self.llama(
+                "<|im_start|>system\nwarmup<|im_end|>\n" + _ASSISTANT_HEADER,
+                max_tokens=1,
+                temperature=0.0,
+            )
+            self.llama.reset()
+        except Exception as e:
+            print(f"{Fore.YELLOW}⚠️  Прогрев модели не удался: {e}")
+    
+    @staticmethod
+    def _gpu_compute_capability() -> Optional[float]:
+        """Compute capability первой видеокарты через nvidia-smi (None, если узнать не удалось)"""
+        try:
+            output = subprocess.check_output(
+                ["nvidia-smi", "--query-gpu=compute_cap", "--format=csv,noheader"],
+                text=True, timeout=5, stderr=subprocess.DEVNULL
+            )
+            return float(output.splitlines()[0].strip())
+        except (OSError, subprocess.SubprocessError, ValueError, IndexError):
+            return None
+    
+    def _check_flash_attention(self):
+        """
+        Flash Attention при выгрузке на GPU: на Ampere+ (CC >= 8.0) ускоряет
+        обработку промпта и экономит VRAM, поэтому включается принудительно
+        """
+        if self.config.n_gpu_layers <= 0 or self.config.flash_attn:
+            return
+        
+        compute_cap = self._gpu_compute_capability()
+        if compute_cap is not None and compute_cap >= 8.0:
+            print(f"{Fore.RED}⚠️  Flash Attention отключен в config.py, но GPU (CC {compute_cap}) его поддерживает - включаем")
+            self.config.flash_attn = True
+        else:
+            print(f"{Fore.YELLOW}⚠️  Flash Attention отключен: обработка промпта медленнее, KV кэш занимает больше VRAM")
+    
+    def _check_weight_quantization(self):
+        """
+        Тип весов по метаданным GGUF
+        
+        Генерация упирается в пропускную способность памяти: на каждый токен
+        читаются все веса, поэтому 4-битная модель отвечает в ~3-4 раза быстрее f16.
+        """
+        metadata = getattr(self.llama, 'metadata', None) or {}
+        try:
+            file_type = int(metadata['general.file_type'])
+        except (KeyError, ValueError, TypeError):
+            return
+        
+        name = _WEIGHT_FILE_TYPES.get(file_type, str(file_type))
+        if file_type in _UNQUANTIZED_FILE_TYPES:
+            print(f"{Fore.YELLOW}⚠️  Веса {name} без квантизации: генерация в разы медленнее, "
+                  f"используйте GGUF Q4_K_M/Q4_K_S")
+        else:
+            print(f"{Fore.CYAN}Веса: {name}")
+    
+    def _print_kv_cache_estimate(self):
+        """Оценка объема KV кэша по метаданным GGUF с учетом выбранных типов K/V"""
+        try:
+            metadata = getattr(self.llama, 'metadata', None) or {}
+            arch = metadata.get('general.architecture', '')
+            n_layer = int(metadata[f'{arch}.block_count'])
+            n_head = int(metadata[f'{arch}.attention.head_count'])
+            n_kv_heads = int(metadata.get(f'{arch}.attention.head_count_kv', n_head))
+            head_dim = metadata.get(f'{arch}.attention.key_length')
+            if head_dim is None:
+                head_dim = int(metadata[f'{arch}.embedding_length']) // n_head
+        except (KeyError, ValueError, TypeError):
+            return
+        
+        estimate = self.config.estimate_kv_cache_bytes(n_layer, n_kv_heads, int(head_dim))
+        estimate_f16 = 2 * n_layer * n_kv_heads * int(head_dim) * self.config.n_ctx * 2
+        print(f"{Fore.CYAN}KV кэш: ~{estimate / 1024 ** 2:.0f} МБ "
+              f"(f16: ~{estimate_f16 / 1024 ** 2:.0f} МБ)")
+    
     def _print_model_info(self):
-        """Вывод информации о модели"""
+        """Вывод информации о модели (только при VERBOSE_LOGGING, иначе лишние вызовы в llama.cpp)"""
+        if not self.config.verbose:
+            return
+        
         if self.llama is None:
             print(f"{Fore.YELLOW}Модель не загружена")
             return
@@ -235,66 +612,119 @@ class ThinkingLLM:
         except Exception as e:
             print(f"{Fore.YELLOW}Не удалось получить метаданные модели: {e}")
     
-    def _trim_conversation_history(self):
+    def _trim_conversation_history(self) -> bool:
         """
         Обрезает историю диалога, чтобы не превышать лимит контекста
+        
+        Возвращает True, если часть сообщений была удалена.
         """
         if not self.conversation_history or self.llama is None:
-            return
+            return False
         
         # Системное сообщение всегда сохраняем
-        system_messages = [msg for msg in self.conversation_history if msg['role'] == 'system']
-        other_messages = [msg for msg in self.conversation_history if msg['role'] != 'system']
+        system_messages, other_messages = [], []
+        for msg in self.conversation_history:
+            (system_messages if msg.role == 'system' else other_messages).append(msg)
         
-        # Подсчитываем токены для всех сообщений
+        # Токены каждого сообщения посчитаны один раз в add_to_history
         total_tokens = 0
         kept_messages = []
         
         # Обрабатываем сообщения в обратном порядке (сначала самые новые)
         for message in reversed(other_messages):
-            try:
-                message_text = f"<|im_start|>{message['role']}\n{message['content']}<|im_end|>\n"
-                message_tokens = len(self.llama.tokenize(message_text.encode('utf-8')))
-                
-                if total_tokens + message_tokens <= self.max_history_tokens:
-                    kept_messages.insert(0, message)
-                    total_tokens += message_tokens
-                else:
-                    break
-            except Exception:
-                # В случае ошибки токенизации, приблизительная оценка
-                estimated_tokens = len(message['content'].split()) * 1.3
-                if total_tokens + estimated_tokens <= self.max_history_tokens:
-                    kept_messages.insert(0, message)
-                    total_tokens += estimated_tokens
-                else:
-                    break
+            message_tokens = message.n_tokens
+            if total_tokens + message_tokens <= self.max_history_tokens:
+                kept_messages.append(message)
+                total_tokens += message_tokens
+            else:
+                break
+        kept_messages.reverse()  # Один разворот вместо вставок в начало списка
         
         # Обновляем историю
         self.conversation_history = system_messages + kept_messages
         
         if len(other_messages) > len(kept_messages):
             removed_count = len(other_messages) - len(kept_messages)
+            for message in other_messages[:removed_count]:
+                self._count_message(message.role, -1)
             print(f"{Fore.YELLOW}📝 Удалено {removed_count} старых сообщений из истории для экономии токенов")
+            return True
+        return False
+    
+    @staticmethod
+    def _render_message(role: str, content: str) -> str:
+        """Сообщение в формате chat template"""
+        return f"<|im_start|>{role}\n{content}<|im_end|>\n"
+    
+    def _rebuild_prompt_prefix(self):
+        """Пересобрать префикс промпта по всей истории (после обрезки или очистки)"""
+        self._prompt_prefix = "".join(
+            self._render_message(msg.role, msg.content) for msg in self.conversation_history
+        )
+        self._prefix_tokens = sum(msg.n_tokens for msg in self.conversation_history)
+    
+    def _count_tokens(self, text: str) -> int:
+        """Число токенов фрагмента промпта (текст кодируется в UTF-8 один раз)"""
+        if self.llama is None:
+            return int(len(text.split()) * 1.3)  # Приблизительная оценка
+        return len(self.llama.tokenize(text.encode('utf-8'), add_bos=False))
+    
+    def _count_message_tokens(self, role: str, content: str) -> int:
+        """Число токенов сообщения вместе с обрамлением <|im_start|>role ... <|im_end|>"""
+        return self._count_tokens(self._render_message(role, content))
     
-    def add_to_history(self, role: str, content: str):
+    def _count_message(self, role: str, delta: int):
+        """Обновить счетчики вопросов и ответов"""
+        if role == 'user':
+            self._n_user += delta
+        elif role == 'assistant':
+            self._n_assistant += delta
+    
+    def add_to_history(self, role: str, content: str, n_tokens: Optional[int] = None):
         """
         Добавляет сообщение в историю диалога
+        
+        Число токенов считается один раз здесь и хранится вместе с сообщением,
+        чтобы ни обрезка истории, ни подсчет входных токенов промпта
+        не токенизировали историю заново на каждом ходе.
         """
-        self.conversation_history.append({
-            "role": role,
-            "content": content
-        })
-        self._trim_conversation_history()
+        if n_tokens is None:
+            n_tokens = self._count_message_tokens(role, content)
+        message = Message(role, content, n_tokens)
+        self.conversation_history.append(message)
+        if role == 'system':
+            self._system_messages.append(message)
+        else:
+            self._count_message(role, 1)
+        if self._trim_conversation_history():
+            self._rebuild_prompt_prefix()
+        else:
+            self._prompt_prefix += self._render_message(role, content)
+            self._prefix_tokens += n_tokens
     
     def clear_history(self):
         """
         Очищает историю диалога (кроме системного сообщения)
         """
-        system_messages = [msg for msg in self.conversation_history if msg['role'] == 'system']
-        self.conversation_history = system_messages
+        self.conversation_history = list(self._system_messages)
+        self._n_user = self._n_assistant = 0
+        self._rebuild_prompt_prefix()
         print(f"{Fore.GREEN}🗑️ История диалога очищена")
     
+    def reset_session(self):
+        """
+        Новая сессия: очистка истории и KV кэша модели
+        
+        Между ходами llama.cpp переиспользует KV кэш общего префикса промпта
+        (системный промпт + прошлые сообщения), и заново обрабатывается только
+        новая часть. Сброс нужен, чтобы начать с чистого контекста.
+        """
+        with self._lock:
+            self.clear_history()
+            if self.llama is not None:
+                self.llama.reset()
+        print(f"{Fore.GREEN}🔄 KV кэш сброшен, начата новая сессия")
+    
     def get_history_summary(self) -> str:
         """
         Возвращает краткую сводку истории диалога
@@ -302,12 +732,9 @@ class ThinkingLLM:
         if not self.conversation_history:
             return "История пуста"
         
-        user_messages = len([msg for msg in self.conversation_history if msg['role'] == 'user'])
-        assistant_messages = len([msg for msg in self.conversation_history if msg['role'] == 'assistant'])
-        
-        return f"История: {user_messages} вопросов, {assistant_messages} ответов"
+        return f"История: {self._n_user} вопросов, {self._n_assistant} ответов"
 
-    def _create_chat_template(self, messages: List[Dict[str, str]]) -> str:
+    def _create_chat_template(self, messages: List[Message]) -> str:
         """
         Создание chat template согласно предоставленному Jinja шаблону
         """
@@ -317,77 +744,166 @@ class ThinkingLLM:
         formatted_messages = []
         
         # Обработка системного сообщения
-        if messages and messages[0].get('role') == 'system':
-            formatted_messages.append(f"<|im_start|>system\n{messages[0]['content']}<|im_end|>")
+        if messages and messages[0].role == 'system':
+            formatted_messages.append(self._render_message('system', messages[0].content))
             messages = messages[1:]
         
         # Обработка остальных сообщений
         for message in messages:
-            role = message['role']
-            content = message['content']
+            role = message.role
             
             if role in ['user', 'assistant']:
-                formatted_messages.append(f"<|im_start|>{role}\n{content}<|im_end|>")
+                formatted_messages.append(self._render_message(role, message.content))
         
         # Добавление начала ответа ассистента
-        formatted_messages.append("<|im_start|>assistant\n")
+        formatted_messages.append(_ASSISTANT_HEADER)
         
-        return "\n".join(formatted_messages)
+        return "".join(formatted_messages)
     
-    def generate_response(self, user_input: str) -> Dict[str, Any]:
+    def generate_response(self, user_input: str, include_thinking: bool = True,
+                          on_answer_text: Optional[Callable[[str], None]] = None,
+                          on_thinking_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Генерация ответа с thinking режимом и статистикой токенов
+
+        Потокобезопасна: параллельные вызовы выполняются по очереди,
+        так как контекст llama.cpp и история диалога общие.
+        При include_thinking=False размышления не выводятся и не возвращаются.
+        on_answer_text получает фрагменты финального ответа по мере генерации
+        (например, для озвучивания до окончания генерации),
+        on_thinking_text - фрагменты размышлений (только при include_thinking).
         """
+        with self._lock:
+            return self._generate_response_locked(user_input, include_thinking, on_answer_text, on_thinking_text)
+
+    def _generate_response_locked(self, user_input: str, include_thinking: bool = True,
+                                  on_answer_text: Optional[Callable[[str], None]] = None,
+                                  on_thinking_text: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """Генерация ответа (вызывается под self._lock)"""
         if self.llama is None:
-            return {
-                "thinking": "Модель не загружена",
-                "answer": "Ошибка: модель не инициализирована",
-                "full_response": "Model not loaded",
-                "token_stats": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "tokens_per_second": 0.0}
-            }
+            return self._model_not_loaded_response()
+        
+        # Системное сообщение идет первым, чтобы префикс промпта только дописывался
+        if not self._system_messages:
+            self.add_to_history("system", self._system_prompt, n_tokens=self._system_prompt_tokens)
         
         # Добавляем пользовательский ввод в историю
         self.add_to_history("user", user_input)
         
-        # Создаем список сообщений из истории или инициализируем системное сообщение
-        if not any(msg['role'] == 'system' for msg in self.conversation_history):
-            # Формируем системный промпт с базой знаний
-            system_prompt = "Ты - профессиональный AI-консультант компании Транснефть. "
-            system_prompt += "Твоя задача - помогать пользователям с вопросами о компании, предоставлять информацию и консультировать. "
-            system_prompt += "Отвечай профессионально, дружелюбно и информативно на русском языке. "
-            system_prompt += "Используй <think></think> теги для демонстрации процесса рассуждения перед финальным ответом.\n\n"
-            
-            # Добавляем базу знаний если она загружена
-            if self.knowledge_base:
-                system_prompt += "# БАЗА ЗНАНИЙ О КОМПАНИИ ТРАНСНЕФТЬ\n\n"
-                system_prompt += self.knowledge_base
-                system_prompt += "\n\n# КОНЕЦ БАЗЫ ЗНАНИЙ\n\n"
-                system_prompt += "ВАЖНО: Используй информацию из базы знаний для ответов на вопросы о компании. "
-                system_prompt += "Если информации в базе недостаточно, скажи об этом честно."
-            
-            self.add_to_history("system", system_prompt)
+        # Префикс уже содержит всю историю диалога
+        prompt = self._prompt_prefix + _ASSISTANT_HEADER
         
-        # Используем всю историю диалога для генерации
-        messages = self.conversation_history.copy()
+        cache_key = None
+        if self.config.response_cache:
+            cache_key = hashlib.sha1(f"{include_thinking}\0{prompt}".encode('utf-8')).digest()
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                self._response_cache.move_to_end(cache_key)
+                if on_answer_text and cached["answer"]:
+                    on_answer_text(cached["answer"])
+                self.add_to_history("assistant", cached["answer"])
+                return dict(cached, cached=True)
         
-        prompt = self._create_chat_template(messages)
+        result, success = self._run_completion(
+            prompt, include_thinking, input_tokens=self._prefix_tokens + self._assistant_header_tokens,
+            on_answer_text=on_answer_text, on_thinking_text=on_thinking_text
+        )
         
-        # Подсчет входных токенов
-        try:
-            input_tokens = len(self.llama.tokenize(prompt.encode('utf-8')))
-        except Exception:
-            input_tokens = 0
+        if success and cache_key is not None:
+            self._response_cache[cache_key] = result
+            if len(self._response_cache) > self.config.response_cache_size:
+                self._response_cache.popitem(last=False)
+        
+        # Добавляем ответ ассистента в историю (только финальный ответ, без thinking)
+        if success:
+            self.add_to_history("assistant", result["answer"])
+        
+        return result
+    
+    def generate_batch(self, prompts: List[str],
+                       on_result: Optional[Callable[[int, Dict[str, Any]], None]] = None,
+                       include_thinking: bool = True) -> List[Dict[str, Any]]:
+        """
+        Пакетная генерация ответов на независимые вопросы
+        
+        Каждый промпт обрабатывается как отдельный диалог «система + вопрос»,
+        без чтения и записи истории. Вся пачка выполняется за один захват
+        модели, системный промпт собирается один раз.
+        
+        on_result(index, result) вызывается сразу после каждого ответа.
+        """
+        if self.llama is None:
+            return [self._model_not_loaded_response() for _ in prompts]
+        
+        system_message = Message("system", self._system_prompt, self._system_prompt_tokens)
+        
+        results = []
+        with self._lock:
+            for index, user_prompt in enumerate(prompts):
+                prompt = self._create_chat_template([system_message, Message("user", user_prompt)])
+                input_tokens = (self._system_prompt_tokens + self._count_message_tokens("user", user_prompt)
+                                + self._assistant_header_tokens)
+                result, _ = self._run_completion(prompt, include_thinking, input_tokens=input_tokens)
+                results.append(result)
+                if on_result:
+                    on_result(index, result)
+        
+        return results
+    
+    def _model_not_loaded_response(self) -> Dict[str, Any]:
+        """Ответ-заглушка, если модель не загружена"""
+        return {
+            "thinking": "Модель не загружена",
+            "answer": "Ошибка: модель не инициализирована",
+            "full_response": "Model not loaded",
+            "token_stats": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0,
+                            "tokens_per_second": 0.0, "generation_time": 0.0}
+        }
+    
+    def _build_system_prompt(self) -> str:
+        """Формирование системного промпта с базой знаний"""
+        parts = [
+            "Ты - профессиональный AI-консультант компании Транснефть. ",
+            "Твоя задача - помогать пользователям с вопросами о компании, предоставлять информацию и консультировать. ",
+            "Отвечай профессионально, дружелюбно и информативно на русском языке. ",
+            "Используй <think></think> теги для демонстрации процесса рассуждения перед финальным ответом.\n\n",
+        ]
+        
+        # Добавляем базу знаний если она загружена
+        if self.knowledge_base:
+            parts += [
+                "# БАЗА ЗНАНИЙ О КОМПАНИИ ТРАНСНЕФТЬ\n\n",
+                self.knowledge_base,
+                "\n\n# КОНЕЦ БАЗЫ ЗНАНИЙ\n\n",
+                "ВАЖНО: Используй информацию из базы знаний для ответов на вопросы о компании. ",
+                "Если информации в базе недостаточно, скажи об этом честно.",
+            ]
+        
+        return "".join(parts)
+    
+    def _run_completion(self, prompt: str, include_thinking: bool = True, input_tokens: int = 0,
+                        on_answer_text: Optional[Callable[[str], None]] = None,
+                        on_thinking_text: Optional[Callable[[str], None]] = None) -> Tuple[Dict[str, Any], bool]:
+        """
+        Один проход генерации по готовому промпту (история не изменяется)
         
-        print(f"{Fore.YELLOW}Генерация ответа...")
-        print(f"{Fore.CYAN}📊 Входных токенов: {input_tokens}")
-        print(f"{Fore.CYAN}📚 {self.get_history_summary()}")
+        input_tokens - размер промпта в токенах, посчитанный вызывающим по кэшу
+        токенов сообщений (промпт целиком не токенизируется ради статистики).
+        on_answer_text вызывается для каждого фрагмента ответа после </think>,
+        on_thinking_text - для каждого фрагмента внутри <think>.
+        Возвращает словарь результата и флаг успешной генерации.
+        """
+        if self.config.verbose:
+            print(f"{Fore.YELLOW}Генерация ответа...")
+            print(f"{Fore.CYAN}📊 Входных токенов: {input_tokens}")
+            print(f"{Fore.CYAN}📚 {self.get_history_summary()}")
         
         # Засекаем время начала генерации
         start_time = time.time()
         
         try:
             # Параметры генерации (настроены согласно требованиям)
-            response = self.llama(
+            stream = self.llama(
                 prompt,
                 max_tokens=self.config.max_tokens,
                 temperature=self.config.temperature,
@@ -396,41 +912,56 @@ class ThinkingLLM:
                 min_p=self.config.min_p,
                 stop=["<|im_end|>", "</s>"],  # Стоп токены
                 echo=False,  # Не повторять промпт
-                stream=False,  # Без стриминга
+                stream=True,  # Вывод по мере генерации
+                grammar=self._think_grammar,  # Гарантирует структуру <think>...</think> ответ
             )
             
+            # Токены выводятся сразу, размышления и ответ разделяются на лету
+            parser = ThinkStreamParser(keep_thinking=include_thinking)
+            raw_chunks = []
+            completion_tokens = 0
+            printed_state = None
+            
+            def emit(segments: List[Tuple[str, str]]):
+                nonlocal printed_state
+                for state, piece in segments:
+                    if state == "think":
+                        if not include_thinking:
+                            continue
+                        if printed_state != "think":
+                            sys.stdout.write(f"\n{Fore.CYAN}💭 Thinking:{Style.RESET_ALL}\n")
+                            printed_state = "think"
+                        sys.stdout.write(f"{Fore.YELLOW}{piece}")
+                        if on_thinking_text:
+                            on_thinking_text(piece)
+                    else:
+                        if printed_state != "answer":
+                            if not piece.strip():
+                                continue
+                            sys.stdout.write(f"\n{Fore.GREEN}✅ Answer:{Style.RESET_ALL}\n")
+                            printed_state = "answer"
+                        sys.stdout.write(f"{Fore.WHITE}{piece}")
+                        if state == "post" and on_answer_text:
+                            on_answer_text(piece)
+                sys.stdout.flush()
+            
+            for chunk in stream:
+                text = chunk['choices'][0]['text']
+                completion_tokens += 1  # Один чанк потока - один токен
+                if not text:
+                    continue
+                raw_chunks.append(text)
+                emit(parser.feed(text))
+            emit(parser.finish())
+            sys.stdout.write(f"{Style.RESET_ALL}\n\n")
+            
             # Засекаем время окончания
             end_time = time.time()
             generation_time = end_time - start_time
             
-            # Правильная обработка ответа
-            if isinstance(response, dict) and 'choices' in response:
-                full_response = response['choices'][0]['text'].strip()
-                
-                # Получение статистики использования токенов из ответа
-                usage = response.get('usage', {})
-                prompt_tokens = usage.get('prompt_tokens', input_tokens)
-                completion_tokens = usage.get('completion_tokens', 0)
-                total_tokens = usage.get('total_tokens', prompt_tokens + completion_tokens)
-                
-                # Если completion_tokens не доступно, пытаемся подсчитать сами
-                if completion_tokens == 0 and full_response:
-                    try:
-                        completion_tokens = len(self.llama.tokenize(full_response.encode('utf-8')))
-                        total_tokens = prompt_tokens + completion_tokens
-                    except Exception:
-                        completion_tokens = len(full_response.split())  # Приблизительная оценка
-                        total_tokens = prompt_tokens + completion_tokens
-                
-            else:
-                # Fallback для других форматов ответа
-                full_response = str(response).strip()
-                prompt_tokens = input_tokens
-                try:
-                    completion_tokens = len(self.llama.tokenize(full_response.encode('utf-8')))
-                except Exception:
-                    completion_tokens = len(full_response.split())  # Приблизительная оценка
-                total_tokens = prompt_tokens + completion_tokens
+            full_response = "".join(raw_chunks).strip()
+            prompt_tokens = input_tokens
+            total_tokens = prompt_tokens + completion_tokens
             
             # Вычисление скорости генерации
             tokens_per_second = completion_tokens / generation_time if generation_time > 0 else 0.0
@@ -439,27 +970,17 @@ class ThinkingLLM:
             thinking_content = ""
             final_answer = full_response
             
-            if "<think>" in full_response and "</think>" in full_response:
-                parts = full_response.split("<think>", 1)
-                if len(parts) > 1:
-                    think_part = parts[1].split("</think>", 1)
-                    if len(think_part) > 1:
-                        thinking_content = think_part[0].strip()
-                        final_answer = think_part[1].strip()
+            if parser.complete:
+                thinking_content = "".join(parser.parts["think"]).strip()
+                final_answer = "".join(parser.parts["post"]).strip()
             
-            # Если thinking не найден, вся генерация считается финальным ответом
-            if not thinking_content:
+            if not include_thinking:
+                # Размышления не нужны вызывающему коду - не выводим и не возвращаем
+                thinking_content = ""
+            elif not thinking_content:
+                # Если thinking не найден, вся генерация считается финальным ответом
                 thinking_content = "Reasoning process not found in response"
             
-            # Добавляем ответ ассистента в историю (только финальный ответ, без thinking)
-            self.add_to_history("assistant", final_answer)
-            
-            # Вывод в консоль
-            print(f"\n{Fore.CYAN}💭 Thinking:{Style.RESET_ALL}")
-            print(f"{Fore.YELLOW}{thinking_content}{Style.RESET_ALL}")
-            print(f"\n{Fore.GREEN}✅ Answer:{Style.RESET_ALL}")
-            print(f"{Fore.WHITE}{final_answer}{Style.RESET_ALL}\n")
-            
             # Статистика токенов
             token_stats = {
                 "input_tokens": prompt_tokens,
@@ -474,7 +995,7 @@ class ThinkingLLM:
                 "answer": final_answer,
                 "full_response": full_response,
                 "token_stats": token_stats
-            }
+            }, True
             
         except Exception as e:
             end_time = time.time()
@@ -491,55 +1012,307 @@ class ThinkingLLM:
                     "tokens_per_second": 0.0,
                     "generation_time": generation_time
                 }
-            }
+            }, False
+
+_BOX_H = '─' * 60
+
+_TOKEN_STATS_TMPL = "\n".join([
+    f"\n{Back.MAGENTA}{Fore.WHITE} TOKEN STATISTICS {Style.RESET_ALL}",
+    f"{Fore.MAGENTA}┌{_BOX_H}┐",
+    f"{Fore.MAGENTA}│ {Fore.CYAN}📥 Входных токенов:  {{input_tokens:>8}} {Fore.MAGENTA}                │",
+    f"{Fore.MAGENTA}│ {Fore.CYAN}📤 Выходных токенов: {{output_tokens:>8}} {Fore.MAGENTA}                │",
+    f"{Fore.MAGENTA}│ {Fore.CYAN}📊 Всего токенов:    {{total_tokens:>8}} {Fore.MAGENTA}                │",
+    f"{Fore.MAGENTA}│ {Fore.CYAN}⚡ Скорость:         {{tokens_per_second:>8.2f}} т/сек {Fore.MAGENTA}      │",
+    f"{Fore.MAGENTA}│ {Fore.CYAN}⏱️  Время генерации: {{generation_time:>8.2f}} сек {Fore.MAGENTA}       │",
+    f"{Fore.MAGENTA}└{_BOX_H}┘",
+]) + "\n"
+
 
-def print_token_stats(token_stats: Dict[str, Any]):
-    """Красивый вывод статистики токенов"""
-    print(f"\n{Back.MAGENTA}{Fore.WHITE} TOKEN STATISTICS {Style.RESET_ALL}")
-    print(f"{Fore.MAGENTA}┌{'─'*60}┐")
-    print(f"{Fore.MAGENTA}│ {Fore.CYAN}📥 Входных токенов:  {token_stats['input_tokens']:>8} {Fore.MAGENTA}                │")
-    print(f"{Fore.MAGENTA}│ {Fore.CYAN}📤 Выходных токенов: {token_stats['output_tokens']:>8} {Fore.MAGENTA}                │")
-    print(f"{Fore.MAGENTA}│ {Fore.CYAN}📊 Всего токенов:    {token_stats['total_tokens']:>8} {Fore.MAGENTA}                │")
-    print(f"{Fore.MAGENTA}│ {Fore.CYAN}⚡ Скорость:         {token_stats['tokens_per_second']:>8.2f} т/сек {Fore.MAGENTA}      │")
-    print(f"{Fore.MAGENTA}│ {Fore.CYAN}⏱️  Время генерации: {token_stats['generation_time']:>8.2f} сек {Fore.MAGENTA}       │")
-    print(f"{Fore.MAGENTA}└{'─'*60}┘")
+def print_token_stats(token_stats: Dict[str, Any], file: Optional[TextIO] = None):
+    """Красивый вывод статистики токенов (одной записью в консоль или в file)"""
+    (file or sys.stdout).write(_TOKEN_STATS_TMPL.format(**token_stats))
+
+_SEPARATOR = f"{Fore.CYAN}{'=' * 80}"
 
 def print_separator():
     """Печать разделителя"""
-    print(f"{Fore.CYAN}{'='*80}")
-
-def print_thinking(thinking_text: str):
-    """Красивый вывод thinking секции"""
-    print(f"\n{Back.BLUE}{Fore.WHITE} THINKING PROCESS {Style.RESET_ALL}")
-    print(f"{Fore.BLUE}┌{'─'*78}┐")
-    
-    # Разделение на строки и форматирование
-    lines = thinking_text.split('\n')
-    for line in lines:
-        # Ограничение длины строки
-        if len(line) > 76:
-            words = line.split(' ')
-            current_line = ""
-            for word in words:
-                if len(current_line + word) > 76:
-                    print(f"{Fore.BLUE}│ {Fore.CYAN}{current_line:<76}{Fore.BLUE} │")
-                    current_line = word + " "
-                else:
-                    current_line += word + " "
-            if current_line.strip():
-                print(f"{Fore.BLUE}│ {Fore.CYAN}{current_line.strip():<76}{Fore.BLUE} │")
-        else:
-            print(f"{Fore.BLUE}│ {Fore.CYAN}{line:<76}{Fore.BLUE} │")
+    print(_SEPARATOR)
+
+def print_thinking(thinking_text: str, file: Optional[TextIO] = None):
+    """Красивый вывод thinking секции (одной записью в консоль или в file)"""
+    out = [
+        f"\n{Back.BLUE}{Fore.WHITE} THINKING PROCESS {Style.RESET_ALL}",
+        f"{Fore.BLUE}┌{'─'*78}┐",
+    ]
     
-    print(f"{Fore.BLUE}└{'─'*78}┘")
+    # Разделение на строки и перенос длинных строк по словам
+    for line in thinking_text.split('\n'):
+        wrapped = textwrap.wrap(line, width=76) if len(line) > 76 else [line]
+        for part in wrapped:
+            out.append(f"{Fore.BLUE}│ {Fore.CYAN}{part:<76}{Fore.BLUE} │")
+    
+    out.append(f"{Fore.BLUE}└{'─'*78}┘")
+    (file or sys.stdout).write("\n".join(out) + "\n")
 
-def print_answer(answer_text: str):
+def print_answer(answer_text: str, file: Optional[TextIO] = None):
     """Красивый вывод финального ответа"""
-    print(f"\n{Back.GREEN}{Fore.WHITE} FINAL ANSWER {Style.RESET_ALL}")
-    print(f"{Fore.GREEN}{answer_text}")
+    (file or sys.stdout).write(
+        f"\n{Back.GREEN}{Fore.WHITE} FINAL ANSWER {Style.RESET_ALL}\n{Fore.GREEN}{answer_text}\n"
+    )
+
+_QUIT_COMMANDS = frozenset({'quit', 'exit', 'выход'})
+
+# Постоянные строки консоли собираются один раз при импорте, а не на каждой итерации
+_MSG_PROMPT = f"\n{Fore.YELLOW}👤 Ваш вопрос (или 'listen' для голосового ввода): {Style.RESET_ALL}"
+_MSG_GOODBYE = f"{Fore.BLUE}До свидания! 👋"
+_MSG_INTERRUPTED = f"\n{Fore.BLUE}Прервано пользователем. До свидания! 👋"
+_MSG_CAMERA_FORMAT = f"{Fore.RED}❌ Неправильный формат. Используйте: camera <id>"
+_MSG_VOICE_MODE = f"{Fore.CYAN}🎤 Переход в режим голосового ввода..."
+_MSG_VOICE_FAIL = f"{Fore.YELLOW}❓ Голосовой ввод не распознан, попробуйте еще раз"
+_MSG_STT_UNAVAILABLE = f"{Fore.RED}❌ Распознавание речи недоступно"
+_MSG_EMPTY_ANSWER = f"{Fore.RED}Ошибка: пустой ответ от модели\n"
+_MSG_SPEAKING = f"\n{Fore.CYAN}🔊 Озвучивание ответа..."
+_MSG_CACHED = f"{Fore.CYAN}⚡ (cached) ответ из кэша, без генерации\n"
+
+_SENTENCE_END_RE = re.compile(r'[.!?…]+(?=\s)|\n')
+
+
+class SentenceSpeaker:
+    """
+    Озвучивание ответа по предложениям, пока модель еще генерирует
+    
+    Фрагменты ответа копятся до конца предложения, готовые предложения
+    уходят в очередь, которую разбирает один поток. Он озвучивает фразы
+    синхронно, поэтому ограниченная очередь TTS не переполняется и фразы
+    не теряются даже при длинном ответе.
+    """
+    
+    def __init__(self, audio_handler: "AudioHandler"):
+        self.audio_handler = audio_handler
+        self._buffer = ""
+        self.spoken = False  # Было ли озвучено хотя бы одно предложение текущего ответа
+        self._sentences: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._speak_loop, name='sentence-tts', daemon=True)
+        self._thread.start()
+    
+    def begin(self):
+        """Начало нового ответа"""
+        self._buffer = ""
+        self.spoken = False
+    
+    def feed(self, text: str):
+        """Очередной фрагмент ответа"""
+        self._buffer += text
+        last_end = 0
+        for match in _SENTENCE_END_RE.finditer(self._buffer):
+            self._put(self._buffer[last_end:match.end()])
+            last_end = match.end()
+        if last_end:
+            self._buffer = self._buffer[last_end:]
+    
+    def finish(self):
+        """Конец ответа: озвучить остаток без знака конца предложения"""
+        self._put(self._buffer)
+        self._buffer = ""
+    
+    def _put(self, sentence: str):
+        sentence = sentence.strip()
+        if sentence:
+            self._sentences.put(sentence)
+            self.spoken = True
+    
+    def _speak_loop(self):
+        while True:
+            sentence = self._sentences.get()
+            try:
+                self.audio_handler.speak_answer(sentence, play_async=False)
+            except Exception as e:
+                print(f"{Fore.YELLOW}⚠️  Ошибка озвучивания: {e}")
+
+
+def _print_history(llm: ThinkingLLM):
+    """Команда 'history': вывод истории диалога"""
+    print(f"\n{Fore.MAGENTA}📚 История диалога:")
+    for i, msg in enumerate(llm.conversation_history):
+        if msg.role == 'system':
+            continue
+        role_emoji = "👤" if msg.role == 'user' else "🤖"
+        content_preview = msg.content[:100] + "..." if len(msg.content) > 100 else msg.content
+        print(f"{Fore.CYAN}{i}. {role_emoji} {msg.role}: {content_preview}")
+    print(f"{Fore.BLUE}{llm.get_history_summary()}")
+
+
+class ConsoleInput:
+    """
+    Ввод вопроса с выводом фоновых сообщений поверх приглашения
+    
+    Сообщения фоновых команд не печатаются посреди строки ввода, а ставятся
+    в очередь. Пока пользователь не ввел строку, stdin ожидается через
+    selectors с таймаутом: пришедшие сообщения выводятся над приглашением,
+    и оно перерисовывается. На Windows select не работает с консолью -
+    там очередь выводится перед каждым приглашением, а ввод идет через input().
+    """
+    
+    def __init__(self, poll_interval: float = 0.1):
+        self.poll_interval = poll_interval
+        self._pending: "queue.SimpleQueue[str]" = queue.SimpleQueue()
+        self._selector: Optional[selectors.BaseSelector] = None
+        if os.name != 'nt' and sys.stdin is not None and sys.stdin.isatty():
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(sys.stdin, selectors.EVENT_READ)
+    
+    def notify(self, message: str):
+        """Сообщение из фонового потока"""
+        self._pending.put(message)
+    
+    def _drain(self) -> bool:
+        messages = []
+        while True:
+            try:
+                messages.append(self._pending.get_nowait())
+            except queue.Empty:
+                break
+        if messages:
+            sys.stdout.write("\n".join(messages) + "\n")
+        return bool(messages)
+    
+    def read(self, prompt: str) -> str:
+        """Аналог input(prompt); EOFError при закрытом stdin"""
+        self._drain()
+        if self._selector is None:
+            return input(prompt)
+        
+        sys.stdout.write(prompt)
+        sys.stdout.flush()
+        while not self._selector.select(timeout=self.poll_interval):
+            if not self._pending.empty():
+                # Стираем строку приглашения, печатаем сообщения и рисуем приглашение заново
+                sys.stdout.write(f"\r\033[K{Style.RESET_ALL}")
+                self._drain()
+                sys.stdout.write(prompt.lstrip("\n"))
+                sys.stdout.flush()
+        
+        line = sys.stdin.readline()
+        if not line:
+            raise EOFError
+        return line.rstrip("\n")
+    
+    def close(self):
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
 
-def main():
+def _in_background(executor: Executor, name: str, func: Callable[[], Optional[str]],
+                   notify: Callable[[str], None]) -> Callable[[], None]:
+    """
+    Обработчик команды, который выполняется в фоне и сразу возвращает управление консоли
+    
+    func возвращает текст результата; он, как и ошибка, передается в notify.
+    """
+    def report(future):
+        error = future.exception()
+        if error is not None:
+            notify(f"{Fore.RED}❌ Ошибка команды '{name}': {error}")
+        elif future.result():
+            notify(future.result())
+    
+    def submit():
+        executor.submit(func).add_done_callback(report)
+    return submit
+
+
+def _build_commands(llm: ThinkingLLM, audio_handler: Optional["AudioHandler"],
+                    vision_handler: Optional["VisionHandler"], background: Executor,
+                    notify: Callable[[str], None]) -> Dict[str, Callable[[], None]]:
+    """
+    Таблица простых команд консоли: текст команды (после casefold) -> обработчик
+    
+    Команды аудио и камеры регистрируются, только если соответствующий модуль доступен,
+    иначе такой ввод уходит модели как обычный вопрос. Медленные команды камеры
+    (перебор устройств, анализ кадра) выполняются в фоне и не блокируют ввод,
+    их результат выводится через notify.
+    """
+    commands: Dict[str, Callable[[], None]] = {
+        'clear': llm.clear_history,
+        'reset': llm.reset_session,
+        'history': lambda: _print_history(llm),
+    }
+    
+    if audio_handler:
+        def audio_on():
+            audio_handler.toggle_stt(True)
+            audio_handler.toggle_tts(True)
+        
+        def audio_off():
+            audio_handler.toggle_stt(False)
+            audio_handler.toggle_tts(False)
+        
+        commands['audio on'] = audio_on
+        commands['audio off'] = audio_off
+    
+    if vision_handler:
+        def vision_start():
+            if vision_handler.start_real_time_analysis():
+                print(f"{Fore.GREEN}📹 Анализ камеры запущен")
+            else:
+                print(f"{Fore.RED}❌ Не удалось запустить анализ камеры")
+        
+        def vision_stop():
+            vision_handler.stop_real_time_analysis()
+            print(f"{Fore.YELLOW}⏹️  Анализ камеры остановлен")
+        
+        def list_cameras() -> str:
+            available_cameras = vision_handler.list_cameras()
+            current_camera = vision_handler.get_current_camera()
+            if available_cameras:
+                found = f"{Fore.GREEN}✓ Доступные камеры: {available_cameras}"
+            else:
+                found = f"{Fore.RED}❌ Камеры не найдены"
+            return f"{Fore.CYAN}📹 Текущая камера: {current_camera}\n{found}"
+        
+        def refresh_cameras() -> str:
+            available_cameras = vision_handler.refresh_cameras()
+            if available_cameras:
+                return f"{Fore.GREEN}✓ Обновлено! Доступные камеры: {available_cameras}"
+            return f"{Fore.RED}❌ Камеры не найдены"
+        
+        commands['vision start'] = vision_start
+        commands['vision stop'] = vision_stop
+        commands['cameras'] = _in_background(background, 'cameras', list_cameras, notify)
+        commands['refresh cameras'] = _in_background(background, 'refresh cameras', refresh_cameras, notify)
+    
+    def look() -> str:
+        if vision_handler and vision_handler.is_camera_available():
+            analysis = vision_handler.analyze_single_frame("Опишите что вы видите на изображении")
+            return f"{Fore.GREEN}🔍 Анализ: {analysis}"
+        return f"{Fore.RED}❌ Камера недоступна"
+    
+    submit_look = _in_background(background, 'look', look, notify)
+    
+    def look_command():
+        print(f"{Fore.CYAN}👁️  Анализ текущего кадра...")
+        submit_look()
+    
+    commands['look'] = look_command
+    return commands
+
+
+def configure_console_output():
+    """
+    Вывод консольного чата в UTF-8: при перенаправлении в файл или pipe Windows
+    иначе кодирует каждую запись в cp1251 и падает на эмодзи.
+    Вызывается точками входа (main.py, web_app.py), а не при импорте модуля:
+    stdout/stderr процесса, импортирующего main, остаются как есть.
+    """
+    for stream in (sys.stdout, sys.stderr):
+        if stream is not None and hasattr(stream, 'reconfigure'):
+            stream.reconfigure(encoding='utf-8', errors='replace')
+
+
+def main() -> None:
     """Основная функция чата"""
+    configure_console_output()
     
     # Парсинг аргументов командной строки
     parser = argparse.ArgumentParser(description='LLM Chat Interface with Thinking Mode and Audio Support')
@@ -548,8 +1321,13 @@ def main():
     parser.add_argument('--no-audio', action='store_true', help='Отключить аудио функции')
     parser.add_argument('--no-stt', action='store_true', help='Отключить распознавание речи')
     parser.add_argument('--no-tts', action='store_true', help='Отключить синтез речи')
+    parser.add_argument('--no-vision', action='store_true', help='Отключить анализ камеры')
+    parser.add_argument('--cache', action='store_true', help='Кэшировать ответы на повторные вопросы')
     args = parser.parse_args()
     
+    vision_handler: Optional["VisionHandler"] = None
+    background: Optional[ThreadPoolExecutor] = None
+    console: Optional[ConsoleInput] = None
     try:
         print(f"{Fore.MAGENTA}🤖 LLM Chat Interface with Thinking Mode & Audio")
         print(f"{Fore.MAGENTA}Модель: Huihui-Qwen3-4B-Thinking")
@@ -561,10 +1339,11 @@ def main():
             print(f"{Fore.BLUE}Для реального запуска используйте без флага --test")
             return
         
-        # Инициализация аудио модуля
-        audio_handler = None
+        # Инициализация аудио модуля (импорт только здесь: pyaudio, pyttsx3 и т.д. грузятся долго)
+        audio_handler: Optional["AudioHandler"] = None
         if not args.no_audio:
             try:
+                from audio_handler import AudioHandler
                 audio_handler = AudioHandler()
                 if args.no_stt:
                     audio_handler.toggle_stt(False)
@@ -575,23 +1354,26 @@ def main():
                 print(f"{Fore.CYAN}💡 Для использования аудио установите: pip install pyaudio speechrecognition pyttsx3")
                 audio_handler = None
         
-        # Инициализация vision модуля
-        vision_handler = None
-        try:
-            vision_handler = VisionHandler()
-        except Exception as e:
-            print(f"{Fore.YELLOW}⚠️  Vision модуль недоступен: {e}")
-            print(f"{Fore.CYAN}💡 Для использования vision установите: pip install opencv-python Pillow numpy")
-            vision_handler = None
+        # Инициализация vision модуля (opencv, numpy импортируются только при необходимости)
+        if not args.no_vision:
+            try:
+                from vision_handler import VisionHandler
+                vision_handler = VisionHandler()
+            except Exception as e:
+                print(f"{Fore.YELLOW}⚠️  Vision модуль недоступен: {e}")
+                print(f"{Fore.CYAN}💡 Для использования vision установите: pip install opencv-python Pillow numpy")
+                vision_handler = None
         
         # Инициализация конфигурации и модели
         config = LLMConfig(args.model)  # Используем конфиг по умолчанию
+        if args.cache:
+            config.response_cache = True
         
         # Показываем текущую конфигурацию
         config.print_config()
         
-        # Проверка существования модели
-        if not Path(config.model_path).exists():
+        # Проверка существования модели (в серверном режиме ее загружает сервер)
+        if not config.server_url and not Path(config.model_path).exists():
             print(f"{Fore.RED}❌ Модель не найдена: {config.model_path}")
             print(f"{Fore.YELLOW}💡 Используйте параметр --model для указания правильного пути:")
             print(f"{Fore.CYAN}   python main.py --model \"C:/path/to/your/model.gguf\"")
@@ -599,103 +1381,69 @@ def main():
             print(f"{Fore.CYAN}   python main.py --test")
             return
         
-        llm = ThinkingLLM(config)
+        # Прогрев аудио и распознавателя жестов идет параллельно с загрузкой модели
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='prewarm') as prewarm:
+            for handler in (audio_handler, vision_handler):
+                if handler is not None:
+                    prewarm.submit(handler.prewarm)
+            llm = ThinkingLLM(config)
         
         print_separator()
         print(f"{Fore.GREEN}✓ Система готова к работе!")
         
-        # Консольный режим
-        print(f"{Fore.YELLOW}Команды:")
-        print(f"{Fore.CYAN}  'quit' или 'exit' - выход")
-        print(f"{Fore.CYAN}  'clear' - очистить историю диалога")
-        print(f"{Fore.CYAN}  'history' - показать историю диалога")
+        # Консольный режим: список команд собирается один раз и выводится одной записью
+        command_help = [
+            f"{Fore.YELLOW}Команды:",
+            f"{Fore.CYAN}  'quit' или 'exit' - выход",
+            f"{Fore.CYAN}  'clear' - очистить историю диалога",
+            f"{Fore.CYAN}  'reset' - очистить историю и KV кэш модели",
+            f"{Fore.CYAN}  'history' - показать историю диалога",
+        ]
         if audio_handler and audio_handler.is_speech_recognition_available():
-            print(f"{Fore.CYAN}  'listen' - режим голосового ввода")
+            command_help.append(f"{Fore.CYAN}  'listen' - режим голосового ввода")
         if audio_handler:
-            print(f"{Fore.CYAN}  'audio on/off' - включить/отключить аудио")
+            command_help.append(f"{Fore.CYAN}  'audio on/off' - включить/отключить аудио")
         if vision_handler and vision_handler.is_camera_available():
-            print(f"{Fore.CYAN}  'vision start/stop' - запуск/остановка анализа камеры")
-            print(f"{Fore.CYAN}  'look' - анализ текущего кадра")
-            print(f"{Fore.CYAN}  'cameras' - показать доступные камеры")
-            print(f"{Fore.CYAN}  'camera <id>' - переключиться на камеру по ID")
-            print(f"{Fore.CYAN}  'refresh cameras' - обновить список камер")
+            command_help += [
+                f"{Fore.CYAN}  'vision start/stop' - запуск/остановка анализа камеры",
+                f"{Fore.CYAN}  'look' - анализ текущего кадра",
+                f"{Fore.CYAN}  'cameras' - показать доступные камеры",
+                f"{Fore.CYAN}  'camera <id>' - переключиться на камеру по ID",
+                f"{Fore.CYAN}  'refresh cameras' - обновить список камер",
+            ]
+        sys.stdout.write("\n".join(command_help) + "\n")
         print_separator()
         
+        # Один фоновый поток: команды камеры выполняются по очереди, не мешая вводу
+        background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='repl-background')
+        console = ConsoleInput()
+        commands: Dict[str, Callable[[], None]] = _build_commands(llm, audio_handler, vision_handler,
+                                                                  background, console.notify)
+        speaker: Optional[SentenceSpeaker] = SentenceSpeaker(audio_handler) if audio_handler else None
+        
         while True:
             try:
                 # Ввод пользователя
-                user_input = input(f"\n{Fore.YELLOW}👤 Ваш вопрос (или 'listen' для голосового ввода): {Style.RESET_ALL}")
+                user_input: str = console.read(_MSG_PROMPT)
                 
-                if user_input.lower().strip() in ['quit', 'exit', 'выход']:
-                    print(f"{Fore.BLUE}До свидания! 👋")
-                    break
-                
-                if user_input.lower().strip() == 'clear':
-                    llm.clear_history()
-                    continue
+                # casefold: полное приведение регистра Unicode (кириллица, «Выход», «ВЫХОД»)
+                cmd: str = user_input.strip().casefold()
                 
-                if user_input.lower().strip() == 'history':
-                    print(f"\n{Fore.MAGENTA}📚 История диалога:")
-                    for i, msg in enumerate(llm.conversation_history):
-                        if msg['role'] == 'system':
-                            continue
-                        role_emoji = "👤" if msg['role'] == 'user' else "🤖"
-                        content_preview = msg['content'][:100] + "..." if len(msg['content']) > 100 else msg['content']
-                        print(f"{Fore.CYAN}{i}. {role_emoji} {msg['role']}: {content_preview}")
-                    print(f"{Fore.BLUE}{llm.get_history_summary()}")
-                    continue
-                
-                # Команды управления аудио
-                if audio_handler and user_input.lower().strip() == 'audio on':
-                    audio_handler.toggle_stt(True)
-                    audio_handler.toggle_tts(True)
-                    continue
-                
-                if audio_handler and user_input.lower().strip() == 'audio off':
-                    audio_handler.toggle_stt(False)
-                    audio_handler.toggle_tts(False)
-                    continue
-                
-                # Голосовой ввод
-                if user_input.lower().strip() == 'listen':
-                    if audio_handler and audio_handler.is_speech_recognition_available():
-                        print(f"{Fore.CYAN}🎤 Переход в режим голосового ввода...")
-                        voice_input = audio_handler.listen_for_question()
-                        if voice_input:
-                            print(f"{Fore.GREEN}📝 Распознано: {voice_input}")
-                            user_input = voice_input
-                        else:
-                            print(f"{Fore.YELLOW}❓ Голосовой ввод не распознан, попробуйте еще раз")
-                            continue
-                    else:
-                        print(f"{Fore.RED}❌ Распознавание речи недоступно")
-                        continue
-                
-                # Команды управления vision
-                if vision_handler and user_input.lower().strip() == 'vision start':
-                    if vision_handler.start_real_time_analysis():
-                        print(f"{Fore.GREEN}📹 Анализ камеры запущен")
-                    else:
-                        print(f"{Fore.RED}❌ Не удалось запустить анализ камеры")
-                    continue
-                
-                if vision_handler and user_input.lower().strip() == 'vision stop':
-                    vision_handler.stop_real_time_analysis()
-                    print(f"{Fore.YELLOW}⏹️  Анализ камеры остановлен")
-                    continue
+                if cmd in _QUIT_COMMANDS:
+                    print(_MSG_GOODBYE)
+                    break
                 
-                # Команды управления камерами
-                if vision_handler and user_input.lower().strip() == 'cameras':
-                    available_cameras = vision_handler.list_cameras()
-                    current_camera = vision_handler.get_current_camera()
-                    print(f"{Fore.CYAN}📹 Текущая камера: {current_camera}")
-                    if available_cameras:
-                        print(f"{Fore.GREEN}✓ Доступные камеры: {available_cameras}")
-                    else:
-                        print(f"{Fore.RED}❌ Камеры не найдены")
+                # Простые команды - поиск в словаре вместо цепочки сравнений.
+                # Ошибки камеры и аудио ловятся здесь, у вызова подсистемы
+                handler = commands.get(cmd)
+                if handler:
+                    try:
+                        handler()
+                    except Exception as e:
+                        print(f"{Fore.RED}❌ Ошибка команды '{cmd}': {e}")
                     continue
                 
-                if vision_handler and user_input.lower().strip().startswith('camera '):
+                if vision_handler and cmd.startswith('camera '):
                     try:
                         camera_id = int(user_input.split()[1])
                         if vision_handler.switch_camera(camera_id):
@@ -703,25 +1451,33 @@ def main():
                         else:
                             print(f"{Fore.RED}❌ Не удалось переключиться на камеру {camera_id}")
                     except (ValueError, IndexError):
-                        print(f"{Fore.RED}❌ Неправильный формат. Используйте: camera <id>")
-                    continue
-                
-                if vision_handler and user_input.lower().strip() == 'refresh cameras':
-                    available_cameras = vision_handler.refresh_cameras()
-                    if available_cameras:
-                        print(f"{Fore.GREEN}✓ Обновлено! Доступные камеры: {available_cameras}")
-                    else:
-                        print(f"{Fore.RED}❌ Камеры не найдены")
+                        print(_MSG_CAMERA_FORMAT)
+                    except Exception as e:
+                        print(f"{Fore.RED}❌ Ошибка переключения камеры: {e}")
                     continue
                 
-                if user_input.lower().strip() == 'look':
-                    if vision_handler and vision_handler.is_camera_available():
-                        print(f"{Fore.CYAN}👁️  Анализ текущего кадра...")
-                        analysis = vision_handler.analyze_single_frame("Опишите что вы видите на изображении")
-                        print(f"{Fore.GREEN}🔍 Анализ: {analysis}")
-                        continue
+                # Голосовой ввод
+                if cmd == 'listen':
+                    if audio_handler and audio_handler.is_speech_recognition_available():
+                        print(_MSG_VOICE_MODE)
+                        # Запись и распознавание идут в фоновых потоках аудио модуля
+                        question = audio_handler.listen_for_question_streaming()
+                        try:
+                            voice_input = question.result()
+                        except KeyboardInterrupt:
+                            audio_handler.stop_listening()
+                            raise
+                        except Exception as e:
+                            print(f"{Fore.RED}❌ Ошибка голосового ввода: {e}")
+                            voice_input = None
+                        if voice_input:
+                            print(f"{Fore.GREEN}📝 Распознано: {voice_input}")
+                            user_input = voice_input
+                        else:
+                            print(_MSG_VOICE_FAIL)
+                            continue
                     else:
-                        print(f"{Fore.RED}❌ Камера недоступна")
+                        print(_MSG_STT_UNAVAILABLE)
                         continue
                 
                 if not user_input.strip():
@@ -729,54 +1485,64 @@ def main():
                 
                 print_separator()
                 
-                # Генерация ответа
-                response = llm.generate_response(user_input)
+                # Генерация ответа; готовые предложения озвучиваются, не дожидаясь конца генерации
+                speak_stream = speaker if speaker and audio_handler.is_text_to_speech_available() else None
+                if speak_stream:
+                    speak_stream.begin()
+                response = llm.generate_response(
+                    user_input, on_answer_text=speak_stream.feed if speak_stream else None
+                )
+                
+                # Весь вывод ответа собирается в буфер и пишется в консоль одной записью
+                out = io.StringIO()
                 
                 # Вывод thinking процесса
                 if response["thinking"]:
-                    print_thinking(response["thinking"])
+                    print_thinking(response["thinking"], file=out)
                 
                 # Вывод финального ответа
                 if response["answer"]:
-                    print_answer(response["answer"])
+                    print_answer(response["answer"], file=out)
                 else:
-                    print(f"{Fore.RED}Ошибка: пустой ответ от модели")
+                    out.write(_MSG_EMPTY_ANSWER)
                 
                 # Вывод статистики токенов
                 if "token_stats" in response:
-                    print_token_stats(response["token_stats"])
+                    print_token_stats(response["token_stats"], file=out)
+                if response.get("cached"):
+                    out.write(_MSG_CACHED)
+                
+                sys.stdout.write(out.getvalue())
+                sys.stdout.flush()
                 
-                # Озвучивание ответа
-                if audio_handler and audio_handler.is_text_to_speech_available() and response["answer"]:
-                    print(f"\n{Fore.CYAN}🔊 Озвучивание ответа...")
-                    audio_handler.speak_answer(response["answer"], play_async=True)
+                # Озвучивание ответа: остаток последнего предложения или весь ответ,
+                # если модель не выделила его тегами и по ходу генерации ничего не озвучено
+                if speak_stream and response["answer"]:
+                    print(_MSG_SPEAKING)
+                    speak_stream.finish()
+                    if not speak_stream.spoken:
+                        audio_handler.speak_answer(response["answer"], play_async=True)
                 
                 print_separator()
                 
-            except KeyboardInterrupt:
-                print(f"\n{Fore.BLUE}Прервано пользователем. До свидания! 👋")
+            except (KeyboardInterrupt, EOFError):
+                print(_MSG_INTERRUPTED)
                 break
-            except Exception as e:
-                print(f"{Fore.RED}Ошибка: {e}")
-                continue
         
-        # Очистка ресурсов
-        if vision_handler:
-            vision_handler.cleanup()
-                
     except Exception as e:
         print(f"{Fore.RED}Критическая ошибка: {e}")
         sys.exit(1)
     finally:
-        # Финальная очистка
-        try:
-            # Используем globals() вместо locals() для проверки переменной
-            if 'vision_handler' in globals() and 'vision_handler' in locals():
-                vision_handler_obj = locals().get('vision_handler')
-                if vision_handler_obj:
-                    vision_handler_obj.cleanup()
-        except Exception:
-            pass  # Игнорируем ошибки при очистке
+        # Очистка ресурсов (в том числе после критической ошибки)
+        if background is not None:
+            background.shutdown(wait=False, cancel_futures=True)
+        if console is not None:
+            console.close()
+        if vision_handler is not None:
+            try:
+                vision_handler.cleanup()
+            except Exception:
+                pass  # Игнорируем ошибки при очистке
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
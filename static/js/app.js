@@ -20,8 +20,11 @@ class TransneftAssistant {
         this.isCameraActive = false;
         this.isSpeakerActive = false; // Озвучка ответов включена/выключена
         this.isProcessing = false;
-        this.voicePollingInterval = null; // Интервал для опроса распознанного текста
-        this.gesturePollingInterval = null; // Интервал для опроса жестов
+        this.events = null; // SSE-канал событий голоса и жестов (/api/events)
+        this.isVoiceListening = false; // Принимаем распознанный текст из канала
+        this.isGestureListening = false; // Принимаем распознанные жесты из канала
+        this.pendingVoiceTexts = []; // Текст, пришедший во время ответа нейросети
+        this.pendingGestureTexts = []; // Жесты, пришедшие во время ответа нейросети
         
         // 3D Персонаж
         this.character3d = null;
@@ -33,6 +36,9 @@ class TransneftAssistant {
         // Сброс контекста при загрузке страницы
         await this.resetContext();
         
+        // Подписка на события голоса и жестов
+        this.connectEvents();
+        
         // Инициализация 3D персонажа
         this.init3DCharacter();
         
@@ -141,10 +147,13 @@ class TransneftAssistant {
                     try {
                         const data = JSON.parse(line.slice(6));
                         
-                        if (data.type === 'thinking') {
+                        if (data.type === 'thinking_delta') {
+                            // Размышления приходят по мере генерации
+                            this.appendThinking(data.content);
+                        } else if (data.type === 'thinking') {
                             // Показываем thinking
                             this.showThinking(data.content);
-                        } else if (data.type === 'answer') {
+                        } else if (data.type === 'answer' || data.type === 'answer_delta') {
                             // Обновляем или создаем ответ
                             if (!lastAnswerBubble) {
                                 lastAnswerBubble = this.addMessage('', false, true);
@@ -156,8 +165,18 @@ class TransneftAssistant {
                                     this.character3d.startAnswering();
                                 }
                             }
-                            fullAnswerText = data.content; // Сохраняем полный текст
-                            this.updateMessage(lastAnswerBubble, data.content);
+                            // answer_delta - новый фрагмент, answer - ответ целиком
+                            if (data.type === 'answer_delta') {
+                                fullAnswerText += data.content;
+                            } else {
+                                fullAnswerText = data.content;
+                            }
+                            this.updateMessage(lastAnswerBubble, fullAnswerText);
+                        } else if (data.type === 'error') {
+                            // Ответ не сгенерирован (например, модель не загрузилась)
+                            console.error('Ошибка генерации:', data.content);
+                            this.hideThinking();
+                            this.addMessage('Извините, произошла ошибка. Попробуйте ещё раз.', false);
                         } else if (data.type === 'done') {
                             // Завершение
                             this.setStatus('idle', 'Готов к работе');
@@ -272,6 +291,15 @@ class TransneftAssistant {
         }, 10);
     }
     
+    appendThinking(content) {
+        // Первый фрагмент открывает панель, остальные дописываются без анимации
+        if (this.thinkingPanel.style.display !== 'block') {
+            this.thinkingPanel.style.display = 'block';
+            this.thinkingContent.textContent = '';
+        }
+        this.thinkingContent.textContent += content;
+    }
+    
     hideThinking() {
         // Плавное исчезновение
         this.thinkingPanel.style.transition = 'opacity 0.5s ease-out';
@@ -319,8 +347,8 @@ class TransneftAssistant {
                 
                 if (data.status === 'started') {
                     console.log('🎤 Голосовой ввод активирован');
-                    // Начинаем опрос для получения распознанного текста
-                    this.startVoicePolling();
+                    // Начинаем принимать распознанный текст из канала событий
+                    this.startVoiceEvents();
                 } else {
                     console.error('Ошибка старта:', data);
                     this.isVoiceActive = false;
@@ -337,7 +365,8 @@ class TransneftAssistant {
             this.micButton.classList.remove('active');
             this.voiceIndicator.classList.remove('active');
             this.setStatus('idle', 'Готов к работе');
-            this.stopVoicePolling();
+            this.stopVoiceEvents();
+            this.pendingVoiceTexts = [];
             
             try {
                 await fetch('/api/voice/stop', { method: 'POST' });
@@ -347,105 +376,138 @@ class TransneftAssistant {
         }
     }
     
-    startVoicePolling() {
-        // Опрашиваем сервер каждые 500ms для получения распознанного текста
-        this.voicePollingInterval = setInterval(async () => {
-            try {
-                const response = await fetch('/api/voice/get-text');
-                const data = await response.json();
-                
-                if (data.status === 'text_available' && data.text) {
-                    console.log('🗣️ Получен текст:', data.text);
-                    
-                    // ОСТАНАВЛИВАЕМ POLLING НА ВРЕМЯ ОБРАБОТКИ ОТВЕТА
-                    this.stopVoicePolling();
-                    
-                    // Добавляем текст в поле ввода
-                    this.messageInput.value = data.text;
-                    
-                    // Автоматически отправляем нейросети
-                    await this.sendMessage('voice');
-                    
-                    // После ответа нейросети возобновляем запись (см. sendMessage)
-                } else if (data.status === 'stopped') {
-                    // Запись остановлена (таймаут 5 секунд) - прекращаем polling
-                    console.log('⏰ Таймаут - запись остановлена, возврат кнопки в исходное состояние');
-                    this.stopVoicePolling();
-                    
-                    // Полностью сбрасываем состояние голосового ввода
-                    this.isVoiceActive = false;
-                    this.micButton.classList.remove('active');
-                    this.voiceIndicator.classList.remove('active');
-                    
-                    // Показываем уведомление пользователю
-                    this.showNotification('Голосовой ввод остановлен (таймаут 5 сек)', 'warning');
-                }
-            } catch (error) {
-                console.error('Ошибка получения текста:', error);
-            }
-        }, 500);
+    connectEvents() {
+        // Единый SSE-канал вместо опроса: распознанная речь, жесты и состояние
+        // микрофона/камеры. EventSource сам переподключается при обрыве
+        this.events = new EventSource('/api/events');
+        
+        this.events.addEventListener('voice_text', (event) => {
+            this.onVoiceText(JSON.parse(event.data).text);
+        });
+        this.events.addEventListener('gesture_text', (event) => {
+            this.onGestureText(JSON.parse(event.data).text);
+        });
+        this.events.addEventListener('voice_status', (event) => {
+            if (!JSON.parse(event.data).active) this.onVoiceStopped();
+        });
+        this.events.addEventListener('camera_status', (event) => {
+            if (!JSON.parse(event.data).active) this.onCameraStopped();
+        });
     }
     
-    stopVoicePolling() {
-        if (this.voicePollingInterval) {
-            clearInterval(this.voicePollingInterval);
-            this.voicePollingInterval = null;
+    async onVoiceText(text) {
+        if (!text || !this.isVoiceActive) return;
+        
+        if (!this.isVoiceListening) {
+            // Нейросеть ещё отвечает - обработаем после ответа
+            this.pendingVoiceTexts.push(text);
+            return;
         }
+        
+        console.log('🗣️ Получен текст:', text);
+        
+        // ОСТАНАВЛИВАЕМ ПРИЁМ НА ВРЕМЯ ОБРАБОТКИ ОТВЕТА
+        this.stopVoiceEvents();
+        
+        // Добавляем текст в поле ввода
+        this.messageInput.value = text;
+        
+        // Автоматически отправляем нейросети
+        await this.sendMessage('voice');
+        
+        // После ответа нейросети возобновляем запись (см. sendMessage)
     }
     
-    startGesturePolling() {
-        // Опрашиваем сервер каждые 500ms для получения распознанных жестов
-        this.gesturePollingInterval = setInterval(async () => {
-            try {
-                const response = await fetch('/api/gesture/get-text');
-                const data = await response.json();
-                
-                if (data.status === 'text_available' && data.text) {
-                    console.log('👋 Получен жест:', data.text);
-                    
-                    // ОСТАНАВЛИВАЕМ POLLING НА ВРЕМЯ ОБРАБОТКИ ОТВЕТА
-                    this.stopGesturePolling();
-                    
-                    // Добавляем текст в поле ввода
-                    this.messageInput.value = data.text;
-                    
-                    // Автоматически отправляем нейросети
-                    await this.sendMessage('gesture');
-                    
-                    // После ответа нейросети камера автоматически возобновится (в web_app.py)
-                } else if (data.status === 'stopped') {
-                    // Камера остановлена (таймаут 7 секунд) - прекращаем polling
-                    console.log('⏰ Таймаут - камера остановлена, возврат кнопки в исходное состояние');
-                    this.stopGesturePolling();
-                    
-                    // Полностью сбрасываем состояние камеры
-                    this.isCameraActive = false;
-                    this.cameraButton.classList.remove('active');
-                    this.cameraIndicator.classList.remove('active');
-                    
-                    // Показываем уведомление пользователю
-                    this.showNotification('Распознавание жестов остановлено (таймаут 7 сек)', 'warning');
-                }
-            } catch (error) {
-                console.error('Ошибка получения жеста:', error);
-            }
-        }, 500);
+    onVoiceStopped() {
+        if (!this.isVoiceListening) return;
+        
+        // Запись остановлена (таймаут 5 секунд)
+        console.log('⏰ Таймаут - запись остановлена, возврат кнопки в исходное состояние');
+        this.stopVoiceEvents();
+        
+        // Полностью сбрасываем состояние голосового ввода
+        this.isVoiceActive = false;
+        this.pendingVoiceTexts = [];
+        this.micButton.classList.remove('active');
+        this.voiceIndicator.classList.remove('active');
+        
+        // Показываем уведомление пользователю
+        this.showNotification('Голосовой ввод остановлен (таймаут 5 сек)', 'warning');
     }
     
-    stopGesturePolling() {
-        if (this.gesturePollingInterval) {
-            clearInterval(this.gesturePollingInterval);
-            this.gesturePollingInterval = null;
+    startVoiceEvents() {
+        this.isVoiceListening = true;
+        
+        // Текст, распознанный во время ответа, отправляем первым
+        if (this.pendingVoiceTexts.length) {
+            this.onVoiceText(this.pendingVoiceTexts.shift());
         }
     }
     
+    stopVoiceEvents() {
+        this.isVoiceListening = false;
+    }
+    
+    async onGestureText(text) {
+        if (!text || !this.isCameraActive) return;
+        
+        if (!this.isGestureListening) {
+            // Нейросеть ещё отвечает - обработаем после ответа
+            this.pendingGestureTexts.push(text);
+            return;
+        }
+        
+        console.log('👋 Получен жест:', text);
+        
+        // ОСТАНАВЛИВАЕМ ПРИЁМ НА ВРЕМЯ ОБРАБОТКИ ОТВЕТА
+        this.stopGestureEvents();
+        
+        // Добавляем текст в поле ввода
+        this.messageInput.value = text;
+        
+        // Автоматически отправляем нейросети
+        await this.sendMessage('gesture');
+        
+        // После ответа нейросети камера автоматически возобновится (в web_app.py)
+    }
+    
+    onCameraStopped() {
+        if (!this.isGestureListening) return;
+        
+        // Камера остановлена (таймаут 7 секунд)
+        console.log('⏰ Таймаут - камера остановлена, возврат кнопки в исходное состояние');
+        this.stopGestureEvents();
+        
+        // Полностью сбрасываем состояние камеры
+        this.isCameraActive = false;
+        this.pendingGestureTexts = [];
+        this.cameraButton.classList.remove('active');
+        this.cameraIndicator.classList.remove('active');
+        
+        // Показываем уведомление пользователю
+        this.showNotification('Распознавание жестов остановлено (таймаут 7 сек)', 'warning');
+    }
+    
+    startGestureEvents() {
+        this.isGestureListening = true;
+        
+        // Жест, распознанный во время ответа, отправляем первым
+        if (this.pendingGestureTexts.length) {
+            this.onGestureText(this.pendingGestureTexts.shift());
+        }
+    }
+    
+    stopGestureEvents() {
+        this.isGestureListening = false;
+    }
+    
     async resumeGestureAfterAnswer() {
         // Возобновляем распознавание жестов после ответа нейросети
         if (this.isCameraActive && this.cameraButton.classList.contains('active')) {
-            console.log('📹 Возобновляем опрос жестов после ответа');
+            console.log('📹 Возобновляем приём жестов после ответа');
             // Камера автоматически возобновлена на backend (web_app.py)
-            // Просто продолжаем опрос
-            this.startGesturePolling();
+            // Просто продолжаем приём событий
+            this.startGestureEvents();
         }
     }
     
@@ -458,8 +520,8 @@ class TransneftAssistant {
                 
                 if (data.status === 'started' || data.status === 'already_listening') {
                     console.log('🎤 Голосовой ввод возобновлён после ответа');
-                    // ВОЗОБНОВЛЯЕМ POLLING после ответа
-                    this.startVoicePolling();
+                    // ВОЗОБНОВЛЯЕМ ПРИЁМ ТЕКСТА после ответа
+                    this.startVoiceEvents();
                 } else {
                     console.log('⚠️ Не удалось возобновить:', data);
                     // Если не удалось возобновить - сбрасываем UI
@@ -539,8 +601,8 @@ class TransneftAssistant {
                 
                 if (data.status === 'started') {
                     console.log('📹 Камера и распознавание жестов активированы');
-                    // Начинаем опрос для получения распознанных жестов
-                    this.startGesturePolling();
+                    // Начинаем принимать распознанные жесты из канала событий
+                    this.startGestureEvents();
                 } else {
                     console.error('Ошибка старта камеры:', data);
                     this.isCameraActive = false;
@@ -557,7 +619,8 @@ class TransneftAssistant {
             this.cameraButton.classList.remove('active');
             this.cameraIndicator.classList.remove('active');
             this.setStatus('idle', 'Готов к работе');
-            this.stopGesturePolling();
+            this.stopGestureEvents();
+            this.pendingGestureTexts = [];
             
             try {
                 await fetch('/api/camera/stop', { method: 'POST' });
@@ -7,13 +7,19 @@ Vision Handler Module with MediaPipe Tasks API
 """
 
 import os
+import sys
 import cv2
 import json
 import time
+import queue
 import threading
 import numpy as np
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from typing import Optional, Dict, Any, List, Tuple, Callable
 from pathlib import Path
+from types import MappingProxyType
 
 # Импорты с проверкой доступности
 mediapipe = None
@@ -61,6 +67,7 @@ class VisionConfig:
         self.camera_device_id = app_config.CAMERA_DEVICE_ID
         self.camera_fps = app_config.CAMERA_FPS
         self.camera_resolution = tuple(app_config.CAMERA_RESOLUTION)
+        self.jpeg_quality = app_config.CAMERA_JPEG_QUALITY
         self.gesture_detection = app_config.GESTURE_DETECTION_ENABLED
         
         # Настройки MediaPipe Tasks
@@ -68,6 +75,9 @@ class VisionConfig:
         self.min_hand_presence_confidence = app_config.MEDIAPIPE_MIN_TRACKING_CONFIDENCE
         self.min_tracking_confidence = app_config.MEDIAPIPE_MIN_TRACKING_CONFIDENCE
         self.max_num_hands = app_config.MEDIAPIPE_MAX_NUM_HANDS
+        self.input_width = app_config.MEDIAPIPE_INPUT_WIDTH
+        self.use_gpu = app_config.MEDIAPIPE_USE_GPU
+        self.motion_threshold = app_config.GESTURE_MOTION_THRESHOLD
         
         # Настройки обработки
         self.frame_skip = app_config.FRAME_SKIP
@@ -106,17 +116,50 @@ class VisionConfig:
         # Если модель не найдена, возвращаем путь для скачивания
         return str(Path(__file__).parent / "gesture_recognizer.task")
 
+_EMPTY_LANDMARKS = np.empty((0, 3), dtype=np.float32)
+_EMPTY_LANDMARKS.flags.writeable = False
+
+
 class MediaPipeGestureRecognizer:
     """Класс для распознавания жестов с помощью MediaPipe Tasks API"""
     
+    # Описания жестов для вывода (создаются один раз, только для чтения)
+    _GESTURE_DESCRIPTIONS = MappingProxyType({
+        "thumb_up": "👍 Большой палец вверх",
+        "thumb_down": "👎 Большой палец вниз",
+        "pointing_up": "☝️ Указательный палец вверх", 
+        "open_palm": "✋ Открытая ладонь",
+        "closed_fist": "✊ Кулак",
+        "victory": "✌️ Знак победы",
+        "iloveyou": "🤟 Знак 'Я люблю тебя'",
+        "none": "❓ Неизвестный жест",
+        "unknown": "❓ Неизвестный жест"
+    })
+    
     def __init__(self, config: VisionConfig):
         self.config = config
         self.recognizer = None
+        self.delegate: Optional[str] = None  # 'GPU' или 'CPU' после инициализации
+        self._analysis_interval = config.analysis_interval
+        self._gesture_confidence = config.gesture_confidence
         
-        # История жестов для анализа
-        self.gesture_history = []
         self.last_detection_time = 0
         
+        # LIVE_STREAM: результаты приходят в _on_result из потока MediaPipe
+        self._result_lock = threading.Lock()
+        self._submit_lock = threading.Lock()  # Метки времени должны возрастать при вызовах из разных потоков
+        self._latest_gestures: List[Dict[str, Any]] = []
+        # Одиночный анализ ждет результат своего кадра по его метке времени и не
+        # трогает результаты живого анализа: {timestamp_ms: {'done': Event, 'gestures': [...]}}
+        self._oneshot: Dict[int, Dict[str, Any]] = {}
+        self._last_timestamp_ms = 0
+        self._rgb_buf: Optional[np.ndarray] = None  # Переиспользуемый буфер RGB кадра
+        self._small_buf: Optional[np.ndarray] = None  # Уменьшенный кадр для распознавания
+        # Детектор движения: миниатюра последнего распознанного кадра и его результат
+        self._motion_size = (96, 96)
+        self._reference_gray: Optional[np.ndarray] = None
+        self._last_result: List[Dict[str, Any]] = []
+        
         self._initialize_mediapipe()
     
     def _initialize_mediapipe(self):
@@ -134,107 +177,231 @@ class MediaPipeGestureRecognizer:
                 print("   Ссылка: https://storage.googleapis.com/mediapipe-models/gesture_recognizer/gesture_recognizer/float16/1/gesture_recognizer.task")
                 return
             
-            # Настройки для MediaPipe Tasks
-            base_options = python.BaseOptions(model_asset_path=model_path)  # type: ignore
-            
-            # Опции для распознавания жестов
-            options = vision.GestureRecognizerOptions(  # type: ignore
-                base_options=base_options,
-                running_mode=vision.RunningMode.IMAGE,  # type: ignore  # Для начала используем режим изображения
-                num_hands=self.config.max_num_hands,
-                min_hand_detection_confidence=self.config.min_hand_detection_confidence,
-                min_hand_presence_confidence=self.config.min_hand_presence_confidence,
-                min_tracking_confidence=self.config.min_tracking_confidence
-            )
-            
-            # Создание распознавателя
-            self.recognizer = vision.GestureRecognizer.create_from_options(options)  # type: ignore
+            # GPU делегат (Linux/macOS) с откатом на CPU, если он недоступен
+            delegates = ['GPU', 'CPU'] if self.config.use_gpu else ['CPU']
+            for delegate in delegates:
+                try:
+                    self.recognizer = self._create_recognizer(model_path, delegate)
+                    self.delegate = delegate
+                    break
+                except Exception as e:
+                    if delegate == delegates[-1]:
+                        raise
+                    print(f"⚠️  GPU делегат MediaPipe недоступен ({e}), используется CPU")
             
-            print("✅ MediaPipe Tasks инициализирован успешно")
+            print(f"✅ MediaPipe Tasks инициализирован успешно ({self.delegate})")
             
         except Exception as e:
             print(f"❌ Ошибка инициализации MediaPipe Tasks: {e}")
     
-    def detect_hand_gestures(self, frame: np.ndarray) -> List[Dict[str, Any]]:
+    def _create_recognizer(self, model_path: str, delegate: str):
+        """Создание распознавателя с указанным делегатом ('GPU' или 'CPU')"""
+        # Настройки для MediaPipe Tasks
+        base_options = python.BaseOptions(  # type: ignore
+            model_asset_path=model_path,
+            delegate=getattr(python.BaseOptions.Delegate, delegate),  # type: ignore
+        )
+        
+        # Опции для распознавания жестов
+        options = vision.GestureRecognizerOptions(  # type: ignore
+            base_options=base_options,
+            # Асинхронный режим: инференс идет в потоках MediaPipe, захват кадров не ждет его,
+            # а трекинг руки между кадрами позволяет пропускать детектор ладони
+            running_mode=vision.RunningMode.LIVE_STREAM,  # type: ignore
+            result_callback=self._on_result,
+            num_hands=self.config.max_num_hands,
+            min_hand_detection_confidence=self.config.min_hand_detection_confidence,
+            min_hand_presence_confidence=self.config.min_hand_presence_confidence,
+            min_tracking_confidence=self.config.min_tracking_confidence
+        )
+        
+        # Создание распознавателя
+        return vision.GestureRecognizer.create_from_options(options)  # type: ignore
+    
+    def _next_timestamp_ms(self) -> int:
+        """Строго возрастающая метка времени кадра (требование LIVE_STREAM)"""
+        timestamp_ms = max(int(time.monotonic() * 1000), self._last_timestamp_ms + 1)
+        self._last_timestamp_ms = timestamp_ms
+        return timestamp_ms
+    
+    def _submit(self, frame: np.ndarray, oneshot: Optional[Dict[str, Any]] = None) -> int:
+        """
+        Отправка кадра в MediaPipe без ожидания результата, возвращает метку времени кадра
+        
+        oneshot - слот одиночного анализа: результат этого кадра попадет в него,
+        а не в результаты живого анализа.
+        """
+        with self._submit_lock:
+            # Уменьшение с сохранением пропорций: ориентиры MediaPipe нормированы (0..1),
+            # поэтому координаты остаются верными и для исходного кадра
+            height, width = frame.shape[:2]
+            if width > self.config.input_width:
+                size = (self.config.input_width, max(1, height * self.config.input_width // width))
+                if self._small_buf is None or self._small_buf.shape[1::-1] != size:
+                    self._small_buf = np.empty((size[1], size[0], 3), dtype=np.uint8)
+                cv2.resize(frame, size, dst=self._small_buf, interpolation=cv2.INTER_AREA)
+                frame = self._small_buf
+            
+            # BGR -> RGB - только перестановка каналов: пишем в готовый буфер без выделения памяти.
+            # mp.Image копирует данные, поэтому буфер можно переиспользовать сразу
+            if self._rgb_buf is None or self._rgb_buf.shape != frame.shape:
+                self._rgb_buf = np.empty(frame.shape, dtype=np.uint8)
+            cv2.mixChannels([frame], [self._rgb_buf], [0, 2, 1, 1, 2, 0])
+            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=self._rgb_buf)
+            timestamp_ms = self._next_timestamp_ms()
+            if oneshot is not None:
+                # Слот регистрируется до отправки: результат может прийти раньше возврата
+                with self._result_lock:
+                    self._oneshot[timestamp_ms] = oneshot
+            try:
+                self.recognizer.recognize_async(mp_image, timestamp_ms)
+            except Exception:
+                if oneshot is not None:
+                    with self._result_lock:
+                        self._oneshot.pop(timestamp_ms, None)
+                raise
+            return timestamp_ms
+    
+    def _recognize_once(self, frame: np.ndarray, timeout: float) -> List[Dict[str, Any]]:
+        """Распознавание одного кадра с ожиданием его собственного результата"""
+        oneshot = {'done': threading.Event(), 'gestures': []}
+        timestamp_ms = self._submit(frame, oneshot)
+        if not oneshot['done'].wait(timeout):
+            # MediaPipe мог пропустить кадр (LIVE_STREAM) - слот больше не ждем
+            with self._result_lock:
+                self._oneshot.pop(timestamp_ms, None)
+            return []
+        return oneshot['gestures']
+    
+    def detect_hand_gestures(self, frame: np.ndarray, wait: bool = False) -> List[Dict[str, Any]]:
         """
         Детекция жестов рук в кадре используя MediaPipe Tasks
+        
+        Кадр отправляется на асинхронное распознавание, а возвращаются жесты
+        последнего готового результата (запаздывание на один анализируемый кадр).
+        Каждый результат возвращается один раз, чтобы жесты не учитывались дважды.
+        wait=True дожидается результата именно этого кадра (одиночный анализ):
+        без ограничения частоты и без влияния на живой анализ.
         """
+        if wait:
+            if self.recognizer is None or not mp:
+                return []
+            try:
+                return self._recognize_once(frame, timeout=1.0)
+            except Exception as e:
+                print(f"❌ Ошибка детекции жестов: {e}")
+                return []
+        
         current_time = time.time()
-        if current_time - self.last_detection_time < self.config.analysis_interval:
+        if current_time - self.last_detection_time < self._analysis_interval:
             return []
         
         self.last_detection_time = current_time
         
-        if self.recognizer is None:
+        if self.recognizer is None or not mp:
             return []
         
-        gestures = []
+        # Неподвижная сцена: вместо инференса (~20 мс) повторяем прошлый результат
+        if self._is_static(frame):
+            with self._result_lock:
+                return [dict(gesture, timestamp=current_time) for gesture in self._last_result]
         
         try:
-            # Конвертация OpenCV изображения в MediaPipe Image
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            if not mp:
-                return []
-                
-            # Преобразование в MediaPipe Image
-            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-            
-            # Распознавание жестов
-            result = self.recognizer.recognize(mp_image)
-            
-            # Обработка результатов
-            if result.gestures:
-                for i, gesture_list in enumerate(result.gestures):
-                    if gesture_list:  # Если есть распознанные жесты
-                        # Информация о руке (правая/левая)
-                        handedness = result.handedness[i][0] if result.handedness and len(result.handedness) > i else None
-                        hand_label = handedness.category_name.lower() if handedness else "unknown"
-                        hand_confidence = handedness.score if handedness else 0.0
-                        
-                        # Информация о жесте
-                        gesture = gesture_list[0]  # Берем жест с максимальной уверенностью
-                        
-                        # Ориентиры руки
-                        landmarks = []
-                        if result.hand_landmarks and len(result.hand_landmarks) > i:
-                            for landmark in result.hand_landmarks[i]:
-                                landmarks.append([landmark.x, landmark.y, landmark.z])
-                        
-                        if gesture.score > self.config.gesture_confidence:
-                            gesture_data = {
-                                'type': gesture.category_name.lower(),
-                                'hand': hand_label,
-                                'confidence': gesture.score,
-                                'hand_confidence': hand_confidence,
-                                'landmarks': landmarks,
-                                'timestamp': current_time,
-                                'description': f"{gesture.category_name} - {hand_label} рука"
-                            }
-                            gestures.append(gesture_data)
-            
+            self._submit(frame)
         except Exception as e:
             print(f"❌ Ошибка детекции жестов: {e}")
+            return []
         
+        with self._result_lock:
+            gestures, self._latest_gestures = self._latest_gestures, []
         return gestures
     
+    def _is_static(self, frame: np.ndarray) -> bool:
+        """
+        Сравнение миниатюры кадра с последним распознанным (сумма модулей разностей)
+        
+        Опорный кадр обновляется только при распознавании, поэтому медленное
+        движение накапливается и все равно превышает порог.
+        """
+        if self.config.motion_threshold <= 0:
+            return False
+        small = cv2.resize(frame, self._motion_size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        reference = self._reference_gray
+        if reference is not None:
+            limit = self.config.motion_threshold * gray.size
+            if cv2.norm(gray, reference, cv2.NORM_L1) < limit:
+                return True
+        self._reference_gray = gray
+        return False
+    
+    def _on_result(self, result, output_image, timestamp_ms: int):
+        """Результат распознавания (вызывается из потока MediaPipe)"""
+        current_time = time.time()
+        min_confidence = self._gesture_confidence
+        gestures = []
+        
+        # Обработка результатов. Поля результата читаются один раз: каждое обращение
+        # к ним идет через обертку protobuf
+        result_gestures = result.gestures
+        if result_gestures:
+            handedness_list = result.handedness or []
+            landmarks_list = result.hand_landmarks or []
+            for i, gesture_list in enumerate(result_gestures):
+                if not gesture_list:  # Нет распознанных жестов
+                    continue
+                
+                # Информация о жесте
+                gesture = gesture_list[0]  # Берем жест с максимальной уверенностью
+                if gesture.score <= min_confidence:
+                    continue  # Ориентиры неуверенного жеста не нужны
+                
+                # Информация о руке (правая/левая)
+                handedness = handedness_list[i][0] if len(handedness_list) > i else None
+                hand_label = handedness.category_name.lower() if handedness else "unknown"
+                hand_confidence = handedness.score if handedness else 0.0
+                
+                # Ориентиры руки: массив (21, 3) float32 одним выделением вместо 21 списка.
+                # Массив свой у каждого жеста - жесты хранятся в буфере и истории анализа
+                landmarks = _EMPTY_LANDMARKS
+                if len(landmarks_list) > i:
+                    hand = landmarks_list[i]
+                    landmarks = np.fromiter(
+                        (value for landmark in hand for value in (landmark.x, landmark.y, landmark.z)),
+                        dtype=np.float32, count=3 * len(hand),
+                    ).reshape(-1, 3)
+                
+                gestures.append({
+                    'type': gesture.category_name.lower(),
+                    'hand': hand_label,
+                    'confidence': gesture.score,
+                    'hand_confidence': hand_confidence,
+                    'landmarks': landmarks,
+                    'timestamp': current_time,
+                })  # Текст для вывода формирует get_gesture_description по запросу
+        
+        with self._result_lock:
+            oneshot = self._oneshot.pop(timestamp_ms, None)
+            if oneshot is None:
+                self._latest_gestures = gestures
+                self._last_result = gestures
+        if oneshot is not None:
+            oneshot['gestures'] = gestures
+            oneshot['done'].set()
+    
+    def warmup(self, resolution: Tuple[int, int]):
+        """Пробное распознавание пустого кадра: граф MediaPipe инициализируется до первого жеста"""
+        if self.recognizer is None or not mp:
+            return
+        width, height = resolution
+        self._recognize_once(np.zeros((height, width, 3), dtype=np.uint8), timeout=5.0)
+    
     def get_gesture_description(self, gesture: Dict[str, Any]) -> str:
         """
         Получение подробного описания жеста
         """
-        gesture_descriptions = {
-            "thumb_up": "👍 Большой палец вверх",
-            "thumb_down": "👎 Большой палец вниз",
-            "pointing_up": "☝️ Указательный палец вверх", 
-            "open_palm": "✋ Открытая ладонь",
-            "closed_fist": "✊ Кулак",
-            "victory": "✌️ Знак победы",
-            "iloveyou": "🤟 Знак 'Я люблю тебя'",
-            "none": "❓ Неизвестный жест",
-            "unknown": "❓ Неизвестный жест"
-        }
-        
         gesture_type = gesture.get('type', 'unknown')
-        base_description = gesture_descriptions.get(gesture_type, f"Жест: {gesture_type}")
+        base_description = self._GESTURE_DESCRIPTIONS.get(gesture_type, f"Жест: {gesture_type}")
         hand_info = f" ({gesture['hand']} рука)"
         confidence_info = f" [Уверенность: {gesture['confidence']:.2f}]"
         
@@ -245,6 +412,87 @@ class MediaPipeGestureRecognizer:
         if self.recognizer:
             self.recognizer.close()
 
+class FramePool:
+    """
+    Пул заранее выделенных буферов кадров
+    
+    Поток захвата пишет кадр в свободный буфер (cv2 читает прямо в него),
+    публикует его как текущий, а предыдущий буфер возвращается в пул.
+    Потребители берут текущий кадр через borrow() - пока он занят,
+    захват его не перезапишет.
+    """
+    
+    def __init__(self, size: int = 4, shape: Optional[Tuple[int, ...]] = None):
+        # При известном размере кадра буферы выделяются сразу, а не на первых кадрах
+        self._buffers: List[Optional[np.ndarray]] = [
+            np.empty(shape, dtype=np.uint8) if shape else None for _ in range(size)
+        ]
+        self._borrowed = [0] * size
+        self._free: "queue.SimpleQueue[int]" = queue.SimpleQueue()
+        for index in range(size):
+            self._free.put(index)
+        self._current = -1
+        self.version = 0  # Растет при каждой смене текущего кадра
+        self._lock = threading.Lock()
+    
+    def acquire(self) -> Optional[int]:
+        """Свободный буфер для записи кадра (None - все заняты)"""
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            return None
+    
+    def buffer(self, index: int) -> Optional[np.ndarray]:
+        return self._buffers[index]
+    
+    def publish(self, index: int, frame: np.ndarray):
+        """Сделать кадр в буфере index текущим"""
+        with self._lock:
+            # cv2 выделяет новый массив, если размер кадра не совпал с буфером
+            self._buffers[index] = frame
+            previous, self._current = self._current, index
+            self.version += 1
+            if previous >= 0 and not self._borrowed[previous]:
+                self._free.put(previous)
+    
+    def release(self, index: int):
+        """Вернуть неопубликованный буфер в пул"""
+        self._free.put(index)
+    
+    def clear(self):
+        """Сбросить текущий кадр (буферы остаются выделенными)"""
+        with self._lock:
+            previous, self._current = self._current, -1
+            self.version += 1
+            if previous >= 0 and not self._borrowed[previous]:
+                self._free.put(previous)
+    
+    @contextmanager
+    def borrow(self):
+        """
+        Текущий кадр без копирования; буфер не перезаписывается до выхода из блока
+        
+        Кадр выдается как view только для чтения: случайная запись (например,
+        cv2.putText) не испортит буфер пула. Для рисования нужна своя копия.
+        """
+        with self._lock:
+            index = self._current
+            if index < 0:
+                frame = None
+            else:
+                self._borrowed[index] += 1
+                frame = self._buffers[index].view()
+                frame.flags.writeable = False
+        try:
+            yield frame
+        finally:
+            if index >= 0:
+                with self._lock:
+                    self._borrowed[index] -= 1
+                    if not self._borrowed[index] and index != self._current:
+                        self._free.put(index)
+
+
 class CameraHandler:
     """Класс для работы с камерой"""
     
@@ -253,8 +501,13 @@ class CameraHandler:
         self.camera = None
         self.is_recording = False
         self.frame_callback = None
-        self.current_frame = None
         self.capture_thread = None  # Добавлено: ссылка на поток захвата
+        width, height = config.camera_resolution
+        self._frame_pool = FramePool(shape=(height, width, 3))
+        # Последний закодированный JPEG: (байты, версия кадра пула)
+        self._encoded_frame: Optional[Tuple[bytes, int]] = None
+        self._encode_lock = threading.Lock()
+        self._encode_params = [cv2.IMWRITE_JPEG_QUALITY, config.jpeg_quality]
         self._initialize_camera()
     
     def _initialize_camera(self):
@@ -266,6 +519,8 @@ class CameraHandler:
             self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.config.camera_resolution[0])
             self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.config.camera_resolution[1])
             self.camera.set(cv2.CAP_PROP_FPS, self.config.camera_fps)
+            # Очередь драйвера на один кадр: grab() отдает свежий кадр, а не накопленный
+            self.camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             
             # Проверка успешного открытия
             if not self.camera.isOpened():
@@ -305,8 +560,10 @@ class CameraHandler:
         """Остановка захвата видео и освобождение камеры"""
         self.is_recording = False
         
-        # Ждём завершения потока захвата
-        if self.capture_thread and self.capture_thread.is_alive():
+        # Ждём завершения потока захвата. Остановка может прийти из самого потока
+        # (таймаут бездействия в callback анализа) - тогда он завершится сам после возврата
+        if (self.capture_thread and self.capture_thread.is_alive()
+                and self.capture_thread is not threading.current_thread()):
             self.capture_thread.join(timeout=2.0)
         
         self.capture_thread = None  # Обнуляем ссылку на поток
@@ -317,17 +574,22 @@ class CameraHandler:
             self.camera = None
             print("📹 Камера освобождена")
         
-        self.current_frame = None
+        self._frame_pool.clear()
         print("⏹️  Захват видео остановлен")
     
     def _capture_loop(self):
-        """Основной цикл захвата кадров"""
+        """
+        Основной цикл захвата кадров
+        
+        grab() забирает кадр у драйвера и ждет следующего, поэтому цикл идет
+        в темпе камеры. Декодирование (retrieve) выполняется только для кадров,
+        которые попадут в пул: пропущенные по frame_skip не декодируются.
+        """
         frame_count = 0
         
+        pool = self._frame_pool
         while self.is_recording and self.camera is not None:
-            ret, frame = self.camera.read()
-            
-            if not ret:
+            if not self.camera.grab():
                 print("❌ Ошибка чтения кадра с камеры")
                 break
             
@@ -336,7 +598,19 @@ class CameraHandler:
             if frame_count % self.config.frame_skip != 0:
                 continue
             
-            self.current_frame = frame
+            # Кадр декодируется в заранее выделенный буфер пула
+            index = pool.acquire()
+            if index is None:
+                continue  # Все буферы заняты потребителями - кадр пропускаем
+            buffer = pool.buffer(index)
+            ret, frame = self.camera.retrieve(buffer) if buffer is not None else self.camera.retrieve()
+            
+            if not ret:
+                pool.release(index)
+                print("❌ Ошибка чтения кадра с камеры")
+                break
+            
+            pool.publish(index, frame)
             
             # Вызов callback функции если задана
             if self.frame_callback:
@@ -344,13 +618,38 @@ class CameraHandler:
                     self.frame_callback(frame)
                 except Exception as e:
                     print(f"❌ Ошибка в callback: {e}")
-            
-            # Ограничение FPS
-            time.sleep(1.0 / self.config.camera_fps)
     
     def get_current_frame(self) -> Optional[np.ndarray]:
-        """Получение текущего кадра"""
-        return self.current_frame
+        """Получение копии текущего кадра (буфер пула будет переиспользован)"""
+        with self._frame_pool.borrow() as frame:
+            return frame.copy() if frame is not None else None
+    
+    def borrow_current_frame(self):
+        """Текущий кадр без копирования: with camera.borrow_current_frame() as frame"""
+        return self._frame_pool.borrow()
+    
+    def get_encoded_frame(self) -> Optional[Tuple[bytes, int]]:
+        """
+        JPEG текущего кадра и его версия
+        
+        Каждый кадр кодируется один раз: остальные клиенты получают готовые
+        байты из кэша. Без зрителей кодирование не выполняется вовсе.
+        """
+        with self._encode_lock:
+            version = self._frame_pool.version
+            encoded = self._encoded_frame
+            if encoded is not None and encoded[1] == version:
+                return encoded
+            
+            with self._frame_pool.borrow() as frame:
+                if frame is None:
+                    return None
+                ok, buffer = cv2.imencode('.jpg', frame, self._encode_params)
+            if not ok:
+                return None
+            
+            self._encoded_frame = (buffer.tobytes(), version)
+            return self._encoded_frame
     
     def release(self):
         """Освобождение ресурсов камеры"""
@@ -362,31 +661,65 @@ class CameraHandler:
 class VisionHandler:
     """Основной класс для работы с vision модулем"""
     
+    # Маппинг подтвержденных жестов на текст
+    _GESTURE_TEXT_MAP = MappingProxyType({
+        'open_palm': 'Привет',
+        'victory': 'Победа',
+        'thumb_up': 'Супер',
+        'pointing_up': 'Внимание'
+    })
+    
     def __init__(self, config_path: Optional[str] = None):
         self.config = VisionConfig(config_path)
+        
+        # OpenCV здесь только уменьшает и конвертирует кадры, основная работа - инференс
+        # MediaPipe со своим пулом потоков. Пул OpenCV на все ядра лишь конкурирует с ним
+        cv2.setNumThreads(max(1, (os.cpu_count() or 4) // 4))
+        
         self.camera_handler = CameraHandler(self.config)
         self.gesture_recognizer = MediaPipeGestureRecognizer(self.config)
         
+        # Параметры анализа, читаемые на каждом кадре, - в атрибутах объекта
+        self._confirmation_time = self.config.gesture_confirmation_time
+        self._inactivity_timeout = self.config.gesture_inactivity_timeout
+        self._gesture_recognition = self.config.gesture_recognition
+        
         # Состояние
         self.is_vision_active = False
         self.is_paused = False  # Флаг паузы (не останавливаем камеру, просто не обрабатываем)
         self.last_analysis_time = 0
-        self.analysis_results = []
+        self.analysis_results: "deque[Dict[str, Any]]" = deque(maxlen=20)  # Последние 20 результатов
         self.current_gestures = []
         
         # Логика подтверждения жестов
-        self.gesture_buffer = []  # Буфер жестов за последние N секунд
+        self.gesture_buffer: "deque[Dict[str, Any]]" = deque()  # Буфер жестов за последние N секунд
+        self._gesture_counter: Counter = Counter()  # Число жестов каждого типа в буфере
         self.last_gesture_time = time.time()  # Время последнего распознанного жеста
         self.last_confirmed_gesture = None  # Последний подтверждённый жест
         self.gesture_callback = None  # Callback для отправки жеста
         
+        # Лог жестов: поток анализа только кладет жест в очередь, вывод в консоль
+        # (форматирование + запись) выполняет отдельный фоновый поток
+        self._log_q: "deque[Dict[str, Any]]" = deque(maxlen=256)
+        self._log_stop = threading.Event()
+        self._log_thread = threading.Thread(target=self._drain_log, name='vision-log', daemon=True)
+        self._log_thread.start()
+        
         print("👁️  Vision модуль инициализирован")
         self.print_status()
     
+    def prewarm(self):
+        """Прогрев распознавателя жестов (можно выполнять параллельно с загрузкой LLM)"""
+        try:
+            self.gesture_recognizer.warmup(self.config.camera_resolution)
+        except Exception as e:
+            print(f"⚠️  Прогрев MediaPipe не удался: {e}")
+    
     def print_status(self):
         """Вывод статуса vision модуля"""
         print(f"📹 Камера: {'✅' if self.camera_handler.camera else '❌'}")
-        print(f"🤖 MediaPipe Tasks: {'✅' if self.gesture_recognizer.recognizer else '❌'}")
+        recognizer = self.gesture_recognizer
+        print(f"🤖 MediaPipe Tasks: {f'✅ ({recognizer.delegate})' if recognizer.recognizer else '❌'}")
         print(f"👋 Детекция жестов: {'✅' if self.config.gesture_recognition else '❌'}")
         
         if not self.gesture_recognizer.recognizer:
@@ -397,37 +730,23 @@ class VisionHandler:
         """Установка callback функции для подтверждённых жестов"""
         self.gesture_callback = callback
     
+    def _clear_gesture_buffer(self):
+        """Очистка буфера жестов вместе со счетчиком"""
+        self.gesture_buffer.clear()
+        self._gesture_counter.clear()
+    
     def _check_gesture_confirmation(self):
         """Проверка подтверждения жеста на основе буфера"""
-        if not self.gesture_buffer:
-            return
-        
-        # Подсчёт жестов по типу в буфере
-        gesture_counts = {}
-        for gesture in self.gesture_buffer:
-            gesture_type = gesture['type']  # Исправлено: 'type' вместо 'gesture'
-            if gesture_type not in gesture_counts:
-                gesture_counts[gesture_type] = 0
-            gesture_counts[gesture_type] += 1
-        
-        # Находим самый частый жест
-        if gesture_counts:
-            most_common_gesture = max(gesture_counts, key=gesture_counts.get)
-            count = gesture_counts[most_common_gesture]
+        # Счетчик жестов по типу ведется при добавлении и удалении из буфера
+        if self._gesture_counter:
+            # Находим самый частый жест
+            most_common_gesture, count = self._gesture_counter.most_common(1)[0]
             
             # Если жест появился достаточно раз (минимум 3 раза за 1.5 секунды при 16fps = ~24 кадра)
             # И это не тот же жест что недавно подтверждали (чтобы избежать дубликатов)
             if count >= 3 and most_common_gesture != self.last_confirmed_gesture:
-                # Маппинг жестов на текст
-                gesture_text_map = {
-                    'open_palm': 'Привет',
-                    'victory': 'Победа',
-                    'thumb_up': 'Супер',
-                    'pointing_up': 'Внимание'
-                }
-                
-                if most_common_gesture in gesture_text_map:
-                    confirmed_text = gesture_text_map[most_common_gesture]
+                confirmed_text = self._GESTURE_TEXT_MAP.get(most_common_gesture)
+                if confirmed_text is not None:
                     print(f"✅ Подтверждён жест: {most_common_gesture} → '{confirmed_text}'")
                     
                     # Обновляем последний подтверждённый жест
@@ -438,7 +757,7 @@ class VisionHandler:
                         self.gesture_callback(confirmed_text)
                     
                     # Очищаем буфер после подтверждения
-                    self.gesture_buffer = []
+                    self._clear_gesture_buffer()
     
     def start_real_time_analysis(self, gesture_callback=None):
         """Запуск анализа в реальном времени"""
@@ -460,7 +779,7 @@ class VisionHandler:
                 self.gesture_callback = gesture_callback
             
             # Сброс состояния
-            self.gesture_buffer = []
+            self._clear_gesture_buffer()
             self.last_gesture_time = time.time()
             self.last_confirmed_gesture = None
             
@@ -488,7 +807,7 @@ class VisionHandler:
         if self.is_vision_active:
             self.is_paused = False
             self.last_gesture_time = time.time()  # Сброс таймера
-            self.gesture_buffer = []  # Очистка буфера
+            self._clear_gesture_buffer()
             print("▶️ Анализ жестов возобновлён")
         else:
             print("⚠️ Анализ не был запущен, используйте start_real_time_analysis()")
@@ -515,15 +834,16 @@ class VisionHandler:
                 return
             
             # Проверка таймаута бездействия
-            if current_time - self.last_gesture_time > self.config.gesture_inactivity_timeout:
-                print(f"⏰ Таймаут бездействия ({self.config.gesture_inactivity_timeout} сек) - останавливаем распознавание жестов")
+            if current_time - self.last_gesture_time > self._inactivity_timeout:
+                print(f"⏰ Таймаут бездействия ({self._inactivity_timeout} сек) - останавливаем распознавание жестов")
                 self.stop_real_time_analysis()
                 return
             
             # Детекция жестов
             gestures = []
-            if self.config.gesture_recognition and self.gesture_recognizer.recognizer:
-                gestures = self.gesture_recognizer.detect_hand_gestures(frame)
+            recognizer = self.gesture_recognizer
+            if self._gesture_recognition and recognizer.recognizer:
+                gestures = recognizer.detect_hand_gestures(frame)
             
             # Обновление текущих жестов
             self.current_gestures = gestures
@@ -537,15 +857,18 @@ class VisionHandler:
                 for gesture in gestures:
                     gesture['detected_at'] = current_time
                     self.gesture_buffer.append(gesture)
-                    
-                    description = self.gesture_recognizer.get_gesture_description(gesture)
-                    print(f"👋 {description}")
+                    self._gesture_counter[gesture['type']] += 1
+                    self._log_q.append(gesture)
                 
-                # Очищаем старые жесты из буфера (старше чем confirmation_time)
-                self.gesture_buffer = [
-                    g for g in self.gesture_buffer 
-                    if current_time - g['detected_at'] <= self.config.gesture_confirmation_time
-                ]
+                # Очищаем старые жесты из буфера (старше чем confirmation_time).
+                # Жесты добавляются по времени, поэтому устаревшие всегда в начале
+                buffer = self.gesture_buffer
+                confirmation_time = self._confirmation_time
+                while buffer and current_time - buffer[0]['detected_at'] > confirmation_time:
+                    expired_type = buffer.popleft()['type']
+                    self._gesture_counter[expired_type] -= 1
+                    if not self._gesture_counter[expired_type]:
+                        del self._gesture_counter[expired_type]
                 
                 # Проверяем подтверждение жеста
                 self._check_gesture_confirmation()
@@ -557,11 +880,7 @@ class VisionHandler:
                     'frame_shape': frame.shape
                 }
                 
-                self.analysis_results.append(result)
-                
-                # Ограничение размера истории
-                if len(self.analysis_results) > 20:
-                    self.analysis_results.pop(0)
+                self.analysis_results.append(result)  # deque(maxlen) сам вытесняет старые
             
         except Exception as e:
             print(f"❌ Ошибка анализа кадра: {e}")
@@ -574,18 +893,19 @@ class VisionHandler:
     
     def get_recent_analysis(self, count: int = 5) -> List[Dict[str, Any]]:
         """Получение последних результатов анализа"""
-        return self.analysis_results[-count:] if self.analysis_results else []
+        return list(self.analysis_results)[-count:]
     
     def analyze_single_frame(self, prompt: str = "Анализ жестов") -> str:
         """Анализ одиночного кадра"""
-        frame = self.camera_handler.get_current_frame()
-        if frame is None:
-            return "Кадр недоступен"
-        
-        if self.gesture_recognizer.recognizer is None:
-            return "MediaPipe Tasks недоступен"
-        
-        gestures = self.gesture_recognizer.detect_hand_gestures(frame)
+        # Кадр берется из пула по ссылке, без копирования
+        with self.camera_handler.borrow_current_frame() as frame:
+            if frame is None:
+                return "Кадр недоступен"
+            
+            if self.gesture_recognizer.recognizer is None:
+                return "MediaPipe Tasks недоступен"
+            
+            gestures = self.gesture_recognizer.detect_hand_gestures(frame, wait=True)
         
         if not gestures:
             return "Жесты не обнаружены"
@@ -605,31 +925,45 @@ class VisionHandler:
         """Проверка доступности MediaPipe Tasks"""
         return self.gesture_recognizer.recognizer is not None
     
+    @staticmethod
+    def _probe_camera(index: int) -> Optional[Tuple[int, int, int, float]]:
+        """Проверка камеры: (индекс, ширина, высота, fps) или None"""
+        cap = cv2.VideoCapture(index)
+        try:
+            if not cap.isOpened():
+                return None
+            # Проверяем, можем ли получить кадр
+            ret, frame = cap.read()
+            if not ret or frame is None:
+                return None
+            return (index, int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                    int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), cap.get(cv2.CAP_PROP_FPS))
+        finally:
+            cap.release()
+    
     def list_cameras(self) -> List[int]:
-        """Получение списка доступных камер"""
-        available_cameras = []
+        """
+        Получение списка доступных камер
+        
+        Открытие устройства (особенно DirectShow) ждет драйвер до секунды и больше,
+        поэтому индексы 0-10 проверяются параллельно: время поиска равно самой
+        медленной проверке, а не их сумме. cv2 отпускает GIL на время ожидания.
+        """
         print("📹 Поиск доступных камер...")
         
-        # Проверяем камеры от 0 до 10
-        for i in range(11):
+        def probe(index: int):
             try:
-                cap = cv2.VideoCapture(i)
-                if cap.isOpened():
-                    # Проверяем, можем ли получить кадр
-                    ret, frame = cap.read()
-                    if ret and frame is not None:
-                        available_cameras.append(i)
-                        
-                        # Получаем информацию о камере
-                        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                        fps = cap.get(cv2.CAP_PROP_FPS)
-                        
-                        print(f"   ✓ Камера {i}: {width}x{height} @ {fps:.1f}fps")
-                    
-                cap.release()
+                return self._probe_camera(index)
             except Exception:
-                continue
+                return None
+        
+        with ThreadPoolExecutor(max_workers=11, thread_name_prefix='camera-probe') as executor:
+            results = [result for result in executor.map(probe, range(11)) if result is not None]
+        
+        available_cameras = []
+        for index, width, height, fps in results:  # map сохраняет порядок индексов
+            available_cameras.append(index)
+            print(f"   ✓ Камера {index}: {width}x{height} @ {fps:.1f}fps")
         
         if available_cameras:
             print(f"📹 Найдено камер: {len(available_cameras)} - {available_cameras}")
@@ -677,12 +1011,33 @@ class VisionHandler:
         return self.list_cameras()
     
     def get_current_frame(self) -> Optional[np.ndarray]:
-        """Получение текущего кадра с камеры"""
+        """Получение копии текущего кадра с камеры"""
         return self.camera_handler.get_current_frame()
     
+    def borrow_current_frame(self):
+        """Текущий кадр без копирования (только чтение): with vision.borrow_current_frame() as frame"""
+        return self.camera_handler.borrow_current_frame()
+    
+    def get_encoded_frame(self) -> Optional[Tuple[bytes, int]]:
+        """JPEG текущего кадра и его версия (общий для всех клиентов)"""
+        return self.camera_handler.get_encoded_frame()
+    
+    def _drain_log(self):
+        """Фоновый вывод лога жестов пачками раз в 100 мс"""
+        while not self._log_stop.wait(0.1):
+            if not self._log_q:
+                continue
+            lines = []
+            while self._log_q:
+                gesture = self._log_q.popleft()
+                lines.append(f"👋 {self.gesture_recognizer.get_gesture_description(gesture)}\n")
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+    
     def cleanup(self):
         """Очистка ресурсов"""
         self.stop_real_time_analysis()
+        self._log_stop.set()
         self.camera_handler.release()
         self.gesture_recognizer.close()
 
@@ -4,46 +4,209 @@ Flask Web Application для AI-консультанта Транснефть
 """
 
 from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+import base64
 import json
+import queue
+import re
 import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 import sys
 
 # Добавляем путь к main.py
 sys.path.insert(0, str(Path(__file__).parent))
 
-from main import ThinkingLLM, LLMConfig
+try:
+    import orjson  # Опционально: быстрое кодирование событий SSE
+except ImportError:
+    orjson = None
+
+try:
+    from flask_compress import Compress  # Опционально: сжатие JSON/HTML/статики
+except ImportError:
+    Compress = None
+
+from main import ThinkingLLM, LLMConfig, configure_console_output
 from audio_handler import AudioHandler
 from vision_handler import VisionHandler
 from chat_logger import ChatLogger
 
+class JSONProvider(DefaultJSONProvider):
+    """jsonify без сортировки ключей и без экранирования кириллицы в \\uXXXX"""
+    ensure_ascii = False
+    sort_keys = False
+
+
 app = Flask(__name__)
+app.json = JSONProvider(app)
 app.config['SECRET_KEY'] = 'transneft-ai-consultant-2025'
 
+if Compress is not None:
+    # SSE и MJPEG не сжимаем: gzip копит данные в буфере и задерживает события,
+    # а JPEG уже сжат
+    app.config['COMPRESS_MIMETYPES'] = [
+        'application/json', 'text/html', 'text/css', 'application/javascript'
+    ]
+    app.config['COMPRESS_STREAMS'] = False
+    Compress(app)
+
 # Инициализация конфигурации и компонентов
 config = LLMConfig()  # Используем конфиг по умолчанию
-llm = ThinkingLLM(config)
+
+# Модель загружается один раз на процесс и только при первом обращении:
+# импорт web_app (например, воркером WSGI-сервера) не тянет веса за собой
+_llm: Optional[ThinkingLLM] = None
+_llm_lock = threading.Lock()
+
+def get_llm() -> ThinkingLLM:
+    """Единственный экземпляр ThinkingLLM процесса"""
+    global _llm
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                _llm = ThinkingLLM(config)
+    return _llm
+
 audio_handler = AudioHandler()
 vision_handler = VisionHandler()
 
 # Инициализация логгера для web-сессии
 chat_logger = ChatLogger(session_name="web_session")
 
-# Глобальное хранилище для распознанного текста
-recognized_text_queue = []
-gesture_text_queue = []
+# Генерация выполняется одним фоновым исполнителем: модель все равно обрабатывает
+# запросы по очереди, а потоки Flask только пересылают готовые фрагменты в SSE
+llm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='llm')
+
+# Очистка текста перед озвучкой: шаблоны компилируются один раз при загрузке
+_EMOJI_RE = re.compile(r'[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F700-\U0001F77F\U0001F780-\U0001F7FF\U0001F800-\U0001F8FF\U0001F900-\U0001F9FF\U0001FA00-\U0001FA6F\U0001FA70-\U0001FAFF\U00002702-\U000027B0\U000024C2-\U0001F251]+')
+_EXCLAMATIONS_RE = re.compile(r'!+')
+_QUESTIONS_RE = re.compile(r'\?+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+@lru_cache(maxsize=256)
+def clean_tts_text(text: str) -> str:
+    """
+    Очистка текста перед озвучкой (кэшируется: один и тот же ответ
+    часто озвучивается повторно)
+    """
+    # Удаляем эмодзи (Unicode диапазоны)
+    text = _EMOJI_RE.sub('', text)
+    # Удаляем множественные восклицательные знаки
+    text = _EXCLAMATIONS_RE.sub('.', text)
+    # Удаляем множественные вопросительные знаки
+    text = _QUESTIONS_RE.sub('?', text)
+    # Удаляем лишние пробелы
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+# Единый SSE-канал событий: у каждого подключенного клиента своя ограниченная
+# очередь, состояние микрофона/камеры перепроверяется каждые EVENT_STATUS_INTERVAL секунд
+EVENT_QUEUE_SIZE = 64
+EVENT_STATUS_INTERVAL = 1.0
+
+# SSE за обратным прокси (nginx и т.п.): запрещаем буферизацию и сжатие
+# посредниками, а комментарий keepalive не дает им закрыть тихое соединение
+SSE_KEEPALIVE_INTERVAL = 15.0
+SSE_KEEPALIVE = ": keepalive\n\n"
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache, no-transform',
+    'X-Accel-Buffering': 'no',
+}
+
+
+class EventQueue:
+    """
+    Ограниченная очередь событий одного клиента с блокирующим чтением.
+    Колбэки аудио/видео потоков кладут события, генератор SSE ждет их
+    с таймаутом, чтобы успевать проверять состояние источников.
+    Если клиент не успевает читать (например, вкладка в фоне), при
+    переполнении отбрасывается самое старое событие.
+    """
+
+    def __init__(self, maxlen: int = EVENT_QUEUE_SIZE):
+        self._items = deque(maxlen=maxlen)
+        self._ready = threading.Condition()
+
+    def put(self, item) -> bool:
+        """Добавление события; True, если ради него отброшено самое старое"""
+        with self._ready:
+            dropped = len(self._items) == self._items.maxlen
+            self._items.append(item)
+            self._ready.notify()
+        return dropped
+
+    def get(self, timeout: float):
+        """Извлечение события; None, если за timeout ничего не пришло"""
+        with self._ready:
+            if not self._items:
+                self._ready.wait(timeout)
+            return self._items.popleft() if self._items else None
+
+
+class EventBus:
+    """Рассылка событий всем клиентам, подключенным к /api/events"""
+
+    def __init__(self):
+        self._clients = set()
+        self._lock = threading.Lock()
+        self.dropped = 0  # Событий отброшено из-за переполнения очередей клиентов
+
+    def subscribe(self) -> EventQueue:
+        client = EventQueue()
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client: EventQueue):
+        with self._lock:
+            self._clients.discard(client)
+
+    def publish(self, event: str, payload: dict):
+        with self._lock:
+            clients = tuple(self._clients)
+        dropped = sum(client.put((event, payload)) for client in clients)
+        if dropped:
+            with self._lock:
+                self.dropped += dropped
+                total = self.dropped
+            print(f"⚠️ Очередь событий клиента переполнена, старые события отброшены (всего: {total})")
+
+
+event_bus = EventBus()
 
 def on_text_recognized_callback(text: str):
     """Callback для обработки распознанного текста"""
-    global recognized_text_queue
-    recognized_text_queue.append(text)
-    print(f"📝 Добавлен текст в очередь: {text}")
+    event_bus.publish('voice_text', {'text': text})
+    print(f"📝 Отправлен распознанный текст: {text}")
 
 def on_gesture_confirmed_callback(text: str):
     """Callback для обработки подтверждённых жестов"""
-    global gesture_text_queue
-    gesture_text_queue.append(text)
-    print(f"👋 Добавлен жест в очередь: {text}")
+    event_bus.publish('gesture_text', {'text': text})
+    print(f"👋 Отправлен жест: {text}")
+
+def sse_response(events) -> Response:
+    """Потоковый ответ text/event-stream с заголовками против буферизации"""
+    return Response(stream_with_context(events), headers=SSE_HEADERS,
+                    content_type='text/event-stream; charset=utf-8')
+
+def sse_event(payload: dict, event: Optional[str] = None) -> str:
+    """Событие SSE; кириллица передается как есть, без \\uXXXX"""
+    if orjson is not None:
+        data = orjson.dumps(payload).decode('utf-8')
+    else:
+        data = json.dumps(payload, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {data}\n\n"
+    return f"data: {data}\n\n"
+
+def is_camera_running() -> bool:
+    """Камера может быть остановлена по таймауту бездействия"""
+    capture_thread = vision_handler.camera_handler.capture_thread
+    return capture_thread is not None and capture_thread.is_alive()
 
 # Устанавливаем callback в audio_handler
 audio_handler._on_text_recognized = on_text_recognized_callback
@@ -76,46 +239,81 @@ def chat():
         vision_handler.pause_analysis()
     
     def generate():
-        """Генератор для streaming ответа"""
+        """Генератор для streaming ответа: фрагменты уходят клиенту по мере генерации"""
+        # Модель генерирует в отдельном потоке, колбэки складывают фрагменты в очередь
+        events = queue.SimpleQueue()
+        result = {}
+        
+        def run_generation():
+            try:
+                result.update(get_llm().generate_response(
+                    message,
+                    on_answer_text=lambda text: events.put(('answer', text)),
+                    on_thinking_text=lambda text: events.put(('thinking', text))
+                ))
+            except Exception as e:
+                # Например, не загрузилась модель: иначе исключение осталось бы в Future
+                events.put(('error', str(e)))
+            finally:
+                events.put(None)
+        
+        llm_executor.submit(run_generation)
+        
         try:
-            # Генерируем ответ
-            response_dict = llm.generate_response(message)
+            answer_parts = []  # Нужны только для сверки с итоговым ответом
+            thinking_streamed = False
+            failed = False
             
-            # Извлекаем thinking и answer из словаря
-            thinking_content = response_dict.get('thinking', '')
-            final_answer = response_dict.get('answer', '')
+            while True:
+                try:
+                    event = events.get(timeout=SSE_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    # Длинный промпт: до первого токена соединение не должно молчать
+                    yield SSE_KEEPALIVE
+                    continue
+                if event is None:
+                    break
+                kind, text = event
+                if kind == 'error':
+                    failed = True
+                    print(f"❌ Ошибка генерации ответа: {text}")
+                    chat_logger.log_error(f"Ошибка генерации ответа: {text}")
+                    yield sse_event({'type': 'error', 'content': text})
+                elif kind == 'thinking':
+                    thinking_streamed = True
+                    yield sse_event({'type': 'thinking_delta', 'content': text})
+                else:
+                    # Только новый фрагмент: клиент сам склеивает ответ
+                    answer_parts.append(text)
+                    yield sse_event({'type': 'answer_delta', 'content': text})
+            
+            if failed:
+                yield sse_event({'type': 'done'})
+                return
+            
+            # Извлекаем thinking и answer из итогового словаря
+            thinking_content = result.get('thinking', '')
+            final_answer = result.get('answer', '')
             
             # Логируем thinking и ответ
             chat_logger.log_assistant_thinking(thinking_content)
             chat_logger.log_assistant_answer(final_answer)
             
-            # Отправляем thinking
-            if thinking_content:
-                yield f"data: {json.dumps({'type': 'thinking', 'content': thinking_content})}\n\n"
-                time.sleep(0.1)
-            
-            # Отправляем ответ по предложениям
-            sentences = final_answer.split('. ')
-            accumulated = ""
-            
-            for i, sentence in enumerate(sentences):
-                if sentence.strip():
-                    accumulated += sentence
-                    if i < len(sentences) - 1:
-                        accumulated += '. '
-                    
-                    yield f"data: {json.dumps({'type': 'answer', 'content': accumulated})}\n\n"
-                    time.sleep(0.1)
+            # Ответ из кэша или сообщение об ошибке не проходят через колбэки
+            if thinking_content and not thinking_streamed:
+                yield sse_event({'type': 'thinking', 'content': thinking_content})
+            if final_answer and final_answer != ''.join(answer_parts).strip():
+                yield sse_event({'type': 'answer', 'content': final_answer})
             
             # Завершение
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+            yield sse_event({'type': 'done'})
         finally:
             # Возобновляем распознавание жестов после обработки
             if gesture_was_active:
                 print("▶️ Возобновляем распознавание жестов после обработки AI")
                 vision_handler.resume_analysis()
     
-    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+    return sse_response(generate())
 
 @app.route('/api/voice/start', methods=['POST'])
 def start_voice():
@@ -151,26 +349,46 @@ def resume_voice():
         print(f"❌ Ошибка возобновления голоса: {e}")
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
-@app.route('/api/voice/get-text', methods=['GET'])
-def get_recognized_text():
+@app.route('/api/events')
+def events():
     """
-    Получение распознанного текста из очереди (long polling)
-    Клиент периодически опрашивает этот endpoint
+    Единый SSE-канал событий для клиента (EventSource):
+    voice_text / gesture_text - распознанный текст и жесты,
+    voice_status / camera_status - включение и остановка микрофона и камеры
+    (в том числе по таймауту бездействия)
     """
-    global recognized_text_queue
+    def generate():
+        client = event_bus.subscribe()
+        voice_active = None
+        camera_active = None
+        last_sent = time.monotonic()
+        try:
+            while True:
+                # Сообщаем только об изменениях состояния
+                listening = bool(audio_handler.is_listening)
+                if listening != voice_active:
+                    voice_active = listening
+                    yield sse_event({'active': listening}, event='voice_status')
+                
+                running = is_camera_running()
+                if running != camera_active:
+                    camera_active = running
+                    yield sse_event({'active': running}, event='camera_status')
+                
+                item = client.get(timeout=EVENT_STATUS_INTERVAL)
+                if item is not None:
+                    event, payload = item
+                    yield sse_event(payload, event=event)
+                elif time.monotonic() - last_sent >= SSE_KEEPALIVE_INTERVAL:
+                    # Заодно запись в сокет обнаруживает отключившегося клиента
+                    yield SSE_KEEPALIVE
+                else:
+                    continue
+                last_sent = time.monotonic()
+        finally:
+            event_bus.unsubscribe(client)
     
-    try:
-        # Проверяем активна ли запись
-        if not audio_handler.is_listening:
-            return jsonify({'status': 'stopped', 'message': 'Запись остановлена'})
-        
-        if recognized_text_queue:
-            text = recognized_text_queue.pop(0)
-            return jsonify({'status': 'text_available', 'text': text})
-        else:
-            return jsonify({'status': 'no_text'})
-    except Exception as e:
-        return jsonify({'status': 'error', 'error': str(e)}), 500
+    return sse_response(generate())
 
 @app.route('/api/tts/speak', methods=['POST'])
 def speak_text():
@@ -186,15 +404,7 @@ def speak_text():
             return jsonify({'status': 'error', 'error': 'Пустой текст'}), 400
         
         # Очистка текста от эмодзи и лишних символов
-        import re
-        # Удаляем эмодзи (Unicode диапазоны)
-        text_cleaned = re.sub(r'[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F700-\U0001F77F\U0001F780-\U0001F7FF\U0001F800-\U0001F8FF\U0001F900-\U0001F9FF\U0001FA00-\U0001FA6F\U0001FA70-\U0001FAFF\U00002702-\U000027B0\U000024C2-\U0001F251]+', '', text)
-        # Удаляем множественные восклицательные знаки
-        text_cleaned = re.sub(r'!+', '.', text_cleaned)
-        # Удаляем множественные вопросительные знаки
-        text_cleaned = re.sub(r'\?+', '?', text_cleaned)
-        # Удаляем лишние пробелы
-        text_cleaned = re.sub(r'\s+', ' ', text_cleaned).strip()
+        text_cleaned = clean_tts_text(text)
         
         if not text_cleaned:
             return jsonify({'status': 'skipped', 'message': 'Текст состоит только из символов'})
@@ -210,28 +420,6 @@ def speak_text():
         print(f"❌ Ошибка озвучки: {e}")
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
-@app.route('/api/gesture/get-text', methods=['GET'])
-def get_gesture_text():
-    """
-    Получение распознанного текста из жестов (long polling)
-    Клиент периодически опрашивает этот endpoint
-    """
-    global gesture_text_queue
-    
-    try:
-        # Проверяем активна ли камера (может быть остановлена по таймауту)
-        camera_handler = vision_handler.camera_handler
-        if not camera_handler.capture_thread or not camera_handler.capture_thread.is_alive():
-            return jsonify({'status': 'stopped', 'message': 'Камера остановлена (таймаут 7 сек)'})
-        
-        if gesture_text_queue:
-            text = gesture_text_queue.pop(0)
-            return jsonify({'status': 'text_available', 'text': text})
-        else:
-            return jsonify({'status': 'no_text'})
-    except Exception as e:
-        return jsonify({'status': 'error', 'error': str(e)}), 500
-
 @app.route('/api/camera/start', methods=['POST'])
 def start_camera():
     """Запуск камеры и анализа жестов"""
@@ -258,34 +446,60 @@ def stop_camera():
 def get_camera_frame():
     """Получение кадра с камеры в формате base64"""
     try:
-        frame = vision_handler.get_current_frame()
-        if frame is not None:
-            # Конвертируем numpy array в JPEG
-            import cv2
-            import base64
-            _, buffer = cv2.imencode('.jpg', frame)
-            frame_base64 = base64.b64encode(buffer.tobytes()).decode('utf-8')
+        # JPEG берется из общего кэша: кадр кодируется один раз для всех клиентов
+        encoded = vision_handler.get_encoded_frame()
+        if encoded is not None:
+            jpeg, version = encoded
+            frame_base64 = base64.b64encode(jpeg).decode('utf-8')
             
             return jsonify({
                 'status': 'success',
                 'frame': frame_base64,
-                'format': 'base64_jpeg'
+                'format': 'base64_jpeg',
+                'version': version
             })
         return jsonify({'status': 'error', 'error': 'Нет кадра'}), 404
     except Exception as e:
         print(f"❌ Ошибка получения кадра: {e}")
         return jsonify({'status': 'error', 'error': str(e)}), 500
 
+@app.route('/api/camera/stream')
+def stream_camera():
+    """
+    Видеопоток камеры в формате MJPEG (multipart/x-mixed-replace)
+    Одно соединение вместо запроса на каждый кадр, JPEG без base64 и JSON:
+    <img src="/api/camera/stream">
+    """
+    frame_interval = vision_handler.config.frame_skip / max(1, vision_handler.config.camera_fps)
+    
+    def generate():
+        last_version = None
+        while is_camera_running():
+            # JPEG кодируется один раз на кадр и общий для всех зрителей
+            encoded = vision_handler.get_encoded_frame()
+            if encoded is not None and encoded[1] != last_version:
+                jpeg, last_version = encoded
+                yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+            time.sleep(frame_interval)
+    
+    return Response(generate(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
 @app.route('/api/reset', methods=['POST'])
 def reset_context():
     """Сброс контекста (истории диалога)"""
     try:
-        llm.clear_history()
+        if _llm is not None:  # Незагруженной модели нечего сбрасывать
+            _llm.clear_history()
         return jsonify({'status': 'success', 'message': 'Контекст сброшен'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
+    configure_console_output()
     print("🚀 Запуск Web-приложения AI-консультанта Транснефть...")
     print("📱 Откройте браузер: http://localhost:5000")
-    app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False)
+    get_llm()  # Загружаем модель до первого запроса
+    # Поток на запрос: long polling и SSE не блокируют остальные эндпоинты.
+    # gevent здесь не подходит - llama.cpp, MediaPipe и PyAudio держат
+    # нативные вызовы и остановили бы весь event loop
+    app.run(debug=False, host='0.0.0.0', port=5000, use_reloader=False, threaded=True)